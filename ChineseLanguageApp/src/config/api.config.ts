@@ -36,6 +36,8 @@ export const API_CONFIG = {
 
   ENDPOINTS: {
     CHAT: '/api/chat',
+    CHAT_STREAM: '/api/chat/stream',
+    SESSION: '/api/session',
     RANDOM_TOPIC: '/api/random-topic',
     HEALTH: '/api/health'
   },
@@ -14,6 +14,7 @@ interface AppState {
 // Action types
 type AppAction =
   | { type: 'ADD_MESSAGE'; payload: Message }
+  | { type: 'UPDATE_LAST_MESSAGE'; payload: Partial<Message> }
   | { type: 'SET_CORRECTION'; payload: Correction | null }
   | { type: 'SET_PROCESSING'; payload: boolean }
   | { type: 'TOGGLE_AUTO_SPEAK' }
@@ -46,6 +47,18 @@ function appReducer(state: AppState, action: AppAction): AppState {
         conversationHistory: [...state.conversationHistory, action.payload]
       };
 
+    case 'UPDATE_LAST_MESSAGE': {
+      if (state.conversationHistory.length === 0) {
+        return state;
+      }
+      const history = [...state.conversationHistory];
+      history[history.length - 1] = { ...history[history.length - 1], ...action.payload };
+      return {
+        ...state,
+        conversationHistory: history
+      };
+    }
+
     case 'SET_CORRECTION':
       return {
         ...state,
@@ -1,7 +1,8 @@
-import { useCallback } from 'react';
+import { useCallback, useRef } from 'react';
 import { useApp } from '../context/AppContext';
-import { chatAPI } from '../services/api';
+import { chatAPI, HTTPStatusError } from '../services/api';
 import { useTextToSpeech } from './useTextToSpeech';
+import { ChatStreamHandlers } from '../types/message.types';
 
 /**
  * Custom hook for conversation management
@@ -11,6 +12,36 @@ export const useConversation = () => {
   const { state, dispatch } = useApp();
   const { speak } = useTextToSpeech();
 
+  // Server-side session, so each turn only uploads the new message
+  const sessionIdRef = useRef<string | null>(null);
+
+  /**
+   * Return the current session id, creating (and seeding) a session if needed.
+   * Returns null if sessions are unavailable; the full history is sent instead.
+   */
+  const ensureSession = useCallback(async () => {
+    if (!sessionIdRef.current) {
+      try {
+        const session = await chatAPI.createSession(state.conversationHistory);
+        sessionIdRef.current = session.session_id;
+      } catch (error) {
+        console.warn('Could not create session, sending full history instead:', error);
+      }
+    }
+    return sessionIdRef.current;
+  }, [state.conversationHistory]);
+
+  /**
+   * Forget the current session; the next message starts a new one seeded
+   * from the local history.
+   */
+  const resetSession = useCallback(() => {
+    if (sessionIdRef.current) {
+      chatAPI.deleteSession(sessionIdRef.current).catch(() => {});
+      sessionIdRef.current = null;
+    }
+  }, []);
+
   /**
    * Send a message to the backend and handle response
    * @param message - User's message in Chinese
@@ -43,41 +74,69 @@ export const useConversation = () => {
       // Start processing
       dispatch({ type: 'SET_PROCESSING', payload: true });
 
-      try {
-        // Call backend API
-        const response = await chatAPI.sendMessage(
-          message,
-          state.conversationHistory
-        );
-
-        // Add AI response to conversation history
-        dispatch({
-          type: 'ADD_MESSAGE',
-          payload: {
-            sender: 'ai',
-            message: response.response,
-            translation: response.translation,
-            timestamp: new Date().toISOString()
+      // Stream the reply so it can be shown (and spoken) before the
+      // translation and correction have finished.
+      let replyShown = false;
+
+      const handlers: ChatStreamHandlers = {
+        onReply: (reply) => {
+          replyShown = true;
+          dispatch({
+            type: 'ADD_MESSAGE',
+            payload: {
+              sender: 'ai',
+              message: reply,
+              timestamp: new Date().toISOString()
+            }
+          });
+          dispatch({ type: 'SET_PROCESSING', payload: false });
+
+          // Auto-speak if enabled
+          if (state.autoSpeak && reply) {
+            speak(reply);
           }
-        });
-
-        // Show correction if present
-        if (response.correction) {
-          dispatch({ type: 'SET_CORRECTION', payload: response.correction });
+        },
+        onTranslation: (translation) => {
+          if (replyShown) {
+            dispatch({ type: 'UPDATE_LAST_MESSAGE', payload: { translation } });
+          }
+        },
+        onCorrection: (correction) => {
+          if (!correction) {
+            return;
+          }
+          dispatch({ type: 'SET_CORRECTION', payload: correction });
 
           // Auto-hide correction after 10 seconds
           setTimeout(() => {
             dispatch({ type: 'SET_CORRECTION', payload: null });
           }, 10000);
         }
+      };
 
-        // Auto-speak if enabled
-        if (state.autoSpeak && response.response) {
-          await speak(response.response);
+      try {
+        for (let attempt = 0; attempt < 2; attempt++) {
+          const sessionId = await ensureSession();
+          try {
+            await chatAPI.streamMessage(message, state.conversationHistory, handlers, sessionId);
+            break;
+          } catch (error) {
+            // Session expired or lives on another worker: recreate it and retry once
+            if (sessionId && error instanceof HTTPStatusError && error.status === 404 && attempt === 0) {
+              sessionIdRef.current = null;
+              continue;
+            }
+            throw error;
+          }
         }
       } catch (error) {
         console.error('Error sending message:', error);
 
+        if (replyShown) {
+          // The reply already arrived; only the enrichment failed.
+          return;
+        }
+
         // Add error message
         dispatch({
           type: 'ADD_MESSAGE',
@@ -92,7 +151,7 @@ export const useConversation = () => {
         dispatch({ type: 'SET_PROCESSING', payload: false });
       }
     },
-    [state.conversationHistory, state.isProcessing, state.autoSpeak, dispatch, speak]
+    [state.conversationHistory, state.isProcessing, state.autoSpeak, dispatch, speak, ensureSession]
   );
 
   /**
@@ -118,6 +177,10 @@ export const useConversation = () => {
         }
       });
 
+      // The server's session doesn't know about the topic; start a new one
+      // (seeded from local history) on the next message.
+      resetSession();
+
       // Auto-speak if enabled
       if (state.autoSpeak) {
         await speak(response.topic);
@@ -127,7 +190,7 @@ export const useConversation = () => {
     } finally {
       dispatch({ type: 'SET_PROCESSING', payload: false });
     }
-  }, [state.isProcessing, state.autoSpeak, dispatch, speak]);
+  }, [state.isProcessing, state.autoSpeak, dispatch, speak, resetSession]);
 
   /**
    * Repeat the last AI message
@@ -147,8 +210,9 @@ export const useConversation = () => {
    * Clear conversation history
    */
   const clearConversation = useCallback(() => {
+    resetSession();
     dispatch({ type: 'CLEAR_CONVERSATION' });
-  }, [dispatch]);
+  }, [dispatch, resetSession]);
 
   /**
    * Toggle auto-speak setting
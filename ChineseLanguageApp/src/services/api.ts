@@ -1,6 +1,6 @@
 import axios from 'axios';
 import { API_CONFIG } from '../config/api.config';
-import { Message, ChatAPIResponse, RandomTopicResponse } from '../types/message.types';
+import { Message, ChatAPIResponse, ChatStreamHandlers, RandomTopicResponse, SessionResponse } from '../types/message.types';
 
 // Create axios instance with default configuration
 const apiClient = axios.create({
@@ -11,30 +11,174 @@ const apiClient = axios.create({
   }
 });
 
+// Error carrying the HTTP status, so callers can detect an expired session (404)
+export class HTTPStatusError extends Error {
+  status: number;
+
+  constructor(status: number) {
+    super(`HTTP error! status: ${status}`);
+    this.status = status;
+  }
+}
+
+/**
+ * Request body for a chat turn: with a server-side session only the new
+ * message is sent, otherwise the full history is included.
+ */
+const chatBody = (message: string, conversationHistory: Message[], sessionId?: string | null) =>
+  sessionId
+    ? { message, session_id: sessionId }
+    : { message, conversation_history: conversationHistory };
+
 // API service for Chinese Language Learning app
 export const chatAPI = {
   /**
    * Send a message to the backend and get AI response
    * @param message - User's message in Chinese
    * @param conversationHistory - Previous conversation messages for context
+   * @param sessionId - Server-side session; when set the history is not sent
    * @returns AI response with translation and optional correction
    */
   sendMessage: async (
     message: string,
-    conversationHistory: Message[]
+    conversationHistory: Message[],
+    sessionId?: string | null
   ): Promise<ChatAPIResponse> => {
     try {
-      const response = await apiClient.post(API_CONFIG.ENDPOINTS.CHAT, {
-        message,
-        conversation_history: conversationHistory
-      });
+      const response = await apiClient.post(
+        API_CONFIG.ENDPOINTS.CHAT,
+        chatBody(message, conversationHistory, sessionId)
+      );
       return response.data;
-    } catch (error) {
+    } catch (error: any) {
       console.error('Error sending message:', error);
+      if (error?.response?.status) {
+        throw new HTTPStatusError(error.response.status);
+      }
       throw error;
     }
   },
 
+  /**
+   * Send a message and receive the reply as a Server-Sent Events stream.
+   * The reply is delivered as soon as it is generated; the translation and
+   * correction follow as separate events.
+   * @param message - User's message in Chinese
+   * @param conversationHistory - Previous conversation messages for context
+   * @param handlers - Callbacks for each stream event
+   * @param sessionId - Server-side session; when set the history is not sent
+   * @returns The full response once the stream has finished
+   */
+  streamMessage: (
+    message: string,
+    conversationHistory: Message[],
+    handlers: ChatStreamHandlers = {},
+    sessionId?: string | null
+  ): Promise<ChatAPIResponse> => {
+    return new Promise((resolve, reject) => {
+      // XMLHttpRequest exposes partial responseText in React Native,
+      // which axios and fetch do not.
+      const xhr = new XMLHttpRequest();
+      const result: ChatAPIResponse = { response: '' };
+      let parsedLength = 0;
+
+      const handleEvent = (event: string, data: any) => {
+        switch (event) {
+          case 'reply':
+            handlers.onReplyDelta?.(data.delta);
+            break;
+          case 'reply_done':
+            result.response = data.response;
+            handlers.onReply?.(data.response);
+            break;
+          case 'translation':
+            result.translation = data.translation;
+            handlers.onTranslation?.(data.translation);
+            break;
+          case 'correction':
+            result.correction = data.correction || undefined;
+            handlers.onCorrection?.(data.correction);
+            break;
+          case 'error':
+            throw new Error(data.error);
+        }
+      };
+
+      const parseAvailable = () => {
+        let boundary;
+        while ((boundary = xhr.responseText.indexOf('\n\n', parsedLength)) !== -1) {
+          const block = xhr.responseText.slice(parsedLength, boundary);
+          parsedLength = boundary + 2;
+
+          let event = 'message';
+          const dataLines: string[] = [];
+          block.split('\n').forEach((line) => {
+            if (line.startsWith('event:')) event = line.slice(6).trim();
+            else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+          });
+          if (dataLines.length) {
+            handleEvent(event, JSON.parse(dataLines.join('\n')));
+          }
+        }
+      };
+
+      xhr.open('POST', API_CONFIG.BASE_URL + API_CONFIG.ENDPOINTS.CHAT_STREAM);
+      xhr.setRequestHeader('Content-Type', 'application/json');
+      xhr.setRequestHeader('Accept', 'text/event-stream');
+      xhr.timeout = API_CONFIG.TIMEOUT;
+
+      xhr.onprogress = () => {
+        try {
+          parseAvailable();
+        } catch (error) {
+          xhr.abort();
+          reject(error);
+        }
+      };
+      xhr.onload = () => {
+        if (xhr.status !== 200) {
+          reject(new HTTPStatusError(xhr.status));
+          return;
+        }
+        try {
+          parseAvailable();
+        } catch (error) {
+          reject(error);
+          return;
+        }
+        if (!result.response) {
+          reject(new Error('Stream ended before the reply was complete'));
+          return;
+        }
+        resolve(result);
+      };
+      xhr.onerror = () => reject(new Error('Network error while streaming message'));
+      xhr.ontimeout = () => reject(new Error('Timed out while streaming message'));
+
+      xhr.send(JSON.stringify(chatBody(message, conversationHistory, sessionId)));
+    });
+  },
+
+  /**
+   * Create a server-side conversation session
+   * @param conversationHistory - Optional history to seed the session with
+   * @returns The new session id and its limits
+   */
+  createSession: async (conversationHistory: Message[] = []): Promise<SessionResponse> => {
+    const response = await apiClient.post(API_CONFIG.ENDPOINTS.SESSION, {
+      conversation_history: conversationHistory
+    });
+    return response.data;
+  },
+
+  /**
+   * Delete a server-side conversation session
+   * @param sessionId - Session to delete
+   */
+  deleteSession: async (sessionId: string): Promise<void> => {
+    await apiClient.delete(`${API_CONFIG.ENDPOINTS.SESSION}/${sessionId}`);
+  },
+
   /**
    * Get a random conversation topic from the backend
    * @returns Random topic suggestion in Chinese
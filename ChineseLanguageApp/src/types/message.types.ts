@@ -16,6 +16,22 @@ export interface ChatAPIResponse {
   response: string;
   translation?: string;
   correction?: Correction;
+  mode?: 'pipeline' | 'fused';
+  session_id?: string;
+}
+
+export interface SessionResponse {
+  session_id: string;
+  max_messages: number;
+  idle_timeout: number;
+}
+
+// Callbacks for the Server-Sent Events emitted by /api/chat/stream
+export interface ChatStreamHandlers {
+  onReplyDelta?: (delta: string) => void;
+  onReply?: (response: string) => void;
+  onTranslation?: (translation: string) => void;
+  onCorrection?: (correction: Correction | null) => void;
 }
 
 export interface RandomTopicResponse {
@@ -0,0 +1,323 @@
+"""Admission control for Azure OpenAI calls.
+
+Azure deployments are limited in requests per minute (RPM) and tokens per
+minute (TPM). Every upstream call takes one request and its estimated
+tokens (prompt estimate plus max_tokens) from a pair of token buckets
+before it is sent. When the buckets are empty, callers wait in a bounded
+priority queue, so chat replies go out before translations and topic
+generation goes last. When the queue is full, a newcomer takes the place
+of the newest waiter of a lower priority, which fails; if nothing lower
+is queued, the newcomer fails. Failed calls, and callers that have waited
+longer than max_wait, get UpstreamOverloaded, which the routes turn into
+a 429 with a Retry-After header.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import math
+import threading
+import time
+
+from context_builder import MESSAGE_OVERHEAD_TOKENS, estimate_tokens
+
+# Lower goes first
+PRIORITIES = {
+    "chat": 0,
+    "correction": 1,
+    "interjection": 1,
+    "translation": 1,
+    "summary": 2,
+    "topic": 2
+}
+LOWEST_PRIORITY = max(PRIORITIES.values())
+# Calls made inside background(): work no request is waiting for
+BACKGROUND_PRIORITY = LOWEST_PRIORITY + 1
+
+_background = contextvars.ContextVar("admission_background", default=False)
+
+
+@contextlib.contextmanager
+def background():
+    """Queue the calls made in this block (and tasks copying its context) behind all others"""
+    token = _background.set(True)
+    try:
+        yield
+    finally:
+        _background.reset(token)
+
+
+class UpstreamOverloaded(Exception):
+    """Raised when a call cannot be admitted; retry_after is in seconds"""
+
+    def __init__(self, retry_after, reason="queue_full"):
+        super().__init__(f"Upstream capacity exhausted ({reason}), retry after {retry_after}s")
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+def estimate_request_tokens(params):
+    """Tokens a completion may use: estimated prompt plus max_tokens"""
+    prompt = sum(
+        estimate_tokens(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS
+        for message in params.get("messages", [])
+    )
+    return prompt + params.get("max_tokens", 0)
+
+
+def retry_after_from(error, default=1):
+    """Seconds to wait according to an Azure 429 response's headers"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return max(1, math.ceil(float(headers["retry-after-ms"]) / 1000))
+        if headers.get("retry-after"):
+            return max(1, math.ceil(float(headers["retry-after"])))
+    except ValueError:
+        pass
+    return default
+
+
+class TokenBucket:
+    """Continuously refilled bucket. A rate of 0 means unlimited. Not thread-safe."""
+
+    def __init__(self, per_minute, burst_seconds=10):
+        self.per_minute = per_minute
+        # Azure enforces its limits over short windows, so only allow a burst
+        # of a few seconds' worth rather than the whole minute at once
+        self.capacity = max(1.0, per_minute * burst_seconds / 60)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def time_for(self, amount, now):
+        """Seconds until amount is available (0 if it is now)"""
+        if not self.per_minute:
+            return 0.0
+        self._refill(now)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60 / self.per_minute
+
+    def wait_time(self, amount, now):
+        # A call bigger than the bucket waits for a full bucket and takes it all
+        return self.time_for(min(amount, self.capacity), now)
+
+    def take(self, amount):
+        if self.per_minute:
+            self.level -= min(amount, self.capacity)
+
+    def give_back(self, amount):
+        if self.per_minute:
+            self.level = min(self.capacity, self.level + amount)
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "tokens", "notify", "granted", "evicted")
+
+    def __init__(self, priority, seq, tokens, notify):
+        self.priority = priority
+        self.seq = seq
+        self.tokens = tokens
+        self.notify = notify
+        self.granted = False
+        # Retry-After for a waiter pushed out of a full queue
+        self.evicted = None
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AdmissionController:
+    """RPM/TPM token buckets in front of Azure, with a bounded priority wait queue"""
+
+    # How often queued callers re-check the buckets when nothing wakes them
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, rpm=0, tpm=0, max_queue=100, max_wait=10.0, burst_seconds=10):
+        self.requests = TokenBucket(rpm, burst_seconds)
+        self.tokens = TokenBucket(tpm, burst_seconds)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self._queue = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+        self.admitted = 0
+        self.delayed = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.evicted = 0
+        self.tokens_refunded = 0
+
+    def acquire(self, task, tokens):
+        """Block until a call of this task and token estimate may be sent"""
+        event = threading.Event()
+        waiter = self._enqueue(task, tokens, event.set)
+        if waiter is None:
+            return
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            delay = self._dispatch()
+            if waiter.granted:
+                return
+            if waiter.evicted is not None:
+                raise UpstreamOverloaded(waiter.evicted, "queue_full")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._give_up(waiter)
+                return
+            event.wait(min(delay, remaining))
+
+    async def acquire_async(self, task, tokens):
+        """acquire() for coroutines; waits without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = self._enqueue(task, tokens, lambda: loop.call_soon_threadsafe(_resolve, future))
+        if waiter is None:
+            return
+        deadline = time.monotonic() + self.max_wait
+        try:
+            while True:
+                delay = self._dispatch()
+                if waiter.granted:
+                    return
+                if waiter.evicted is not None:
+                    raise UpstreamOverloaded(waiter.evicted, "queue_full")
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._give_up(waiter)
+                    return
+                try:
+                    await asyncio.wait_for(asyncio.shield(future), min(delay, remaining))
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            self._remove(waiter)
+            raise
+
+    def try_acquire(self, task, tokens):
+        """Admit a call only if it can go out right away; never queues.
+
+        For speculative calls such as hedges, which are worth sending only
+        while there is spare capacity.
+        """
+        with self._lock:
+            if self._queue or self._wait_time(tokens, time.monotonic()) > 0:
+                return False
+            self._take(tokens)
+            return True
+
+    def settle(self, estimated, actual):
+        """Return the unused part of a call's token estimate once its usage is known"""
+        unused = estimated - actual
+        if unused <= 0 or not self.tokens.per_minute:
+            return
+        with self._lock:
+            self.tokens.give_back(unused)
+            self.tokens_refunded += unused
+
+    def _enqueue(self, task, tokens, notify):
+        """Admit the call now (returns None) or queue it. Raises when the queue is full."""
+        with self._lock:
+            now = time.monotonic()
+            if not self._queue and self._wait_time(tokens, now) == 0:
+                self._take(tokens)
+                return None
+            priority = BACKGROUND_PRIORITY if _background.get() else PRIORITIES.get(task, LOWEST_PRIORITY)
+            waiter = _Waiter(priority, next(self._seq), tokens, notify)
+            if len(self._queue) >= self.max_queue:
+                # The waiter that would go out last; it makes room if it is
+                # of a lower priority than the newcomer
+                worst = max(self._queue) if self._queue else None
+                if worst is None or worst.priority <= priority:
+                    self.rejected_queue_full += 1
+                    raise UpstreamOverloaded(self._retry_after(tokens, now), "queue_full")
+                self._queue.remove(worst)
+                heapq.heapify(self._queue)
+                worst.evicted = self._retry_after(worst.tokens, now)
+                worst.notify()
+                self.evicted += 1
+            heapq.heappush(self._queue, waiter)
+            self.delayed += 1
+            return waiter
+
+    def _dispatch(self):
+        """Admit queued calls in priority order while capacity lasts.
+
+        Returns how long to wait before checking again.
+        """
+        with self._lock:
+            now = time.monotonic()
+            while self._queue:
+                head = self._queue[0]
+                wait = self._wait_time(head.tokens, now)
+                if wait > 0:
+                    return max(wait, self.POLL_INTERVAL)
+                heapq.heappop(self._queue)
+                self._take(head.tokens)
+                head.granted = True
+                head.notify()
+            return self.POLL_INTERVAL
+
+    def _remove(self, waiter):
+        """Take a waiter out of the queue. Returns False if it was already admitted or evicted."""
+        with self._lock:
+            if waiter.granted or waiter.evicted is not None:
+                return False
+            self._queue.remove(waiter)
+            heapq.heapify(self._queue)
+            return True
+
+    def _give_up(self, waiter):
+        if not self._remove(waiter):
+            if waiter.evicted is not None:
+                raise UpstreamOverloaded(waiter.evicted, "queue_full")
+            return
+        with self._lock:
+            self.rejected_timeout += 1
+            retry_after = self._retry_after(waiter.tokens, time.monotonic())
+        raise UpstreamOverloaded(retry_after, "timeout")
+
+    def _wait_time(self, tokens, now):
+        return max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+
+    def _take(self, tokens):
+        self.requests.take(1)
+        self.tokens.take(tokens)
+        self.admitted += 1
+
+    def _retry_after(self, tokens, now):
+        # Time for everything queued, plus this call, to get through the buckets
+        queued_tokens = tokens + sum(waiter.tokens for waiter in self._queue)
+        wait = max(
+            self.requests.time_for(len(self._queue) + 1, now),
+            self.tokens.time_for(queued_tokens, now)
+        )
+        return max(1, math.ceil(wait))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rpm": self.requests.per_minute,
+                "tpm": self.tokens.per_minute,
+                "queued": len(self._queue),
+                "max_queue": self.max_queue,
+                "admitted": self.admitted,
+                "delayed": self.delayed,
+                "rejected_queue_full": self.rejected_queue_full,
+                "rejected_timeout": self.rejected_timeout,
+                "evicted": self.evicted,
+                "tokens_refunded": self.tokens_refunded
+            }
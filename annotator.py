@@ -0,0 +1,308 @@
+"""Word segmentation and pinyin for Chinese text, without Azure.
+
+data/pinyin.bin is a dictionary of about 150,000 words, each with a
+frequency and its reading, compiled from the jieba word list and the
+pypinyin readings (both MIT licensed). It is memory-mapped; entries are
+grouped by first character, and a sorted index of first characters says
+where each group lives:
+
+    header   b"PYD1"  uint32 syllables  uint32 groups  uint64 total frequency
+    syllables  uint32 length, then the toned syllables joined by "\\n"
+    index    (uint32 first character, uint32 offset, uint32 length) * groups
+    records  per group: uint8 n, n bytes of the word after its first character (UTF-8),
+             uint32 frequency, uint16 syllable id per character
+
+A group is decoded the first time a text uses its character. Text is
+segmented into the most probable sequence of dictionary words (the route
+through the DAG of all words found in the text, as jieba does), and
+results for repeated strings come from an LRU cache.
+
+Rebuild the dictionary from the jieba and pypinyin packages' data with:
+
+    python annotator.py path/to/jieba/dict.txt path/to/pypinyin/
+"""
+
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+
+from cache import MISSING, LRUCache
+
+PINYIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "pinyin.bin")
+
+MAGIC = b"PYD1"
+HEADER = struct.Struct("<4sIIQ")
+LENGTH = struct.Struct("<I")
+INDEX_ENTRY = struct.Struct("<III")
+FREQUENCY = struct.Struct("<I")
+SYLLABLE = struct.Struct("<H")
+
+HAN_RUN_RE = re.compile(r"[㐀-䶿一-鿿豈-﫿]+")
+
+# Readings for characters segmented as words on their own, where the
+# first pypinyin reading is not the usual one (跑得快 de, 慢慢地 de, 很长
+# cháng), or is but should stay so. Longer words keep their phrase or
+# character readings.
+SINGLE_CHARACTER_READINGS = {
+    "得": "de", "地": "de", "长": "cháng", "教": "jiāo", "着": "zhe", "了": "le", "的": "de",
+    "还": "hái", "行": "xíng", "都": "dōu", "为": "wèi", "和": "hé", "只": "zhǐ", "种": "zhǒng",
+}
+
+
+class PinyinDictionary:
+    """Read-only, memory-mapped word list with frequencies and readings"""
+
+    def __init__(self, path=PINYIN_PATH):
+        self.path = path
+        self._mm = None
+        self._groups = 0
+        self._index_start = 0
+        self.syllables = []
+        self.log_total = 0.0
+        # First character -> its decoded group (see group())
+        self._decoded = {}
+        self._readings = {}
+        self._lock = threading.Lock()
+        try:
+            with open(path, "rb") as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, syllable_count, self._groups, total = HEADER.unpack_from(self._mm, 0)
+            if magic != MAGIC:
+                raise ValueError("not a pinyin dictionary")
+            position = HEADER.size
+            size = LENGTH.unpack_from(self._mm, position)[0]
+            position += LENGTH.size
+            self.syllables = self._mm[position:position + size].decode("utf-8").split("\n")
+            if len(self.syllables) != syllable_count:
+                raise ValueError("corrupt syllable table")
+            self._index_start = position + size
+            self.log_total = math.log(total)
+        except (OSError, ValueError, struct.error) as e:
+            print(f"Could not load pinyin dictionary from {path}: {e}")
+            self._mm = None
+            self._groups = 0
+
+    def __len__(self):
+        return self._groups
+
+    def _index_entry(self, codepoint):
+        low, high = 0, self._groups
+        while low < high:
+            middle = (low + high) // 2
+            entry = INDEX_ENTRY.unpack_from(self._mm, self._index_start + INDEX_ENTRY.size * middle)
+            if entry[0] == codepoint:
+                return entry
+            if entry[0] < codepoint:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def group(self, char):
+        """{word: (log frequency, syllable offset)} for the words starting with char.
+
+        Every prefix of those words is also a key, with None as its value
+        unless it is a word itself, so a scan can stop as soon as no word
+        can match.
+        """
+        words = self._decoded.get(char)
+        if words is not None:
+            return words
+        words = {}
+        entry = self._index_entry(ord(char)) if self._groups else None
+        if entry is not None:
+            _, offset, length = entry
+            mm, position, end = self._mm, offset, offset + length
+            while position < end:
+                size = mm[position]
+                word = char + mm[position + 1:position + 1 + size].decode("utf-8")
+                position += 1 + size
+                frequency = FREQUENCY.unpack_from(mm, position)[0]
+                position += FREQUENCY.size
+                words[word] = (math.log(frequency) - self.log_total, position)
+                position += SYLLABLE.size * len(word)
+                for k in range(2, len(word)):
+                    words.setdefault(word[:k], None)
+        with self._lock:
+            # Bounded by the dictionary: one entry per first character
+            self._decoded[char] = words
+        return words
+
+    def reading(self, word):
+        """Toned syllables for a dictionary word, one per character"""
+        reading = self._readings.get(word)
+        if reading is not None:
+            return reading
+        found = self.group(word[0]).get(word)
+        if found is None:
+            return None
+        ids = struct.unpack_from(f"<{len(word)}H", self._mm, found[1])
+        reading = self._readings[word] = [self.syllables[i] for i in ids]
+        return reading
+
+    def stats(self):
+        return {"first_characters": self._groups, "decoded": len(self._decoded)}
+
+
+class Annotator:
+    """Segments text into words with pinyin, caching repeated strings"""
+
+    def __init__(self, dictionary=None, cache_size=2048, cache_ttl=86400):
+        self.dictionary = dictionary if dictionary is not None else PinyinDictionary()
+        self.cache = LRUCache(max_size=cache_size, ttl=cache_ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def segment(self, run):
+        """Most probable split of a run of Chinese characters into words"""
+        decoded, group = self.dictionary._decoded, self.dictionary.group
+        n = len(run)
+        # Unknown characters count as a word seen once
+        unknown = -self.dictionary.log_total
+        scores = [0.0] * (n + 1)
+        ends = [n] * (n + 1)
+        for i in range(n - 1, -1, -1):
+            char = run[i]
+            words = decoded.get(char) or group(char)
+            single = words.get(char)
+            score, end = (single[0] if single else unknown) + scores[i + 1], i + 1
+            j = i + 2
+            while j <= n:
+                fragment = run[i:j]
+                if fragment not in words:
+                    # No dictionary word starts with fragment
+                    break
+                found = words[fragment]
+                if found is not None and found[0] + scores[j] > score:
+                    score, end = found[0] + scores[j], j
+                j += 1
+            scores[i], ends[i] = score, end
+        segments, i = [], 0
+        while i < n:
+            segments.append(run[i:ends[i]])
+            i = ends[i]
+        return segments
+
+    def annotate(self, text):
+        """[{"word", "pinyin"}] for text; pinyin is one syllable per character, or None
+        for anything that isn't Chinese (punctuation, Latin letters, digits, ...)"""
+        cached = self.cache.get(text)
+        if cached is not MISSING:
+            with self._lock:
+                self.hits += 1
+            return cached
+        with self._lock:
+            self.misses += 1
+
+        tokens = []
+        position = 0
+        for match in HAN_RUN_RE.finditer(text):
+            if match.start() > position:
+                tokens.append({"word": text[position:match.start()], "pinyin": None})
+            for word in self.segment(match.group(0)):
+                reading = self.dictionary.reading(word)
+                if reading is None:
+                    # A character missing from the dictionary keeps its place
+                    reading = [self._char_reading(char) for char in word]
+                tokens.append({"word": word, "pinyin": reading})
+            position = match.end()
+        if position < len(text):
+            tokens.append({"word": text[position:], "pinyin": None})
+        self.cache.set(text, tokens)
+        return tokens
+
+    def _char_reading(self, char):
+        reading = self.dictionary.reading(char)
+        return reading[0] if reading else None
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        return {
+            "dictionary": self.dictionary.stats(),
+            "cache": {"hits": hits, "misses": misses, "size": len(self.cache)}
+        }
+
+
+def build(jieba_dict_path, pypinyin_dir, path=PINYIN_PATH, min_frequency=10):
+    """Compile data/pinyin.bin from jieba's dict.txt and pypinyin's JSON data"""
+    import json
+
+    with open(os.path.join(pypinyin_dir, "pinyin_dict.json"), encoding="utf-8") as f:
+        # The first reading of each character is its most common one
+        char_readings = {chr(int(code)): readings.split(",")[0] for code, readings in json.load(f).items()}
+    with open(os.path.join(pypinyin_dir, "phrases_dict.json"), encoding="utf-8") as f:
+        # Words whose reading differs from their characters' first readings
+        phrase_readings = {word: [syllables[0] for syllables in readings] for word, readings in json.load(f).items()}
+
+    frequencies = {}
+    with open(jieba_dict_path, encoding="utf-8") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) < 2 or not HAN_RUN_RE.fullmatch(parts[0]):
+                continue
+            if int(parts[1]) >= min_frequency or len(parts[0]) == 1:
+                frequencies[parts[0]] = max(int(parts[1]), 1)
+    for word in phrase_readings:
+        if HAN_RUN_RE.fullmatch(word):
+            frequencies.setdefault(word, min_frequency)
+    for char in char_readings:
+        if HAN_RUN_RE.fullmatch(char):
+            frequencies.setdefault(char, 1)
+
+    syllables, syllable_ids = [], {}
+    groups = {}
+    for word, frequency in frequencies.items():
+        reading = phrase_readings.get(word)
+        if reading is None and word in SINGLE_CHARACTER_READINGS:
+            reading = [SINGLE_CHARACTER_READINGS[word]]
+        if reading is None:
+            reading = [char_readings.get(char) for char in word]
+        if len(reading) != len(word) or None in reading or len(word[1:].encode("utf-8")) > 255:
+            continue
+        ids = []
+        for syllable in reading:
+            if syllable not in syllable_ids:
+                syllable_ids[syllable] = len(syllables)
+                syllables.append(syllable)
+            ids.append(syllable_ids[syllable])
+        groups.setdefault(word[0], []).append((word[1:].encode("utf-8"), frequency, ids))
+
+    table = "\n".join(syllables).encode("utf-8")
+    index_start = HEADER.size + LENGTH.size + len(table)
+    records_start = index_start + INDEX_ENTRY.size * len(groups)
+    index, records = bytearray(), bytearray()
+    for char in sorted(groups, key=ord):
+        offset = records_start + len(records)
+        entries = sorted(groups[char])
+        for suffix, frequency, ids in entries:
+            records += bytes([len(suffix)]) + suffix + FREQUENCY.pack(min(frequency, 2 ** 32 - 1))
+            records += b"".join(SYLLABLE.pack(i) for i in ids)
+        index += INDEX_ENTRY.pack(ord(char), offset, records_start + len(records) - offset)
+
+    total = sum(frequency for entries in groups.values() for _, frequency, _ in entries)
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(syllables), len(groups), total))
+        f.write(LENGTH.pack(len(table)) + table)
+        f.write(index)
+        f.write(records)
+    os.replace(temporary, path)
+    return sum(len(entries) for entries in groups.values())
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compile data/pinyin.bin")
+    parser.add_argument("jieba_dict", help="dict.txt from the jieba package")
+    parser.add_argument("pypinyin_dir", help="Directory of the pypinyin package (pinyin_dict.json, phrases_dict.json)")
+    parser.add_argument("--min-frequency", type=int, default=10, help="Leave out rarer jieba words")
+    parser.add_argument("--output", default=PINYIN_PATH)
+    args = parser.parse_args()
+    count = build(args.jieba_dict, args.pypinyin_dir, args.output, args.min_frequency)
+    print(f"Wrote {count} words to {args.output} ({os.path.getsize(args.output)} bytes)")
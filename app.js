@@ -3,6 +3,7 @@ class ChineseLanguageApp {
         this.recognition = null;
         this.synthesis = window.speechSynthesis;
         this.conversationHistory = [];
+        this.sessionId = null;
         this.isListening = false;
         this.finalTranscript = '';
         this.recordedMessage = '';
@@ -157,56 +158,229 @@ class ChineseLanguageApp {
         this.showLoading(true);
 
         try {
-            console.log('Sending message to API:', message);
-            console.log('Conversation history:', this.conversationHistory);
-            
-            const response = await fetch('/api/chat', {
+            if (window.ReadableStream && window.TextDecoder) {
+                await this.streamChatResponse(message);
+            } else {
+                await this.fetchChatResponse(message);
+            }
+        } catch (error) {
+            console.error('Full error details:', error);
+            console.error('Error stack:', error.stack);
+            if (error.retryAfter) {
+                this.addMessageToHistory('ai', '老师现在有点忙，请稍后再试。', `The tutor is busy right now. Please try again in ${error.retryAfter} seconds.`);
+            } else {
+                this.addMessageToHistory('ai', '抱歉，出现了错误。请再试一次。', 'Sorry, there was an error. Please try again.');
+            }
+        }
+        
+        this.isProcessing = false;
+        this.showLoading(false);
+    }
+
+    async fetchChatResponse(message) {
+        console.log('Sending message to API:', message);
+        console.log('Conversation history:', this.conversationHistory);
+        
+        const response = await this.postChatMessage('/api/chat', message);
+
+        console.log('Response status:', response.status);
+        
+        if (!response.ok) {
+            throw this.httpError(response);
+        }
+
+        const data = await response.json();
+        console.log('Response data:', data);
+        
+        if (data.error) {
+            throw new Error(data.error);
+        }
+
+        if (!data.response) {
+            console.error('No response field in data:', data);
+            throw new Error('Invalid response format from server');
+        }
+
+        this.addMessageToHistory('ai', data.response, data.translation);
+        
+        if (data.correction) {
+            this.showCorrection(data.correction);
+        }
+
+        if (this.autoSpeakCheckbox.checked && data.response) {
+            this.speakText(data.response);
+        }
+    }
+
+    httpError(response) {
+        const error = new Error(`HTTP error! status: ${response.status}`);
+        if (response.status === 429) {
+            // The server is at its Azure quota; it says when to try again
+            error.retryAfter = parseInt(response.headers.get('Retry-After'), 10) || 5;
+        }
+        return error;
+    }
+
+    async streamChatResponse(message) {
+        // Same request as fetchChatResponse, but the reply is shown as it is
+        // generated and the translation/correction are filled in when ready.
+        const response = await this.postChatMessage('/api/chat/stream', message);
+
+        if (!response.ok || !response.body) {
+            throw this.httpError(response);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let partialText = '';
+        let partialEl = null;
+        let replyEntry = null;
+
+        const handleEvent = (event, data) => {
+            if (event === 'reply') {
+                if (!partialEl) {
+                    this.showLoading(false);
+                    partialEl = this.createPartialMessage();
+                }
+                partialText += data.delta;
+                partialEl.textContent = partialText;
+                this.conversationHistoryEl.scrollTop = this.conversationHistoryEl.scrollHeight;
+            } else if (event === 'reply_done') {
+                if (partialEl) {
+                    partialEl.closest('.message-group').remove();
+                }
+                this.showLoading(false);
+                replyEntry = this.addMessageToHistory('ai', data.response);
+                if (this.autoSpeakCheckbox.checked && data.response) {
+                    this.speakText(data.response);
+                }
+            } else if (event === 'translation' && replyEntry) {
+                this.addTranslationToMessage(replyEntry, data.translation);
+            } else if (event === 'correction' && data.correction) {
+                this.showCorrection(data.correction);
+            } else if (event === 'error') {
+                throw new Error(data.error);
+            }
+        };
+
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const block = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let event = 'message';
+                let dataLines = [];
+                block.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) event = line.slice(6).trim();
+                    else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+                });
+                if (dataLines.length) {
+                    handleEvent(event, JSON.parse(dataLines.join('\n')));
+                }
+            }
+        }
+
+        if (!replyEntry) {
+            throw new Error('Stream ended before the reply was complete');
+        }
+    }
+
+    async postChatMessage(url, message) {
+        // With a server-side session only the new message is sent. If the
+        // session has expired (404), recreate it from the local history and
+        // retry once. Without a session, fall back to sending the history.
+        for (let attempt = 0; attempt < 2; attempt++) {
+            const sessionId = await this.ensureSession();
+            const body = sessionId
+                ? { message: message, session_id: sessionId }
+                : { message: message, conversation_history: this.conversationHistory };
+
+            const response = await fetch(url, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
                 },
+                body: JSON.stringify(body)
+            });
+
+            if (response.status === 404 && sessionId) {
+                this.sessionId = null;
+                continue;
+            }
+            return response;
+        }
+        throw new Error('Could not create a conversation session');
+    }
+
+    async ensureSession() {
+        if (this.sessionId) {
+            return this.sessionId;
+        }
+        try {
+            const response = await fetch('/api/session', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                // Seed with everything except the message being sent now
                 body: JSON.stringify({
-                    message: message,
-                    conversation_history: this.conversationHistory
+                    conversation_history: this.conversationHistory.slice(0, -1)
                 })
             });
-
-            console.log('Response status:', response.status);
-            
             if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
+                return null;
             }
-
             const data = await response.json();
-            console.log('Response data:', data);
-            
-            if (data.error) {
-                throw new Error(data.error);
-            }
+            this.sessionId = data.session_id;
+        } catch (error) {
+            console.warn('Could not create session, sending full history instead:', error);
+            return null;
+        }
+        return this.sessionId;
+    }
 
-            if (!data.response) {
-                console.error('No response field in data:', data);
-                throw new Error('Invalid response format from server');
-            }
+    resetSession() {
+        if (this.sessionId) {
+            fetch(`/api/session/${this.sessionId}`, { method: 'DELETE' }).catch(() => {});
+            this.sessionId = null;
+        }
+    }
 
-            this.addMessageToHistory('ai', data.response, data.translation);
-            
-            if (data.correction) {
-                this.showCorrection(data.correction);
-            }
+    createPartialMessage() {
+        const messageGroupDiv = document.createElement('div');
+        messageGroupDiv.className = 'message-group ai-message-group';
+        messageGroupDiv.innerHTML = `
+            <div class="message ai-message">
+                <div class="message-content"><p></p></div>
+            </div>
+        `;
+        this.conversationHistoryEl.appendChild(messageGroupDiv);
+        return messageGroupDiv.querySelector('p');
+    }
 
-            if (this.autoSpeakCheckbox.checked && data.response) {
-                this.speakText(data.response);
-            }
+    addTranslationToMessage(entry, translation) {
+        if (!translation) return;
+        entry.translation = translation;
 
-        } catch (error) {
-            console.error('Full error details:', error);
-            console.error('Error stack:', error.stack);
-            this.addMessageToHistory('ai', '抱歉，出现了错误。请再试一次。', 'Sorry, there was an error. Please try again.');
-        }
-        
-        this.isProcessing = false;
-        this.showLoading(false);
+        const translationDiv = document.createElement('div');
+        translationDiv.className = 'message ai-message translation-message';
+
+        const translationContent = document.createElement('div');
+        translationContent.className = 'message-content translation-content';
+
+        const translationP = document.createElement('p');
+        translationP.textContent = translation;
+        translationContent.appendChild(translationP);
+
+        translationDiv.appendChild(translationContent);
+        entry.element.appendChild(translationDiv);
+        this.conversationHistoryEl.scrollTop = this.conversationHistoryEl.scrollHeight;
     }
 
     addMessageToHistory(sender, message, translation = null) {
@@ -265,7 +439,11 @@ class ChineseLanguageApp {
         this.conversationHistoryEl.appendChild(messageGroupDiv);
         this.conversationHistoryEl.scrollTop = this.conversationHistoryEl.scrollHeight;
 
-        this.conversationHistory.push({ sender, message, translation, timestamp: new Date().toISOString() });
+        const entry = { sender, message, translation, timestamp: new Date().toISOString() };
+        this.conversationHistory.push(entry);
+        // Not serialized with the history; lets streamed translations attach later.
+        Object.defineProperty(entry, 'element', { value: messageGroupDiv, enumerable: false });
+        return entry;
     }
 
     showCorrection(correction) {
@@ -367,6 +545,7 @@ class ChineseLanguageApp {
     clearConversation() {
         if (confirm('Are you sure you want to clear the conversation?')) {
             this.conversationHistory = [];
+            this.resetSession();
             this.conversationHistoryEl.innerHTML = `
                 <div class="message-group ai-message-group">
                     <div class="message ai-message">
@@ -409,6 +588,9 @@ class ChineseLanguageApp {
 
             // Add the random topic as an AI message to start the conversation
             this.addMessageToHistory('ai', data.topic, data.translation);
+            // The server's session doesn't know about the topic; start a new
+            // one (seeded from local history) on the next message.
+            this.resetSession();
             
             if (this.autoSpeakCheckbox.checked && data.topic) {
                 this.speakText(data.topic);
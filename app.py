@@ -1,10 +1,27 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, abort, g, request, jsonify, stream_with_context
 from flask_cors import CORS
-import openai
 import os
+import contextvars
 import json
-import re
+import random
+import itertools
+import threading
+import time
+import metrics
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from glossary import Glossary, rewrite
+from annotator import Annotator
+from admission import AdmissionController, UpstreamOverloaded, estimate_request_tokens, retry_after_from
+from cache import MISSING, SingleFlight, TieredCache, normalize_text
+from context_builder import ContextBuilder
+from journal import JOURNAL_ROUTES, RequestJournal, journal_entry, stream_reply
+from topic_pool import TopicPool
+from reply_cache import OpeningReplyCache
+from sessions import SessionStore
+from static_assets import StaticAssets
+from tasks import TaskStats, load_task_profiles
+from triage import CJK_RE, ENGLISH_WORD_RE, INTERJECTION, SKIP, CorrectionTriage
 # Environment variables are handled by Vercel
 # from dotenv import load_dotenv
 # load_dotenv()
@@ -12,14 +29,166 @@ from datetime import datetime
 app = Flask(__name__)
 CORS(app)
 
+# "pipeline": separate chat, correction and translation calls.
+# "fused": one JSON-mode completion returns all three (see process_message).
+CHAT_MODES = ("pipeline", "fused")
+DEFAULT_CHAT_MODE = os.getenv("CHAT_MODE", "pipeline")
+if DEFAULT_CHAT_MODE not in CHAT_MODES:
+    DEFAULT_CHAT_MODE = "pipeline"
+
+BATCH_MAX_SENTENCES = int(os.getenv("BATCH_MAX_SENTENCES", "200"))
+# Longest text /api/annotate accepts
+ANNOTATE_MAX_CHARS = int(os.getenv("ANNOTATE_MAX_CHARS", "5000"))
+
+# Open connections to Azure in the background before the first chat
+UPSTREAM_WARMUP = os.getenv("UPSTREAM_WARMUP", "0") == "1"
+
+# One JSON line per request with its Azure calls (see metrics.py)
+REQUEST_LOG = os.getenv("REQUEST_LOG", "1") == "1"
+
+# Part of the correction cache key. Bump it whenever the correction or
+# interjection prompts change so results from the old prompts are not reused.
+CORRECTION_PROMPT_VERSION = "4"
+
+CHAT_ERROR_RESPONSE = {
+    "response": "很好！让我们继续对话。",
+    "translation": "Great! Let's continue our conversation."
+}
+
+FUSED_ERROR_RESPONSE = {
+    "response": "抱歉，我现在无法回应。请再试一次。",
+    "translation": "Sorry, I can't respond right now. Please try again."
+}
+
+TOPIC_CATEGORIES = [
+    "food and cooking, favorite dishes, restaurants",
+    "weather, seasons, outdoor activities", 
+    "hobbies, interests, free time activities",
+    "travel, places visited, dream destinations",
+    "family, friends, relationships",
+    "work, studies, daily routines",
+    "entertainment, movies, music, books",
+    "holidays, festivals, celebrations",
+    "sports, exercise, health",
+    "pets, animals, nature"
+]
+
+QUESTION_STYLES = [
+    "Ask an interesting question about",
+    "Start a conversation about", 
+    "Make a comment or observation about",
+    "Ask for their opinion on",
+    "Ask about their experience with"
+]
+
+FALLBACK_TOPICS = [
+    {"topic": "你今天做了什么有趣的事情？", "translation": "What interesting things did you do today?"},
+    {"topic": "你最喜欢吃什么菜？", "translation": "What's your favorite dish?"},
+    {"topic": "周末你通常做什么？", "translation": "What do you usually do on weekends?"},
+    {"topic": "你有什么爱好吗？", "translation": "Do you have any hobbies?"},
+    {"topic": "你去过哪些有趣的地方？", "translation": "What interesting places have you been to?"},
+    {"topic": "你最近在看什么书或电影？", "translation": "What books or movies have you been reading/watching recently?"},
+    {"topic": "你喜欢什么样的音乐？", "translation": "What kind of music do you like?"},
+    {"topic": "你的家乡有什么特色？", "translation": "What's special about your hometown?"}
+]
+
 class ChineseLanguageTutor:
     def __init__(self):
-        self.client = openai.AzureOpenAI(
-            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-            api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-01"),
-            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
-        )
+        # Imported here rather than at the top: backends.py loads the openai
+        # SDK, which is most of this app's import time
+        from backends import BackendPool
+        
+        # One or more endpoint/deployment pairs; each call is routed to the
+        # healthiest (see backends.py and AZURE_OPENAI_BACKENDS)
+        self.backends = BackendPool.from_env()
         self.deployment_name = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4")
+        # Optional per-task deployment/temperature/max_tokens overrides, so
+        # cheap tasks can run on a faster deployment (see tasks.py)
+        self.task_profiles = load_task_profiles(os.getenv("AZURE_OPENAI_TASK_DEPLOYMENTS"))
+        self.task_stats = TaskStats()
+        
+        # Shared, bounded pool for upstream calls that can run alongside the
+        # chat completion (e.g. the correction analysis). Bounded so a burst of
+        # chat requests cannot open an unlimited number of Azure calls.
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("UPSTREAM_MAX_WORKERS", "8")),
+            thread_name_prefix="upstream"
+        )
+        # Separate pool for /api/correct/batch, so classroom uploads share
+        # BATCH_CONCURRENCY workers instead of taking over the one above
+        self.batch_concurrency = int(os.getenv("BATCH_CONCURRENCY", "8"))
+        self.batch_executor = ThreadPoolExecutor(
+            max_workers=self.batch_concurrency,
+            thread_name_prefix="batch"
+        )
+        # Every Azure call is admitted against the deployment's RPM/TPM quota
+        # (0 = no limit); chat replies are queued ahead of background work.
+        self.admission = AdmissionController(
+            rpm=int(os.getenv("AZURE_OPENAI_RPM", "0")),
+            tpm=int(os.getenv("AZURE_OPENAI_TPM", "0")),
+            max_queue=int(os.getenv("ADMISSION_QUEUE_SIZE", "100")),
+            max_wait=float(os.getenv("ADMISSION_MAX_WAIT", "10"))
+        )
+        
+        # Translations of repeated replies and topics are served from here.
+        # Set CACHE_DB_PATH to persist them and share them between workers.
+        self.translation_cache = TieredCache(
+            "translation",
+            max_size=int(os.getenv("TRANSLATION_CACHE_SIZE", "2048")),
+            ttl=int(os.getenv("TRANSLATION_CACHE_TTL", "86400")),
+            db_path=os.getenv("CACHE_DB_PATH")
+        )
+        # Opt-in: a few random topics are pre-generated in the background.
+        # Never on Vercel, where functions don't live long enough to use them.
+        self.topic_pool = None
+        if os.getenv("TOPIC_POOL_ENABLED", "0") == "1" and not os.getenv("VERCEL"):
+            self.topic_pool = TopicPool(
+                TOPIC_CATEGORIES,
+                self._generate_topic,
+                size=int(os.getenv("TOPIC_POOL_SIZE", "5")),
+                low_water=int(os.getenv("TOPIC_POOL_LOW_WATER", "2")),
+                batch=int(os.getenv("TOPIC_POOL_BATCH", "2"))
+            )
+        # Opt-in: common first messages (no history) are answered from a
+        # pool of pre-generated replies, refreshed in the background
+        self.opening_cache = None
+        if os.getenv("OPENING_CACHE_ENABLED", "0") == "1":
+            self.opening_cache = OpeningReplyCache(
+                self._opening_bundle,
+                variants=int(os.getenv("OPENING_CACHE_VARIANTS", "3")),
+                ttl=int(os.getenv("OPENING_CACHE_TTL", "3600")),
+                min_hits=int(os.getenv("OPENING_CACHE_MIN_HITS", "2")),
+                max_keys=int(os.getenv("OPENING_CACHE_MAX_KEYS", "256"))
+            )
+        
+        # Prompt history is fitted to a token budget; older turns are folded
+        # into a running summary that is rebuilt in the background.
+        self.context_builder = ContextBuilder(
+            self._summarize_conversation,
+            TieredCache(
+                "summary",
+                max_size=int(os.getenv("SUMMARY_CACHE_SIZE", "2048")),
+                ttl=int(os.getenv("SUMMARY_CACHE_TTL", "86400")),
+                db_path=os.getenv("CACHE_DB_PATH")
+            ),
+            token_budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500")),
+            max_messages=int(os.getenv("CONTEXT_MAX_MESSAGES", "12")),
+            summary_interval=int(os.getenv("CONTEXT_SUMMARY_INTERVAL", "6")),
+            executor=self.executor
+        )
+        
+        self.correction_triage = CorrectionTriage()
+        self.glossary = Glossary()
+        self.correction_cache = TieredCache(
+            "correction",
+            max_size=int(os.getenv("CORRECTION_CACHE_SIZE", "4096")),
+            ttl=int(os.getenv("CORRECTION_CACHE_TTL", "604800")),
+            db_path=os.getenv("CACHE_DB_PATH")
+        )
+        # Identical translations/corrections requested at the same moment
+        # (a class starting together) share one upstream call.
+        self.translation_flight = SingleFlight("translation")
+        self.correction_flight = SingleFlight("correction")
         
         self.system_prompt = """You are an expert Chinese language tutor. Your role is to:
 
@@ -45,69 +214,253 @@ English translations will be handled separately by the system.
 
 Always be supportive and educational while maintaining natural conversation flow."""
 
-    def process_message(self, user_message, conversation_history):
+        # Appended to the system prompt in fused mode so a single completion
+        # returns the reply, its translation and the correction together.
+        self.fused_instructions = """For every student message, also check it for mistakes.
+
+Respond with a JSON object only, in this format:
+{
+    "response": "your conversational reply, in Chinese characters only",
+    "translation": "natural English translation of your reply",
+    "has_errors": true/false,
+    "correction": { ... }
+}
+
+If the student used English words, set "correction" to:
+{
+    "type": "interjection_help",
+    "english_words": [list of English words],
+    "translations": [list of Chinese translations for each word],
+    "suggested_sentence": "suggested Chinese sentence using the translations",
+    "explanation": "brief explanation of how to use these words in Chinese"
+}
+
+Otherwise, if the student's Chinese has grammatical errors or better word choices, set "correction" to:
+{
+    "type": "grammar_correction",
+    "original": "original text",
+    "corrected": "corrected version",
+    "explanation": "explanation of what was wrong and why"
+}
+
+If the student's Chinese is correct, set "has_errors" to false and omit "correction"."""
+
+        # The single-purpose prompts below are system messages that never
+        # change, and the text they work on follows in a user message. Azure
+        # caches prompt prefixes, so calls of the same task share everything
+        # up to the variable part (cached tokens are in /api/health "tasks").
+        self.correction_instructions = """Analyze the student's Chinese text for grammatical errors, pronunciation issues, or better word choices.
+
+If there are errors or improvements, respond with JSON:
+{
+    "has_errors": true,
+    "type": "grammar_correction",
+    "original": "original text",
+    "corrected": "corrected version",
+    "explanation": "explanation of what was wrong and why"
+}
+
+If the Chinese is correct, respond with JSON: {"has_errors": false}"""
+
+        self.interjection_instructions = """The student used English words in their Chinese sentence.
+
+Please help them by:
+1. Providing Chinese translations for the English words
+2. Showing how to incorporate them naturally into Chinese
+
+Words listed as already translated need no translation; use them in the suggested sentence.
+
+Respond with JSON:
+{
+    "type": "interjection_help",
+    "english_words": [list of English words],
+    "translations": [list of Chinese translations for each word],
+    "suggested_sentence": "suggested Chinese sentence using the translations",
+    "explanation": "brief explanation of how to use these words in Chinese"
+}"""
+
+        self.translation_instructions = "Translate the Chinese text to natural English. Respond with only the translation."
+
+        self.topic_instructions = """Generate a UNIQUE conversation starter for a Chinese language learning student, in the style and on the category given.
+
+Create a completely unique, engaging conversation starter.
+Requirements:
+- Simple enough for beginners to intermediate learners
+- Culturally relevant and engaging
+- Written in simplified Chinese characters
+- One question or statement to start a conversation
+- Must be DIFFERENT from weather topics
+- Be creative and varied - avoid repetitive patterns
+- Think of something fresh and interesting
+
+IMPORTANT: Do NOT ask about weather. Choose a different, more interesting topic.
+
+Respond with ONLY the Chinese text, nothing else."""
+
+        self.summary_instructions = """Update the running summary of a conversation between a Chinese tutor and a student.
+Keep what the tutor needs to continue naturally: facts about the student (name, interests, level),
+topics already discussed, and mistakes the student keeps making. Write at most 80 words, in English."""
+
+    def _complete(self, task, **params):
+        """Send a chat completion to Azure once admission control lets it through.
+
+        Raises UpstreamOverloaded when the call is rejected locally or every
+        backend tried answered 429.
+        """
+        return self._send(self._admit(task, params))
+
+    def _admit(self, task, params):
+        """Wait for admission of one call; returns the admitted call for _send().
+
+        Split from _send() so a caller can start lower-priority work only
+        once its own call has been let through, instead of letting that work
+        take the last of the quota first.
+        """
+        call = self._plan(task, params)
+        self.admission.acquire(task, call[3])
+        return call
+
+    def _plan(self, task, params):
+        """(task, params, deployment, token estimate) with the task's profile applied"""
+        profile = self.task_profiles.get(task)
+        if profile is not None:
+            params = profile.apply(params)
+        deployment = profile.deployment if profile else None
+        return task, params, deployment, estimate_request_tokens(params)
+
+    def _send(self, call):
+        """Make a call returned by _admit()"""
+        task, params, deployment, estimate = call
+        span = {"task": task, "deployment": deployment or self.deployment_name}
+        start = time.monotonic()
         try:
-            messages = [{"role": "system", "content": self.system_prompt}]
-            
-            for msg in conversation_history[-10:]:
-                if msg['sender'] == 'user':
-                    messages.append({"role": "user", "content": msg['message']})
-                elif msg['sender'] == 'ai':
-                    messages.append({"role": "assistant", "content": msg['message']})
-            
-            messages.append({"role": "user", "content": user_message})
-            
-            analysis_prompt = f"""
-            Analyze this Chinese text for errors: "{user_message}"
-            
-            Provide:
-            1. A natural conversational response in Chinese
-            2. English translation of your response
-            3. If there are errors, provide correction details
-            4. Respond with short simple sentences
-            
-            Format your response as JSON:
-            {{
-                "response": "Chinese response here",
-                "translation": "English translation here",
-                "has_errors": true/false,
-                "correction": {{
-                    "original": "original text with errors",
-                    "corrected": "corrected version",
-                    "explanation": "explanation of the correction"
-                }}
-            }}
-            
-            If no errors, omit the correction field.
-            """
-            
-            response = self.client.chat.completions.create(
-                model=self.deployment_name,
-                messages=[
-                    {"role": "system", "content": analysis_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                temperature=0.7,
-                max_tokens=1000
-            )
-            
-            result = response.choices[0].message.content.strip()
-            
+            response = self.backends.complete(params, deployment, span, self._extra_attempt_admission(task, estimate))
+        except Exception as e:
+            self._record_call(task, span, start, error=e)
+            if getattr(e, "status_code", None) == 429:
+                raise UpstreamOverloaded(retry_after_from(e), "azure_rate_limit") from e
+            raise
+        
+        if params.get("stream"):
+            # Usage comes in the stream's last chunk (see _chat_request)
+            self._record_call(task, span, start)
+            return self._metered_stream(response, task, span, estimate)
+        self._record_call(task, span, start, response.usage)
+        if response.usage is not None:
+            self.admission.settle(estimate, response.usage.total_tokens)
+        return response
+
+    def _extra_attempt_admission(self, task, estimate):
+        """admit callback for BackendPool.complete(): failovers and hedges cost quota too"""
+        def admit(hedge=False):
+            if hedge:
+                return self.admission.try_acquire(task, estimate)
             try:
-                parsed_result = json.loads(result)
-                return parsed_result
-            except json.JSONDecodeError:
-                return self._fallback_response(user_message, result)
-                
+                self.admission.acquire(task, estimate)
+            except UpstreamOverloaded:
+                return False
+            return True
+        return admit
+
+    def _metered_stream(self, stream, task, span, estimate):
+        """Pass a stream's chunks through, recording its usage when it arrives"""
+        for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                self._record_stream_usage(task, span, chunk.usage, estimate)
+            yield chunk
+
+    def _record_stream_usage(self, task, span, usage, estimate):
+        self.task_stats.record_usage(task, usage)
+        metrics.record_usage(task, span, usage)
+        self.admission.settle(estimate, usage.total_tokens)
+
+    def _record_call(self, task, span, start, usage=None, error=None):
+        """Per-task counters, metrics and a request span for one Azure call"""
+        latency = time.monotonic() - start
+        self.task_stats.record(task, latency, usage, error=error is not None)
+        status_code = getattr(error, "status_code", None)
+        if error is None:
+            outcome = "ok"
+        elif status_code is not None:
+            outcome = f"http_{status_code}"
+        else:
+            outcome = type(error).__name__
+        metrics.record_upstream(task, span, latency, usage, outcome)
+
+    def _submit(self, fn, *args):
+        """Run fn in the pool with the caller's context, so its spans land on the caller's request"""
+        return self.executor.submit(contextvars.copy_context().run, fn, *args)
+
+    def process_message(self, user_message, conversation_history, history_base=None):
+        """Fused mode: reply, translation and correction from one JSON completion"""
+        try:
+            response = self._complete("chat", **self._fused_request(user_message, conversation_history, history_base))
+            return self._parse_fused_response(response.choices[0].message.content.strip(), user_message)
+        except UpstreamOverloaded:
+            raise
         except Exception as e:
             print(f"Error processing message: {e}")
-            return {
-                "response": "抱歉，我现在无法回应。请再试一次。",
-                "translation": "Sorry, I can't respond right now. Please try again.",
-                "has_errors": False
-            }
+            metrics.record_fallback("fused_error")
+            return dict(FUSED_ERROR_RESPONSE)
+
+    def _fused_request(self, user_message, conversation_history, history_base=None):
+        """Completion arguments for fused mode"""
+        messages = self.context_builder.build(
+            self.system_prompt + "\n\n" + self.fused_instructions,
+            conversation_history,
+            user_message,
+            history_base
+        )
+        return {
+            "model": self.deployment_name,
+            "messages": messages,
+            "temperature": 0.7,
+            "max_tokens": 1000,
+            "response_format": {"type": "json_object"}
+        }
+
+    def _parse_fused_response(self, result, user_message):
+        try:
+            parsed_result = json.loads(result)
+        except json.JSONDecodeError:
+            return self._fallback_response(user_message, result)
+        
+        if not isinstance(parsed_result, dict) or not parsed_result.get("response"):
+            return self._fallback_response(user_message, result)
+        
+        return {
+            "response": parsed_result["response"].strip(),
+            "translation": parsed_result.get("translation") or "Translation not available",
+            "correction": self._normalize_fused_correction(parsed_result, user_message)
+        }
+
+    def _normalize_fused_correction(self, parsed_result, user_message):
+        """Map the fused completion's correction onto the pipeline's correction schema"""
+        correction = parsed_result.get("correction")
+        if not isinstance(correction, dict) or not correction:
+            return None
+        if parsed_result.get("has_errors") is False and correction.get("type") != "interjection_help":
+            return None
+        
+        correction_type = correction.get("type")
+        if correction_type not in ("grammar_correction", "interjection_help"):
+            correction_type = "interjection_help" if "english_words" in correction else "grammar_correction"
+        correction["type"] = correction_type
+        
+        if correction_type == "interjection_help":
+            if not correction.get("english_words"):
+                interjections = self._detect_english_interjections(user_message)
+                correction["english_words"] = interjections["english_words"] if interjections else []
+        else:
+            correction.setdefault("original", user_message)
+            if not correction.get("corrected"):
+                return None
+        
+        correction.setdefault("explanation", "")
+        return correction
 
     def _fallback_response(self, user_message, ai_response):
+        metrics.record_fallback("fused_unparsed")
         chinese_response = ai_response
         if '\n' in ai_response:
             lines = ai_response.split('\n')
@@ -116,61 +469,173 @@ Always be supportive and educational while maintaining natural conversation flow
         return {
             "response": chinese_response,
             "translation": "I understand what you said. Let's continue our conversation!",
-            "has_errors": False
+            "correction": None
+        }
+
+    def respond(self, user_message, conversation_history, mode=None, history_base=None):
+        """Answer a chat turn in the requested mode (defaults to CHAT_MODE)"""
+        mode = mode or DEFAULT_CHAT_MODE
+        result = self._cached_opening(user_message, conversation_history, mode)
+        if result is not None:
+            result["cached"] = True
+        elif mode == "fused":
+            result = self.process_message(user_message, conversation_history, history_base)
+        else:
+            result = self.get_conversation_response(user_message, conversation_history, history_base)
+        result["mode"] = mode
+        return result
+
+    def _cached_opening(self, user_message, conversation_history, mode="pipeline"):
+        """A pooled reply for a history-free message, or None. Bundles are
+        generated by the pipeline, so only pipeline turns are served from it."""
+        if self.opening_cache is None or conversation_history or mode != "pipeline":
+            return None
+        return self.opening_cache.get(user_message)
+
+    def _opening_bundle(self, user_message):
+        """A new reply, translation and correction for a first message. Raises
+        instead of returning the canned fallbacks, so those are never pooled."""
+        chat_call = self._admit("chat", self._chat_request(user_message, []))
+        correction_future = self._submit(self._corrections, user_message)
+        response = self._send(chat_call)
+        ai_response = response.choices[0].message.content.strip()
+        if not ai_response:
+            correction_future.cancel()
+            raise ValueError("Empty chat reply")
+        cache_key = normalize_text(ai_response)
+        translation = self.translation_cache.get(cache_key)
+        if translation is MISSING:
+            translation = self.translation_flight.do(cache_key, self._fetch_translation, ai_response, cache_key)
+        return {
+            "response": ai_response,
+            "translation": translation,
+            "correction": correction_future.result()
         }
 
-    def get_conversation_response(self, user_message, conversation_history):
+    def get_conversation_response(self, user_message, conversation_history, history_base=None):
+        correction_future = None
         try:
-            messages = [{"role": "system", "content": self.system_prompt}]
+            chat_call = self._admit("chat", self._chat_request(user_message, conversation_history, history_base))
             
-            # Only include previous messages, not the current one
-            # The current message is already in conversation_history from the frontend
-            for msg in conversation_history[:-1][-8:]:
-                if msg['sender'] == 'user':
-                    messages.append({"role": "user", "content": msg['message']})
-                elif msg['sender'] == 'ai':
-                    messages.append({"role": "assistant", "content": msg['message']})
-            
-            # Add the current message
-            messages.append({"role": "user", "content": user_message})
-            
-            print(f"DEBUG: Sending request to Azure OpenAI...")
-            print(f"DEBUG: Deployment: {self.deployment_name}")
-            print(f"DEBUG: Message: {user_message}")
-            
-            response = self.client.chat.completions.create(
-                model=self.deployment_name,
-                messages=messages,
-                temperature=0.8,
-                max_tokens=800
-            )
+            # The correction only depends on the user's message, so start it
+            # now and let it run while we wait for the chat reply. Started
+            # after the chat call is admitted, so it can't take the last of
+            # the quota from the reply the user is waiting for.
+            correction_future = self._submit(self._analyze_for_corrections, user_message)
             
+            response = self._send(chat_call)
             ai_response = response.choices[0].message.content.strip()
-            print(f"DEBUG: Received response: {ai_response[:100]}...")
             
-            correction = self._analyze_for_corrections(user_message)
+            # The translation needs the reply, so it runs here while the
+            # correction (if still in flight) finishes in the pool.
+            translation = self._get_translation(ai_response)
+            correction = correction_future.result()
             
             return {
                 "response": ai_response,
-                "translation": self._get_translation(ai_response),
+                "translation": translation,
                 "correction": correction
             }
             
         except Exception as e:
+            if correction_future is not None:
+                correction_future.cancel()
+            if isinstance(e, UpstreamOverloaded):
+                raise
             print(f"ERROR in get_conversation_response: {e}")
             import traceback
             traceback.print_exc()
-            return {
-                "response": "很好！让我们继续对话。",
-                "translation": "Great! Let's continue our conversation."
-            }
+            metrics.record_fallback("chat_error")
+            return dict(CHAT_ERROR_RESPONSE)
+
+    def _chat_request(self, user_message, conversation_history, history_base=None, stream=False):
+        """Completion arguments for the pipeline's chat reply"""
+        params = {
+            "model": self.deployment_name,
+            "messages": self.context_builder.build(self.system_prompt, conversation_history, user_message, history_base),
+            "temperature": 0.8,
+            "max_tokens": 800
+        }
+        if stream:
+            params["stream"] = True
+            # A last chunk with the usage, cached prompt tokens included
+            params["stream_options"] = {"include_usage": True}
+        return params
+
+    def stream_conversation_response(self, user_message, conversation_history, history_base=None, mode="pipeline"):
+        """Streaming variant of respond.
+
+        Yields (event, data) pairs: "reply" for each chunk of the chat reply,
+        "reply_done" with the full reply and the mode used, then
+        "translation" and "correction" in whichever order they finish, and
+        finally "done". Fused mode has nothing to stream until its single
+        completion is parsed, so its reply arrives as one "reply" event.
+        """
+        cached = self._cached_opening(user_message, conversation_history, mode)
+        if cached is not None:
+            yield from self._bundle_events(dict(cached, cached=True), mode)
+            return
+        if mode == "fused":
+            yield from self._bundle_events(self.process_message(user_message, conversation_history, history_base), mode)
+            return
+        
+        # As in get_conversation_response, the correction starts once the
+        # chat call is admitted
+        chat_call = self._admit("chat", self._chat_request(user_message, conversation_history, history_base, stream=True))
+        correction_future = self._submit(self._analyze_for_corrections, user_message)
+        
+        chunks = []
+        try:
+            stream = self._send(chat_call)
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    chunks.append(delta)
+                    yield "reply", {"delta": delta}
+            ai_response = "".join(chunks).strip()
+            if not ai_response:
+                raise ValueError("Empty streamed response")
+        except Exception as e:
+            print(f"ERROR in stream_conversation_response: {e}")
+            if not chunks:
+                correction_future.cancel()
+                if isinstance(e, UpstreamOverloaded):
+                    raise
+                metrics.record_fallback("chat_error")
+                yield "reply_done", {"response": CHAT_ERROR_RESPONSE["response"], "mode": mode}
+                yield "translation", {"translation": CHAT_ERROR_RESPONSE["translation"]}
+                yield "done", {"mode": mode}
+                return
+            ai_response = "".join(chunks).strip()
+        
+        yield "reply_done", {"response": ai_response, "mode": mode}
+        
+        translation_future = self._submit(self._get_translation, ai_response)
+        for future in as_completed([translation_future, correction_future]):
+            if future is translation_future:
+                yield "translation", {"translation": future.result()}
+            else:
+                yield "correction", {"correction": future.result()}
+        
+        yield "done", {"mode": mode}
+
+    def _bundle_events(self, bundle, mode):
+        """The stream events for a finished reply (pooled or fused): all of it at once"""
+        reply_done = {"response": bundle["response"], "mode": mode}
+        if bundle.get("cached"):
+            reply_done["cached"] = True
+        yield "reply", {"delta": bundle["response"]}
+        yield "reply_done", reply_done
+        yield "translation", {"translation": bundle["translation"]}
+        yield "correction", {"correction": bundle.get("correction")}
+        yield "done", {"mode": mode}
 
     def _detect_english_interjections(self, text):
         """Detect English words in Chinese text that might be interjections"""
-        import string
-        
         # Simple regex to find English words (letters only, not mixed with Chinese)
-        english_words = re.findall(r'\b[a-zA-Z]+\b', text)
+        english_words = ENGLISH_WORD_RE.findall(text)
         
         if english_words:
             return {
@@ -182,238 +647,581 @@ Always be supportive and educational while maintaining natural conversation flow
 
     def _analyze_for_corrections(self, text):
         try:
-            # First check for English interjections
-            interjections = self._detect_english_interjections(text)
-            
-            if interjections:
-                # Handle interjections - get translations for English words
-                english_words_str = ", ".join(interjections["english_words"])
-                interjection_prompt = f"""
-                The student used these English words in their Chinese sentence: {english_words_str}
-                Original sentence: "{text}"
-                
-                Please help them by:
-                1. Providing Chinese translations for the English words
-                2. Showing how to incorporate them naturally into Chinese
-                
-                Respond with JSON:
-                {{
-                    "type": "interjection_help",
-                    "english_words": [list of English words],
-                    "translations": [list of Chinese translations for each word],
-                    "suggested_sentence": "suggested Chinese sentence using the translations",
-                    "explanation": "brief explanation of how to use these words in Chinese"
-                }}
-                """
-                
-                response = self.client.chat.completions.create(
-                    model=self.deployment_name,
-                    messages=[{"role": "user", "content": interjection_prompt}],
-                    temperature=0.3,
-                    max_tokens=400
-                )
-                
-                result = response.choices[0].message.content.strip()
-                
-                try:
-                    return json.loads(result)
-                except json.JSONDecodeError:
-                    # Fallback for interjections
-                    return {
-                        "type": "interjection_help",
-                        "english_words": interjections["english_words"],
-                        "explanation": f"I noticed you used English words: {english_words_str}. Let me help you say those in Chinese!"
-                    }
-            
-            # Regular grammar correction analysis
-            correction_prompt = f"""
-            Analyze this Chinese text for grammatical errors, pronunciation issues, or better word choices: "{text}"
-            
-            If there are errors or improvements, respond with JSON:
-            {{
-                "type": "grammar_correction",
-                "original": "original text",
-                "corrected": "corrected version", 
-                "explanation": "explanation of what was wrong and why"
-            }}
-            
-            If the Chinese is correct, respond with: null
-            """
-            
-            response = self.client.chat.completions.create(
-                model=self.deployment_name,
-                messages=[{"role": "user", "content": correction_prompt}],
-                temperature=0.3,
-                max_tokens=300
-            )
-            
-            result = response.choices[0].message.content.strip()
-            
-            if result.lower() == 'null' or 'null' in result.lower():
-                return None
-                
-            try:
-                parsed = json.loads(result)
-                if not parsed.get("type"):
-                    parsed["type"] = "grammar_correction"
-                return parsed
-            except json.JSONDecodeError:
-                return None
-                
+            return self._corrections(text)
         except Exception as e:
             print(f"Error analyzing corrections: {e}")
+            metrics.record_fallback("correction_error")
+            return None
+
+    def _corrections(self, text):
+        """Correction for text, or None if it has no errors. Raises if Azure fails."""
+        # Punctuation-only input, single characters and known-correct
+        # phrases cannot need a correction, so don't ask Azure.
+        decision, reason = self.correction_triage.classify(text)
+        if decision == SKIP:
             return None
+        if decision == INTERJECTION:
+            local = self._glossary_correction(text)
+            if local is not MISSING:
+                return local
+        
+        # Results are close to deterministic at temperature 0.3, so repeated
+        # learner sentences ("你好", "谢谢", ...) are served from the cache,
+        # including the "no errors" (None) result.
+        cache_key = self._correction_cache_key(text)
+        cached = self.correction_cache.get(cache_key)
+        if cached is not MISSING:
+            return cached
+        
+        return self.correction_flight.do(cache_key, self._fetch_corrections, text, cache_key)
+
+    def _glossary_correction(self, text):
+        """Interjection help from the local glossary, or MISSING if Azure is needed.
+
+        Only a Chinese sentence whose English words are all in the glossary
+        is answered locally; an English sentence needs a real rewrite.
+        """
+        words = ENGLISH_WORD_RE.findall(text)
+        known = self.glossary.translate(words) if CJK_RE.search(text) else {}
+        if not known:
+            self.glossary.count("upstream")
+            return MISSING
+        if len(known) < len(set(words)):
+            self.glossary.count("partial")
+            return MISSING
+        self.glossary.count("local")
+        return {
+            "type": "interjection_help",
+            "english_words": words,
+            "translations": [known[word] for word in words],
+            "suggested_sentence": rewrite(text, known),
+            "explanation": "Here is how to say these words in Chinese: " + ", ".join(
+                f"{word} → {chinese}" for word, chinese in known.items()
+            )
+        }
+
+    def correct_batch(self, sentences):
+        """Corrections for a list of sentences, in order, one item per sentence.
+
+        Identical sentences are checked once. Items are {"sentence",
+        "correction"} or, if that sentence failed, {"sentence", "error"}.
+        """
+        keys = [self._correction_cache_key(sentence) for sentence in sentences]
+        futures = {}
+        for sentence, key in zip(sentences, keys):
+            if sentence and key not in futures:
+                futures[key] = self.batch_executor.submit(contextvars.copy_context().run, self._corrections, sentence)
+        return [self._batch_item(sentence, futures.get(key)) for sentence, key in zip(sentences, keys)]
+
+    def _batch_item(self, sentence, future):
+        if future is None:
+            return {"sentence": sentence, "error": "Sentence is required"}
+        error = future.exception()
+        if error is None:
+            return {"sentence": sentence, "correction": future.result()}
+        if isinstance(error, UpstreamOverloaded):
+            return {
+                "sentence": sentence,
+                "error": "The tutor is busy right now. Please try again shortly.",
+                "retry_after": error.retry_after
+            }
+        print(f"Error correcting batch sentence: {error}")
+        return {"sentence": sentence, "error": "Correction failed"}
+
+    def _fetch_corrections(self, text, cache_key):
+        correction, cacheable = self._request_corrections(text)
+        if cacheable:
+            self.correction_cache.set(cache_key, correction)
+        return correction
+
+    def _correction_cache_key(self, text):
+        return f"v{CORRECTION_PROMPT_VERSION}:{normalize_text(text)}"
+
+    def _request_corrections(self, text):
+        """Ask Azure for a correction. Returns (correction, cacheable)"""
+        interjections = self._detect_english_interjections(text)
+        task = "interjection" if interjections else "correction"
+        response = self._complete(task, **self._correction_request(text, interjections))
+        return self._parse_correction(response.choices[0].message.content.strip(), text, interjections)
+
+    def _correction_request(self, text, interjections):
+        """Completion arguments for the interjection or grammar check"""
+        if interjections:
+            # Handle interjections - in a Chinese sentence only the words the
+            # glossary doesn't know need translating; English sentences are
+            # translated as a whole
+            known = self.glossary.translate(interjections["english_words"]) if CJK_RE.search(text) else {}
+            interjections["known"] = known
+            unknown = [word for word in dict.fromkeys(interjections["english_words"]) if word not in known]
+            user_content = f"English words: {', '.join(unknown)}\n"
+            if known:
+                user_content += f"Already translated: {', '.join(f'{word} = {chinese}' for word, chinese in known.items())}\n"
+            user_content += f"Sentence: {text}"
+            return {
+                "model": self.deployment_name,
+                "messages": [
+                    {"role": "system", "content": self.interjection_instructions},
+                    {"role": "user", "content": user_content}
+                ],
+                "temperature": 0.3,
+                "max_tokens": 400,
+                "response_format": {"type": "json_object"}
+            }
+        
+        # Regular grammar correction analysis
+        return {
+            "model": self.deployment_name,
+            "messages": [
+                {"role": "system", "content": self.correction_instructions},
+                {"role": "user", "content": text}
+            ],
+            "temperature": 0.3,
+            "max_tokens": 300,
+            "response_format": {"type": "json_object"}
+        }
+
+    def _parse_correction(self, result, text, interjections):
+        """Parse the correction reply. Returns (correction, cacheable)"""
+        if not interjections:
+            return self._parse_grammar_correction(result, text)
+        try:
+            parsed = json.loads(result)
+        except json.JSONDecodeError:
+            parsed = None
+        if isinstance(parsed, dict):
+            known = interjections.get("known")
+            if known and isinstance(parsed.get("english_words"), list) and isinstance(parsed.get("translations"), list):
+                # Azure only translated the unknown words; list every word in order
+                translated = {str(word).lower(): chinese for word, chinese in zip(parsed["english_words"], parsed["translations"])}
+                words = interjections["english_words"]
+                parsed["english_words"] = words
+                parsed["translations"] = [known.get(word) or translated.get(word.lower(), "") for word in words]
+            return parsed, True
+        # Fallback for interjections
+        english_words_str = ", ".join(interjections["english_words"])
+        return {
+            "type": "interjection_help",
+            "english_words": interjections["english_words"],
+            "explanation": f"I noticed you used English words: {english_words_str}. Let me help you say those in Chinese!"
+        }, False
+
+    def _parse_grammar_correction(self, result, text):
+        """Parse the grammar check reply. Returns (correction, cacheable)"""
+        try:
+            parsed = json.loads(result)
+        except json.JSONDecodeError:
+            return None, False
+        
+        # A bare null is how the pre-JSON-mode prompt said "no errors"
+        if parsed is None:
+            return None, True
+        if not isinstance(parsed, dict):
+            return None, False
+        if parsed.pop("has_errors", True) is False:
+            return None, True
+        
+        corrected = parsed.get("corrected")
+        if not corrected or normalize_text(corrected) == normalize_text(text):
+            return None, True
+        
+        if not parsed.get("type"):
+            parsed["type"] = "grammar_correction"
+        parsed.setdefault("original", text)
+        return parsed, True
+
+    def _summarize_conversation(self, previous_summary, turns):
+        """Fold turns into the running conversation summary. Raises on failure."""
+        transcript = "\n".join(
+            f"{'Student' if role == 'user' else 'Tutor'}: {content}" for role, content in turns
+        )
+        summary_prompt = f"""Previous summary: {previous_summary or "None"}
+
+New messages:
+{transcript}"""
+        
+        response = self._complete(
+            "summary",
+            model=self.deployment_name,
+            messages=[
+                {"role": "system", "content": self.summary_instructions},
+                {"role": "user", "content": summary_prompt}
+            ],
+            temperature=0.3,
+            max_tokens=200
+        )
+        return response.choices[0].message.content.strip()
 
     def _get_translation(self, chinese_text):
+        cache_key = normalize_text(chinese_text)
+        cached = self.translation_cache.get(cache_key)
+        if cached is not MISSING:
+            return cached
+        
         try:
-            translation_prompt = f"Translate this Chinese text to natural English: {chinese_text}"
-            
-            response = self.client.chat.completions.create(
-                model=self.deployment_name,
-                messages=[{"role": "user", "content": translation_prompt}],
-                temperature=0.3,
-                max_tokens=200
-            )
-            
-            return response.choices[0].message.content.strip()
-            
+            return self.translation_flight.do(cache_key, self._fetch_translation, chinese_text, cache_key)
         except Exception as e:
             print(f"Error getting translation: {e}")
+            metrics.record_fallback("translation_error")
             return "Translation not available"
 
+    def _fetch_translation(self, chinese_text, cache_key):
+        response = self._complete("translation", **self._translation_request(chinese_text))
+        translation = response.choices[0].message.content.strip()
+        if translation:
+            self.translation_cache.set(cache_key, translation)
+        return translation
+
+    def _translation_request(self, chinese_text):
+        return {
+            "model": self.deployment_name,
+            "messages": [
+                {"role": "system", "content": self.translation_instructions},
+                {"role": "user", "content": chinese_text}
+            ],
+            "temperature": 0.3,
+            "max_tokens": 200
+        }
+
     def get_random_conversation_topic(self):
+        if self.topic_pool is not None:
+            # Topics are generated ahead of time by the pool's worker, so this
+            # is usually just a pop. The worker starts on first use; while the
+            # pool is empty topics are generated per request as below.
+            self.topic_pool.start()
+            topic = self.topic_pool.pop()
+            if topic is not None:
+                return topic
+        
         try:
-            import random
-            import time
-            import hashlib
-            
-            print("DEBUG: Starting random topic generation")
-            
-            # Add randomness to the prompt itself
-            topic_categories = [
-                "food and cooking, favorite dishes, restaurants",
-                "weather, seasons, outdoor activities", 
-                "hobbies, interests, free time activities",
-                "travel, places visited, dream destinations",
-                "family, friends, relationships",
-                "work, studies, daily routines",
-                "entertainment, movies, music, books",
-                "holidays, festivals, celebrations",
-                "sports, exercise, health",
-                "pets, animals, nature"
-            ]
-            
-            question_styles = [
-                "Ask an interesting question about",
-                "Start a conversation about", 
-                "Make a comment or observation about",
-                "Ask for their opinion on",
-                "Ask about their experience with"
-            ]
-            
-            selected_category = random.choice(topic_categories)
-            selected_style = random.choice(question_styles)
-            
-            # Use current timestamp and random data for additional randomness
-            timestamp_seed = str(int(time.time() * 1000000))  # More precision
-            random_hash = hashlib.md5(f"{timestamp_seed}{random.random()}".encode()).hexdigest()[:8]
-            
-            print(f"DEBUG: Selected category: {selected_category}")
-            print(f"DEBUG: Selected style: {selected_style}")
-            print(f"DEBUG: Random seed: {random_hash}")
-            
-            topic_prompt = f"""Session ID: {random_hash} - Generate a UNIQUE conversation starter.
-            
-            {selected_style} {selected_category}.
-            
-            Create a completely unique, engaging conversation starter for a Chinese language learning student.
-            Requirements:
-            - Simple enough for beginners to intermediate learners
-            - Culturally relevant and engaging  
-            - Written in simplified Chinese characters
-            - One question or statement to start a conversation
-            - Must be DIFFERENT from weather topics
-            - Be creative and varied - avoid repetitive patterns
-            - Think of something fresh and interesting
-            
-            IMPORTANT: Do NOT ask about weather. Choose a different, more interesting topic.
-            
-            Respond with ONLY the Chinese text, nothing else."""
-            
-            response = self.client.chat.completions.create(
-                model=self.deployment_name,
-                messages=[{"role": "user", "content": topic_prompt}],
-                temperature=1.2,  # Even higher temperature for more randomness
-                max_tokens=100,
-                top_p=0.9,  # Add nucleus sampling
-                frequency_penalty=0.5,  # Reduce repetition
-                presence_penalty=0.3   # Encourage new topics
-            )
-            
-            chinese_topic = response.choices[0].message.content.strip()
-            print(f"DEBUG: Generated topic: {chinese_topic}")
-            
-            english_translation = self._get_translation(chinese_topic)
-            print(f"DEBUG: Translation: {english_translation}")
-            
-            return {
-                "topic": chinese_topic,
-                "translation": english_translation
-            }
-            
+            return self._generate_topic(random.choice(TOPIC_CATEGORIES))
         except Exception as e:
             print(f"Error getting random topic: {e}")
             import traceback
             print(f"Full traceback: {traceback.format_exc()}")
+            metrics.record_fallback("topic_error")
             # Even fallback should have some variety
-            import random
-            fallback_topics = [
-                {"topic": "你今天做了什么有趣的事情？", "translation": "What interesting things did you do today?"},
-                {"topic": "你最喜欢吃什么菜？", "translation": "What's your favorite dish?"},
-                {"topic": "周末你通常做什么？", "translation": "What do you usually do on weekends?"},
-                {"topic": "你有什么爱好吗？", "translation": "Do you have any hobbies?"},
-                {"topic": "你去过哪些有趣的地方？", "translation": "What interesting places have you been to?"},
-                {"topic": "你最近在看什么书或电影？", "translation": "What books or movies have you been reading/watching recently?"},
-                {"topic": "你喜欢什么样的音乐？", "translation": "What kind of music do you like?"},
-                {"topic": "你的家乡有什么特色？", "translation": "What's special about your hometown?"}
-            ]
-            return random.choice(fallback_topics)
-
-tutor = ChineseLanguageTutor()
+            return random.choice(FALLBACK_TOPICS)
+
+    def _generate_topic(self, category):
+        """Generate one topic and its translation for a category. Raises on failure."""
+        response = self._complete("topic", **self._topic_request(category))
+        chinese_topic = response.choices[0].message.content.strip()
+        if not chinese_topic:
+            raise ValueError("Empty topic from Azure")
+        
+        english_translation = self._get_translation(chinese_topic)
+        if english_translation == "Translation not available":
+            raise ValueError(f"No translation for topic: {chinese_topic}")
+        
+        return {
+            "topic": chinese_topic,
+            "translation": english_translation
+        }
+
+    def _topic_request(self, category):
+        selected_style = random.choice(QUESTION_STYLES)
+        
+        # Only the style and category vary, so they come last
+        topic_prompt = f"{selected_style} {category}."
+        
+        return {
+            "model": self.deployment_name,
+            "messages": [
+                {"role": "system", "content": self.topic_instructions},
+                {"role": "user", "content": topic_prompt}
+            ],
+            "temperature": 1.2,  # Even higher temperature for more randomness
+            "max_tokens": 100,
+            "top_p": 0.9,  # Add nucleus sampling
+            "frequency_penalty": 0.5,  # Reduce repetition
+            "presence_penalty": 0.3   # Encourage new topics
+        }
+
+    def stats(self):
+        """Cache, triage, topic pool and context counters for /api/health"""
+        return {
+            "caches": {
+                "translation": self.translation_cache.stats(),
+                "correction": self.correction_cache.stats()
+            },
+            "single_flight": {
+                "translation": self.translation_flight.stats(),
+                "correction": self.correction_flight.stats()
+            },
+            "correction_triage": self.correction_triage.stats(),
+            "glossary": self.glossary.stats(),
+            "admission": self.admission.stats(),
+            "upstream": self.backends.stats(),
+            "tasks": self.task_stats.stats(self.task_profiles),
+            "topic_pool": self.topic_pool.stats() if self.topic_pool else None,
+            "opening_cache": self.opening_cache.stats() if self.opening_cache else None,
+            "context": self.context_builder.stats()
+        }
+
+class LazyTutor:
+    """Creates the tutor on first use.
+
+    Building it imports the openai SDK and sets up the clients, so a cold
+    start that only answers /api/health or a static file skips that work.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._tutor = None
+        self._lock = threading.Lock()
+        self._warm_up_started = False
+
+    def get(self):
+        if self._tutor is None:
+            with self._lock:
+                if self._tutor is None:
+                    self._tutor = self.factory()
+        return self._tutor
+
+    def peek(self):
+        """The tutor if it has been created, else None"""
+        return self._tutor
+
+    def warm_up_in_background(self):
+        """Create the tutor and open connections to Azure in a background thread (once)"""
+        with self._lock:
+            if self._warm_up_started:
+                return
+            self._warm_up_started = True
+        threading.Thread(target=lambda: self.get().backends.warm_up(), name="warm-up", daemon=True).start()
+
+tutor = LazyTutor(ChineseLanguageTutor)
+sessions = SessionStore(
+    max_messages=int(os.getenv("SESSION_MAX_MESSAGES", "20")),
+    idle_ttl=int(os.getenv("SESSION_IDLE_TTL", "1800")),
+    max_sessions=int(os.getenv("SESSION_MAX_SESSIONS", "10000")),
+    max_chars=int(os.getenv("SESSION_MAX_CHARS", "20000000"))
+)
+
+journal = RequestJournal.from_env()
+
+# Pinyin and word segmentation from the bundled dictionary; no Azure calls
+annotator = Annotator(cache_size=int(os.getenv("ANNOTATION_CACHE_SIZE", "2048")))
+
+static_assets = StaticAssets(
+    os.path.dirname(os.path.abspath(__file__)),
+    reload=os.getenv("STATIC_RELOAD", "0") == "1"
+)
+
+def json_body(data):
+    """A parsed JSON body as a dict ({} when there is none), or None if it isn't an object"""
+    if data is None:
+        return {}
+    return data if isinstance(data, dict) else None
+
+def chat_message_from(data):
+    """The stripped "message" of a chat body, or (None, error message)"""
+    message = data.get('message')
+    if message is not None and not isinstance(message, str):
+        return None, "message must be a string"
+    message = (message or '').strip()
+    if not message:
+        return None, "Message is required"
+    return message, None
+
+def batch_sentences(data):
+    """The stripped "sentences" of a /api/correct/batch body, or (None, error message)"""
+    sentences = data.get('sentences')
+    if not isinstance(sentences, list) or not sentences:
+        return None, "sentences must be a non-empty list"
+    if len(sentences) > BATCH_MAX_SENTENCES:
+        return None, f"At most {BATCH_MAX_SENTENCES} sentences per batch"
+    if not all(isinstance(sentence, str) for sentence in sentences):
+        return None, "Every sentence must be a string"
+    return [sentence.strip() for sentence in sentences], None
+
+def annotate_text(data):
+    """The "text" of a /api/annotate body, or (None, error message)"""
+    text = data.get('text')
+    if not isinstance(text, str) or not text.strip():
+        return None, "text is required"
+    if len(text) > ANNOTATE_MAX_CHARS:
+        return None, f"At most {ANNOTATE_MAX_CHARS} characters per request"
+    return text, None
+
+def conversation_history_from(data):
+    """The "conversation_history" of a chat or session body, or (None, error message)"""
+    history = data.get('conversation_history') or []
+    if not isinstance(history, list):
+        return None, "conversation_history must be a list"
+    for msg in history:
+        if not isinstance(msg, dict) or not isinstance(msg.get('message'), str):
+            return None, 'Every conversation_history entry must be an object with a "message" string'
+    return history, None
+
+def session_id_from(data):
+    """The "session_id" of a chat body (None without one), or (None, error message)"""
+    session_id = data.get('session_id')
+    if session_id is not None and not isinstance(session_id, str):
+        return None, "session_id must be a string"
+    return session_id, None
+
+def _not_an_object():
+    return jsonify({"error": "The request body must be a JSON object"}), 400
+
+def _unknown_session(session_id):
+    return jsonify({
+        "error": "Unknown or expired session",
+        "session_id": session_id
+    }), 404
+
+def _overloaded(e):
+    return jsonify({
+        "error": "The tutor is busy right now. Please try again shortly.",
+        "retry_after": e.retry_after
+    }), 429, {"Retry-After": str(e.retry_after)}
+
+def collect_metrics(tutor, sessions):
+    """Prometheus families for the counters the components already keep"""
+    families = [
+        ("tutor_sessions_active", "gauge", "Live conversation sessions", [({}, sessions.stats()["active"])])
+    ]
+    if tutor is None:
+        # Not created yet: nothing has been counted
+        return families
+    stats = tutor.stats()
+    for metric, key, help in (
+        ("tutor_cache_memory_hits_total", "memory_hits", "Cache hits served from memory"),
+        ("tutor_cache_disk_hits_total", "disk_hits", "Cache hits served from SQLite"),
+        ("tutor_cache_misses_total", "misses", "Cache misses")
+    ):
+        families.append((metric, "counter", help, [
+            ({"cache": name}, cache[key]) for name, cache in stats["caches"].items()
+        ]))
+    families.append(("tutor_cache_entries", "gauge", "Entries in the in-memory cache", [
+        ({"cache": name}, cache["size"]) for name, cache in stats["caches"].items()
+    ]))
+    families.append(("tutor_single_flight_merged_total", "counter", "Requests that joined an identical in-flight call", [
+        ({"call": name}, flight["merged"]) for name, flight in stats["single_flight"].items()
+    ]))
+    families.append(("tutor_correction_triage_total", "counter", "Correction triage decisions", [
+        ({"reason": reason}, count) for reason, count in stats["correction_triage"]["decisions"].items()
+    ]))
+    if stats["opening_cache"]:
+        families.append(("tutor_opening_replies_total", "counter", "History-free first messages by pooled reply result", [
+            ({"result": "served"}, stats["opening_cache"]["served"]),
+            ({"result": "miss"}, stats["opening_cache"]["misses"])
+        ]))
+    families.append(("tutor_glossary_interjections_total", "counter", "Interjection help answered locally, partly or by Azure", [
+        ({"outcome": outcome}, count) for outcome, count in stats["glossary"]["outcomes"].items()
+    ]))
+    admission = stats["admission"]
+    families += [
+        ("tutor_admission_queued", "gauge", "Azure calls waiting for admission", [({}, admission["queued"])]),
+        ("tutor_admission_rejected_total", "counter", "Azure calls rejected by admission control", [
+            ({"reason": "queue_full"}, admission["rejected_queue_full"]),
+            ({"reason": "evicted"}, admission["evicted"]),
+            ({"reason": "timeout"}, admission["rejected_timeout"])
+        ])
+    ]
+    upstream = stats["upstream"]
+    families += [
+        ("tutor_backend_circuit_open", "gauge", "1 while a backend's circuit is not closed", [
+            ({"backend": b["name"]}, int(b["state"] != "closed")) for b in upstream["backends"]
+        ]),
+        ("tutor_backend_in_flight", "gauge", "Azure calls in flight per backend", [
+            ({"backend": b["name"]}, b["in_flight"]) for b in upstream["backends"]
+        ]),
+        ("tutor_backend_failovers_total", "counter", "Calls retried on another backend", [({}, upstream["failovers"])]),
+        ("tutor_backend_hedges_total", "counter", "Hedged calls sent", [({}, upstream["hedges"])])
+    ]
+    if stats["topic_pool"] is not None:
+        families.append(("tutor_topic_pool_size", "gauge", "Pregenerated topics", [({}, stats["topic_pool"]["pooled"])]))
+    return families
+
+metrics.REGISTRY.set_collector("tutor", lambda: collect_metrics(tutor.peek(), sessions))
+
+def _route_label():
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = metrics.start_request()
+    if UPSTREAM_WARMUP:
+        # Flask has no startup hook, so the first request of any kind
+        # (usually a health check or the page itself) starts the warm-up
+        tutor.warm_up_in_background()
+
+@app.after_request
+def finish_request_metrics(response):
+    started = g.get("request_started")
+    if started is None:
+        return response
+    route, status = _route_label(), str(response.status_code)
+    metrics.observe_request(route, request.method, status, started)
+    # Streams keep making calls after the headers are sent; they write
+    # their own log line when they end
+    if response.mimetype != "text/event-stream":
+        spans = metrics.log_request(route, request.method, status, started, REQUEST_LOG)
+        if journal is not None and route in JOURNAL_ROUTES:
+            journal.record(journal_entry(
+                route, request.method, status, started,
+                request.get_json(silent=True), response.get_json(silent=True), spans
+            ))
+    return response
 
 @app.route('/')
 def index():
-    return send_from_directory('.', 'index.html')
+    return serve_static('index.html')
 
 @app.route('/<path:filename>')
 def serve_static(filename):
-    return send_from_directory('.', filename)
+    found = static_assets.response(
+        filename, request.headers.get("If-None-Match"), request.headers.get("Accept-Encoding")
+    )
+    if found is None:
+        abort(404)
+    status, headers, body = found
+    return Response(body, status, headers)
 
 @app.route('/api/chat', methods=['POST'])
 def chat():
     try:
-        print("DEBUG: Chat endpoint called")
-        data = request.get_json()
-        print(f"DEBUG: Received data: {data}")
+        data = json_body(request.get_json(silent=True))
+        if data is None:
+            return _not_an_object()
+        
+        user_message, message_error = chat_message_from(data)
+        conversation_history, history_error = conversation_history_from(data)
+        session_id, session_error = session_id_from(data)
+        mode = data.get('mode') or DEFAULT_CHAT_MODE
+        
+        if message_error:
+            return jsonify({"error": message_error}), 400
         
-        user_message = data.get('message', '').strip()
-        conversation_history = data.get('conversation_history', [])
+        if history_error:
+            return jsonify({"error": history_error}), 400
         
-        print(f"DEBUG: User message: {user_message}")
-        print(f"DEBUG: Conversation history length: {len(conversation_history)}")
+        if session_error:
+            return jsonify({"error": session_error}), 400
         
-        if not user_message:
-            return jsonify({"error": "Message is required"}), 400
+        if mode not in CHAT_MODES:
+            return jsonify({"error": f"Unknown mode '{mode}'. Use one of: {', '.join(CHAT_MODES)}"}), 400
         
-        # Check environment variables
-        print(f"DEBUG: API Key present: {bool(os.getenv('AZURE_OPENAI_API_KEY'))}")
-        print(f"DEBUG: Endpoint present: {bool(os.getenv('AZURE_OPENAI_ENDPOINT'))}")
+        history_base = None
+        if session_id:
+            conversation_history, history_base = sessions.context(session_id)
+            if conversation_history is None:
+                return _unknown_session(session_id)
         
-        result = tutor.get_conversation_response(user_message, conversation_history)
-        print(f"DEBUG: Got result: {result}")
+        result = tutor.get().respond(user_message, conversation_history, mode, history_base)
+        if data.get('annotate'):
+            result["annotation"] = annotator.annotate(result["response"])
+        
+        if session_id:
+            sessions.append_turn(session_id, user_message, result["response"])
+            result["session_id"] = session_id
         
         return jsonify(result)
         
+    except UpstreamOverloaded as e:
+        print(f"Chat endpoint overloaded: {e}")
+        return _overloaded(e)
     except Exception as e:
         print(f"Chat endpoint error: {e}")
         import traceback
@@ -424,10 +1232,149 @@ def chat():
             "translation": "Sorry, an error occurred."
         }), 500
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Server-Sent Events variant of /api/chat.
+
+    Emits "reply" events with text deltas as the reply is generated, then
+    "reply_done", "translation" and "correction" events, and a final "done".
+    "reply_done" and "done" carry the mode used ("mode" as in /api/chat).
+    With "annotate": true, "reply_done" also carries the reply's annotation.
+    """
+    data = json_body(request.get_json(silent=True))
+    if data is None:
+        return _not_an_object()
+    
+    user_message, message_error = chat_message_from(data)
+    conversation_history, history_error = conversation_history_from(data)
+    session_id, session_error = session_id_from(data)
+    mode = data.get('mode') or DEFAULT_CHAT_MODE
+    annotate = bool(data.get('annotate'))
+    
+    if message_error:
+        return jsonify({"error": message_error}), 400
+    
+    if history_error:
+        return jsonify({"error": history_error}), 400
+    
+    if session_error:
+        return jsonify({"error": session_error}), 400
+    
+    if mode not in CHAT_MODES:
+        return jsonify({"error": f"Unknown mode '{mode}'. Use one of: {', '.join(CHAT_MODES)}"}), 400
+    
+    history_base = None
+    if session_id:
+        conversation_history, history_base = sessions.context(session_id)
+        if conversation_history is None:
+            return _unknown_session(session_id)
+    
+    # Wait for the first event before sending headers, so a call rejected by
+    # admission control is still answered with a plain 429.
+    events = tutor.get().stream_conversation_response(user_message, conversation_history, history_base, mode)
+    try:
+        first_event = next(events)
+    except UpstreamOverloaded as e:
+        print(f"Chat stream overloaded: {e}")
+        return _overloaded(e)
+    
+    started = g.request_started
+    spans = metrics.current_spans()
+    
+    def generate():
+        metrics.resume_request(spans)
+        reply = {}
+        try:
+            for event, payload in itertools.chain([first_event], events):
+                if event == "reply_done" and session_id:
+                    sessions.append_turn(session_id, user_message, payload["response"])
+                if event == "reply_done" and annotate:
+                    payload = dict(payload, annotation=annotator.annotate(payload["response"]))
+                stream_reply(reply, event, payload)
+                yield f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            print(f"Chat stream error: {e}")
+            error = {'error': 'An error occurred processing your message'}
+            stream_reply(reply, "error", error)
+            yield f"event: error\ndata: {json.dumps(error)}\n\n"
+        finally:
+            # Skipped by finish_request_metrics, which runs before the body is sent
+            logged_spans = metrics.log_request("/api/chat/stream", "POST", "200", started, REQUEST_LOG)
+            if journal is not None:
+                journal.record(journal_entry("/api/chat/stream", "POST", 200, started, data, reply, logged_spans))
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+@app.route('/api/annotate', methods=['POST'])
+def annotate():
+    """Words and pinyin for a Chinese text, from the local dictionary.
+
+    Each token is {"word", "pinyin"}: one toned syllable per character,
+    or null for punctuation and anything else that isn't Chinese.
+    """
+    data = json_body(request.get_json(silent=True))
+    if data is None:
+        return _not_an_object()
+    text, error = annotate_text(data)
+    if error:
+        return jsonify({"error": error}), 400
+    return jsonify({"text": text, "tokens": annotator.annotate(text)})
+
+@app.route('/api/correct/batch', methods=['POST'])
+def correct_batch():
+    """Corrections for a list of sentences (e.g. a class's homework).
+
+    Only the correction step runs: no replies or translations. Results are
+    in the order of "sentences"; a failed sentence has an "error" instead
+    of a "correction".
+    """
+    data = json_body(request.get_json(silent=True))
+    if data is None:
+        return _not_an_object()
+    sentences, error = batch_sentences(data)
+    if error:
+        return jsonify({"error": error}), 400
+    
+    return jsonify({"results": tutor.get().correct_batch(sentences)})
+
+@app.route('/api/session', methods=['POST'])
+def create_session():
+    """Create a conversation session.
+
+    Afterwards /api/chat and /api/chat/stream only need "message" and
+    "session_id"; the server keeps the recent turns. An optional
+    "conversation_history" seeds the session (e.g. after a 404).
+    """
+    data = json_body(request.get_json(silent=True))
+    if data is None:
+        return _not_an_object()
+    conversation_history, error = conversation_history_from(data)
+    if error:
+        return jsonify({"error": error}), 400
+    
+    session_id = sessions.create(conversation_history)
+    return jsonify({
+        "session_id": session_id,
+        "max_messages": sessions.max_messages,
+        "idle_timeout": sessions.idle_ttl
+    }), 201
+
+@app.route('/api/session/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    sessions.delete(session_id)
+    return '', 204
+
 @app.route('/api/random-topic', methods=['GET'])
 def random_topic():
     try:
-        result = tutor.get_random_conversation_topic()
+        result = tutor.get().get_random_conversation_topic()
         return jsonify(result)
     except Exception as e:
         print(f"Random topic endpoint error: {e}")
@@ -437,18 +1384,30 @@ def random_topic():
             "translation": "How about we talk about today's weather?"
         }), 500
 
-@app.route('/api/health', methods=['GET'])
-def health():
-    env_status = {
+def environment_status():
+    return {
         "AZURE_OPENAI_API_KEY": bool(os.getenv("AZURE_OPENAI_API_KEY")),
         "AZURE_OPENAI_ENDPOINT": bool(os.getenv("AZURE_OPENAI_ENDPOINT")),
         "AZURE_OPENAI_DEPLOYMENT_NAME": bool(os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME")),
         "AZURE_OPENAI_API_VERSION": bool(os.getenv("AZURE_OPENAI_API_VERSION"))
     }
+
+@app.route('/api/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/api/health', methods=['GET'])
+def health():
     return jsonify({
         "status": "healthy", 
         "timestamp": datetime.now().isoformat(),
-        "environment_variables": env_status
+        "environment_variables": environment_status(),
+        "sessions": sessions.stats(),
+        "journal": journal.stats() if journal else None,
+        "static": static_assets.stats(),
+        "annotation": annotator.stats(),
+        "tutor_started": tutor.peek() is not None,
+        **(tutor.peek().stats() if tutor.peek() else {})
     })
 
 if __name__ == '__main__':
@@ -464,9 +1423,11 @@ if __name__ == '__main__':
         print("export AZURE_OPENAI_API_KEY='your-api-key'")
         print("export AZURE_OPENAI_ENDPOINT='your-endpoint'")
         print("export AZURE_OPENAI_DEPLOYMENT_NAME='your-deployment-name'")
-        print("export AZURE_OPENAI_API_VERSION='2024-02-01'")
+        print("export AZURE_OPENAI_API_VERSION='2024-10-21'")
         exit(1)
     
     print("Starting Chinese Language Learning App...")
     print("Open http://localhost:5000 in your browser")
+    # Pick up front-end edits without a restart, like the debug reloader does for code
+    static_assets.reload = True
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,647 @@
+"""Async serving mode: the chat API on Quart with AsyncAzureOpenAI.
+
+app.py's Flask app ties up a worker thread for the whole of every chat
+turn. Here Azure calls are awaited instead, so one process can hold
+hundreds of in-flight conversations. All upstream requests share one
+httpx connection pool with keep-alive, sized by:
+
+    UPSTREAM_MAX_CONNECTIONS   open connections to Azure (default 200)
+    UPSTREAM_MAX_KEEPALIVE     idle connections kept for reuse (default 50)
+    UPSTREAM_KEEPALIVE_EXPIRY  seconds an idle connection is kept (default 30)
+    UPSTREAM_TIMEOUT           seconds per Azure request (default 60)
+    UPSTREAM_WARMUP            1 to open the connections when serving starts
+
+Run with:  hypercorn asgi_app:app --bind 0.0.0.0:$PORT
+
+Prompts, parsing, caches, triage, sessions and the context builder are the
+same as in app.py. Background work (topic pool refills, conversation
+summaries) still runs on the synchronous client in its own threads.
+"""
+
+import asyncio
+import json
+import os
+import random
+import time
+from datetime import datetime
+
+import metrics
+from quart import Quart, Response, abort, g, jsonify, request
+from quart_cors import cors
+
+from admission import UpstreamOverloaded, estimate_request_tokens, retry_after_from
+from app import (
+    CHAT_ERROR_RESPONSE,
+    CHAT_MODES,
+    DEFAULT_CHAT_MODE,
+    FALLBACK_TOPICS,
+    FUSED_ERROR_RESPONSE,
+    REQUEST_LOG,
+    TOPIC_CATEGORIES,
+    UPSTREAM_WARMUP,
+    ChineseLanguageTutor,
+    LazyTutor,
+    annotate_text,
+    annotator,
+    batch_sentences,
+    chat_message_from,
+    collect_metrics,
+    conversation_history_from,
+    environment_status,
+    journal,
+    json_body,
+    session_id_from,
+    static_assets,
+)
+from cache import MISSING, normalize_text
+from journal import JOURNAL_ROUTES, journal_entry, stream_reply
+from sessions import SessionStore
+from triage import INTERJECTION, SKIP
+
+
+class AsyncChineseLanguageTutor(ChineseLanguageTutor):
+    """ChineseLanguageTutor whose request-path Azure calls are awaited"""
+
+    def __init__(self):
+        import httpx
+
+        super().__init__()
+        self.http_limits = httpx.Limits(
+            max_connections=int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "200")),
+            max_keepalive_connections=int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "50")),
+            keepalive_expiry=float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "30"))
+        )
+        self.http_client = httpx.AsyncClient(
+            limits=self.http_limits,
+            timeout=httpx.Timeout(float(os.getenv("UPSTREAM_TIMEOUT", "60")), connect=10.0)
+        )
+        self.backends.enable_async(self.http_client)
+        # Bounds /api/correct/batch work across all batches, like the
+        # batch thread pool in app.py
+        self.batch_semaphore = asyncio.Semaphore(self.batch_concurrency)
+
+    async def aclose(self):
+        await self.http_client.aclose()
+
+    async def _complete_async(self, task, **params):
+        """_complete() for the request path: waits for admission without blocking the loop"""
+        return await self._send_async(await self._admit_async(task, params))
+
+    async def _admit_async(self, task, params):
+        call = self._plan(task, params)
+        await self.admission.acquire_async(task, call[3])
+        return call
+
+    async def _send_async(self, call):
+        task, params, deployment, estimate = call
+        span = {"task": task, "deployment": deployment or self.deployment_name}
+        start = time.monotonic()
+        try:
+            response = await self.backends.complete_async(
+                params, deployment, span, self._extra_attempt_admission_async(task, estimate)
+            )
+        except Exception as e:
+            self._record_call(task, span, start, error=e)
+            if getattr(e, "status_code", None) == 429:
+                raise UpstreamOverloaded(retry_after_from(e), "azure_rate_limit") from e
+            raise
+
+        if params.get("stream"):
+            self._record_call(task, span, start)
+            return self._metered_stream_async(response, task, span, estimate)
+        self._record_call(task, span, start, response.usage)
+        if response.usage is not None:
+            self.admission.settle(estimate, response.usage.total_tokens)
+        return response
+
+    def _extra_attempt_admission_async(self, task, estimate):
+        async def admit(hedge=False):
+            if hedge:
+                return self.admission.try_acquire(task, estimate)
+            try:
+                await self.admission.acquire_async(task, estimate)
+            except UpstreamOverloaded:
+                return False
+            return True
+        return admit
+
+    async def _metered_stream_async(self, stream, task, span, estimate):
+        """_metered_stream() for an async stream"""
+        async for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                self._record_stream_usage(task, span, chunk.usage, estimate)
+            yield chunk
+
+    async def respond_async(self, user_message, conversation_history, mode=None, history_base=None):
+        mode = mode or DEFAULT_CHAT_MODE
+        # Pools are filled by a background thread on the synchronous client
+        result = self._cached_opening(user_message, conversation_history, mode)
+        if result is not None:
+            result["cached"] = True
+        elif mode == "fused":
+            result = await self.process_message_async(user_message, conversation_history, history_base)
+        else:
+            result = await self.get_conversation_response_async(user_message, conversation_history, history_base)
+        result["mode"] = mode
+        return result
+
+    async def process_message_async(self, user_message, conversation_history, history_base=None):
+        try:
+            response = await self._complete_async(
+                "chat", **self._fused_request(user_message, conversation_history, history_base)
+            )
+            return self._parse_fused_response(response.choices[0].message.content.strip(), user_message)
+        except UpstreamOverloaded:
+            raise
+        except Exception as e:
+            print(f"Error processing message: {e}")
+            metrics.record_fallback("fused_error")
+            return dict(FUSED_ERROR_RESPONSE)
+
+    async def get_conversation_response_async(self, user_message, conversation_history, history_base=None):
+        correction_task = None
+        try:
+            chat_call = await self._admit_async(
+                "chat", self._chat_request(user_message, conversation_history, history_base)
+            )
+            # Started once the chat call is admitted, as in app.py
+            correction_task = asyncio.create_task(self._analyze_for_corrections_async(user_message))
+
+            response = await self._send_async(chat_call)
+            ai_response = response.choices[0].message.content.strip()
+
+            translation = await self._get_translation_async(ai_response)
+            correction = await correction_task
+
+            return {
+                "response": ai_response,
+                "translation": translation,
+                "correction": correction
+            }
+        except Exception as e:
+            if correction_task is not None:
+                correction_task.cancel()
+            if isinstance(e, UpstreamOverloaded):
+                raise
+            print(f"ERROR in get_conversation_response_async: {e}")
+            metrics.record_fallback("chat_error")
+            return dict(CHAT_ERROR_RESPONSE)
+
+    async def stream_conversation_response_async(self, user_message, conversation_history, history_base=None,
+                                                 mode="pipeline"):
+        """Async variant of stream_conversation_response, with the same events"""
+        cached = self._cached_opening(user_message, conversation_history, mode)
+        if cached is not None:
+            for event in self._bundle_events(dict(cached, cached=True), mode):
+                yield event
+            return
+        if mode == "fused":
+            result = await self.process_message_async(user_message, conversation_history, history_base)
+            for event in self._bundle_events(result, mode):
+                yield event
+            return
+
+        chat_call = await self._admit_async(
+            "chat", self._chat_request(user_message, conversation_history, history_base, stream=True)
+        )
+        correction_task = asyncio.create_task(self._analyze_for_corrections_async(user_message))
+
+        chunks = []
+        try:
+            stream = await self._send_async(chat_call)
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    chunks.append(delta)
+                    yield "reply", {"delta": delta}
+            ai_response = "".join(chunks).strip()
+            if not ai_response:
+                raise ValueError("Empty streamed response")
+        except Exception as e:
+            print(f"ERROR in stream_conversation_response_async: {e}")
+            if not chunks:
+                correction_task.cancel()
+                if isinstance(e, UpstreamOverloaded):
+                    raise
+                metrics.record_fallback("chat_error")
+                yield "reply_done", {"response": CHAT_ERROR_RESPONSE["response"], "mode": mode}
+                yield "translation", {"translation": CHAT_ERROR_RESPONSE["translation"]}
+                yield "done", {"mode": mode}
+                return
+            ai_response = "".join(chunks).strip()
+
+        yield "reply_done", {"response": ai_response, "mode": mode}
+
+        translation_task = asyncio.create_task(self._get_translation_async(ai_response))
+        pending = {translation_task: "translation", correction_task: "correction"}
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                event = pending.pop(task)
+                yield event, {event: task.result()}
+
+        yield "done", {"mode": mode}
+
+    async def _analyze_for_corrections_async(self, text):
+        try:
+            return await self._corrections_async(text)
+        except Exception as e:
+            print(f"Error analyzing corrections: {e}")
+            metrics.record_fallback("correction_error")
+            return None
+
+    async def _corrections_async(self, text):
+        decision, reason = self.correction_triage.classify(text)
+        if decision == SKIP:
+            return None
+        if decision == INTERJECTION:
+            local = self._glossary_correction(text)
+            if local is not MISSING:
+                return local
+
+        cache_key = self._correction_cache_key(text)
+        cached = self.correction_cache.get(cache_key)
+        if cached is not MISSING:
+            return cached
+
+        return await self.correction_flight.do_async(cache_key, self._fetch_corrections_async, text, cache_key)
+
+    async def correct_batch_async(self, sentences):
+        keys = [self._correction_cache_key(sentence) for sentence in sentences]
+        tasks = {}
+        for sentence, key in zip(sentences, keys):
+            if sentence and key not in tasks:
+                tasks[key] = asyncio.create_task(self._batch_correction_async(sentence))
+        if tasks:
+            await asyncio.wait(tasks.values())
+        return [self._batch_item(sentence, tasks.get(key)) for sentence, key in zip(sentences, keys)]
+
+    async def _batch_correction_async(self, sentence):
+        async with self.batch_semaphore:
+            return await self._corrections_async(sentence)
+
+    async def _fetch_corrections_async(self, text, cache_key):
+        interjections = self._detect_english_interjections(text)
+        task = "interjection" if interjections else "correction"
+        response = await self._complete_async(task, **self._correction_request(text, interjections))
+        correction, cacheable = self._parse_correction(
+            response.choices[0].message.content.strip(), text, interjections
+        )
+        if cacheable:
+            self.correction_cache.set(cache_key, correction)
+        return correction
+
+    async def _get_translation_async(self, chinese_text):
+        cache_key = normalize_text(chinese_text)
+        cached = self.translation_cache.get(cache_key)
+        if cached is not MISSING:
+            return cached
+
+        try:
+            return await self.translation_flight.do_async(cache_key, self._fetch_translation_async, chinese_text, cache_key)
+        except Exception as e:
+            print(f"Error getting translation: {e}")
+            metrics.record_fallback("translation_error")
+            return "Translation not available"
+
+    async def _fetch_translation_async(self, chinese_text, cache_key):
+        response = await self._complete_async("translation", **self._translation_request(chinese_text))
+        translation = response.choices[0].message.content.strip()
+        if translation:
+            self.translation_cache.set(cache_key, translation)
+        return translation
+
+    async def get_random_conversation_topic_async(self):
+        if self.topic_pool is not None:
+            self.topic_pool.start()
+            topic = self.topic_pool.pop()
+            if topic is not None:
+                return topic
+
+        try:
+            response = await self._complete_async("topic", **self._topic_request(random.choice(TOPIC_CATEGORIES)))
+            chinese_topic = response.choices[0].message.content.strip()
+            if not chinese_topic:
+                raise ValueError("Empty topic from Azure")
+            english_translation = await self._get_translation_async(chinese_topic)
+            if english_translation == "Translation not available":
+                raise ValueError(f"No translation for topic: {chinese_topic}")
+            return {
+                "topic": chinese_topic,
+                "translation": english_translation
+            }
+        except Exception as e:
+            print(f"Error getting random topic: {e}")
+            metrics.record_fallback("topic_error")
+            return random.choice(FALLBACK_TOPICS)
+
+    def stats(self):
+        stats = super().stats()
+        stats["http_pool"] = {
+            "max_connections": self.http_limits.max_connections,
+            "max_keepalive_connections": self.http_limits.max_keepalive_connections,
+            "keepalive_expiry": self.http_limits.keepalive_expiry
+        }
+        return stats
+
+
+app = cors(Quart(__name__))
+
+tutor = LazyTutor(AsyncChineseLanguageTutor)
+sessions = SessionStore(
+    max_messages=int(os.getenv("SESSION_MAX_MESSAGES", "20")),
+    idle_ttl=int(os.getenv("SESSION_IDLE_TTL", "1800")),
+    max_sessions=int(os.getenv("SESSION_MAX_SESSIONS", "10000")),
+    max_chars=int(os.getenv("SESSION_MAX_CHARS", "20000000"))
+)
+
+# Replaces the collector app.py registered for its own tutor
+metrics.REGISTRY.set_collector("tutor", lambda: collect_metrics(tutor.peek(), sessions))
+
+# Kept so the warm-up task isn't garbage collected while it runs
+_warm_up_task = None
+
+@app.before_serving
+async def warm_up():
+    global _warm_up_task
+    if UPSTREAM_WARMUP:
+        _warm_up_task = asyncio.create_task(_warm_up())
+
+async def _warm_up():
+    instance = await _get_tutor()
+    await instance.backends.warm_up_async()
+
+async def _get_tutor():
+    """tutor.get() for async routes"""
+    instance = tutor.peek()
+    if instance is None:
+        # Built in a thread: importing the SDK would otherwise stall the loop
+        instance = await asyncio.to_thread(tutor.get)
+    return instance
+
+@app.after_serving
+async def close_upstream():
+    if tutor.peek() is not None:
+        await tutor.peek().aclose()
+
+def _route_label():
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+@app.before_request
+async def start_request_metrics():
+    g.request_started = metrics.start_request()
+
+@app.after_request
+async def finish_request_metrics(response):
+    started = g.get("request_started")
+    if started is None:
+        return response
+    route, status = _route_label(), str(response.status_code)
+    metrics.observe_request(route, request.method, status, started)
+    if response.mimetype != "text/event-stream":
+        spans = metrics.log_request(route, request.method, status, started, REQUEST_LOG)
+        if journal is not None and route in JOURNAL_ROUTES:
+            journal.record(journal_entry(
+                route, request.method, status, started,
+                await request.get_json(silent=True), await response.get_json(silent=True), spans
+            ))
+    return response
+
+def _not_an_object():
+    return jsonify({"error": "The request body must be a JSON object"}), 400
+
+def _unknown_session(session_id):
+    return jsonify({
+        "error": "Unknown or expired session",
+        "session_id": session_id
+    }), 404
+
+def _overloaded(e):
+    return jsonify({
+        "error": "The tutor is busy right now. Please try again shortly.",
+        "retry_after": e.retry_after
+    }), 429, {"Retry-After": str(e.retry_after)}
+
+@app.route('/')
+async def index():
+    return await serve_static('index.html')
+
+@app.route('/<path:filename>')
+async def serve_static(filename):
+    found = static_assets.response(
+        filename, request.headers.get("If-None-Match"), request.headers.get("Accept-Encoding")
+    )
+    if found is None:
+        abort(404)
+    status, headers, body = found
+    return Response(body, status, headers)
+
+@app.route('/api/chat', methods=['POST'])
+async def chat():
+    try:
+        data = json_body(await request.get_json(silent=True))
+        if data is None:
+            return _not_an_object()
+
+        user_message, message_error = chat_message_from(data)
+        conversation_history, history_error = conversation_history_from(data)
+        session_id, session_error = session_id_from(data)
+        mode = data.get('mode') or DEFAULT_CHAT_MODE
+
+        if message_error:
+            return jsonify({"error": message_error}), 400
+
+        if history_error:
+            return jsonify({"error": history_error}), 400
+
+        if session_error:
+            return jsonify({"error": session_error}), 400
+
+        if mode not in CHAT_MODES:
+            return jsonify({"error": f"Unknown mode '{mode}'. Use one of: {', '.join(CHAT_MODES)}"}), 400
+
+        history_base = None
+        if session_id:
+            conversation_history, history_base = sessions.context(session_id)
+            if conversation_history is None:
+                return _unknown_session(session_id)
+
+        instance = await _get_tutor()
+        result = await instance.respond_async(user_message, conversation_history, mode, history_base)
+        if data.get('annotate'):
+            result["annotation"] = annotator.annotate(result["response"])
+
+        if session_id:
+            sessions.append_turn(session_id, user_message, result["response"])
+            result["session_id"] = session_id
+
+        return jsonify(result)
+
+    except UpstreamOverloaded as e:
+        print(f"Chat endpoint overloaded: {e}")
+        return _overloaded(e)
+    except Exception as e:
+        print(f"Chat endpoint error: {e}")
+        return jsonify({
+            "error": "An error occurred processing your message",
+            "response": "抱歉，出现了错误。",
+            "translation": "Sorry, an error occurred."
+        }), 500
+
+@app.route('/api/chat/stream', methods=['POST'])
+async def chat_stream():
+    data = json_body(await request.get_json(silent=True))
+    if data is None:
+        return _not_an_object()
+
+    user_message, message_error = chat_message_from(data)
+    conversation_history, history_error = conversation_history_from(data)
+    session_id, session_error = session_id_from(data)
+    mode = data.get('mode') or DEFAULT_CHAT_MODE
+    annotate = bool(data.get('annotate'))
+
+    if message_error:
+        return jsonify({"error": message_error}), 400
+
+    if history_error:
+        return jsonify({"error": history_error}), 400
+
+    if session_error:
+        return jsonify({"error": session_error}), 400
+
+    if mode not in CHAT_MODES:
+        return jsonify({"error": f"Unknown mode '{mode}'. Use one of: {', '.join(CHAT_MODES)}"}), 400
+
+    history_base = None
+    if session_id:
+        conversation_history, history_base = sessions.context(session_id)
+        if conversation_history is None:
+            return _unknown_session(session_id)
+
+    # As in app.py, wait for the first event so a rejected call gets a 429
+    instance = await _get_tutor()
+    events = instance.stream_conversation_response_async(user_message, conversation_history, history_base, mode)
+    try:
+        first_event = await events.__anext__()
+    except UpstreamOverloaded as e:
+        print(f"Chat stream overloaded: {e}")
+        return _overloaded(e)
+
+    reply = {}
+
+    def encode(event, payload):
+        if event == "reply_done" and session_id:
+            sessions.append_turn(session_id, user_message, payload["response"])
+        if event == "reply_done" and annotate:
+            payload = dict(payload, annotation=annotator.annotate(payload["response"]))
+        stream_reply(reply, event, payload)
+        return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8")
+
+    started = g.request_started
+    spans = metrics.current_spans()
+
+    async def generate():
+        # The body may be sent from another task than the view's; carry the
+        # request's spans over so the stream's later calls are logged with it
+        metrics.resume_request(spans)
+        try:
+            yield encode(*first_event)
+            async for event, payload in events:
+                yield encode(event, payload)
+        except Exception as e:
+            print(f"Chat stream error: {e}")
+            yield encode("error", {"error": "An error occurred processing your message"})
+        finally:
+            logged_spans = metrics.log_request("/api/chat/stream", "POST", "200", started, REQUEST_LOG)
+            if journal is not None:
+                journal.record(journal_entry("/api/chat/stream", "POST", 200, started, data, reply, logged_spans))
+
+    response = Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+    response.timeout = None
+    return response
+
+@app.route('/api/annotate', methods=['POST'])
+async def annotate():
+    data = json_body(await request.get_json(silent=True))
+    if data is None:
+        return _not_an_object()
+    text, error = annotate_text(data)
+    if error:
+        return jsonify({"error": error}), 400
+    # Long texts take milliseconds; keep them off the event loop
+    tokens = await asyncio.to_thread(annotator.annotate, text)
+    return jsonify({"text": text, "tokens": tokens})
+
+@app.route('/api/correct/batch', methods=['POST'])
+async def correct_batch():
+    data = json_body(await request.get_json(silent=True))
+    if data is None:
+        return _not_an_object()
+    sentences, error = batch_sentences(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    instance = await _get_tutor()
+    return jsonify({"results": await instance.correct_batch_async(sentences)})
+
+@app.route('/api/session', methods=['POST'])
+async def create_session():
+    data = json_body(await request.get_json(silent=True))
+    if data is None:
+        return _not_an_object()
+    conversation_history, error = conversation_history_from(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    session_id = sessions.create(conversation_history)
+    return jsonify({
+        "session_id": session_id,
+        "max_messages": sessions.max_messages,
+        "idle_timeout": sessions.idle_ttl
+    }), 201
+
+@app.route('/api/session/<session_id>', methods=['DELETE'])
+async def delete_session(session_id):
+    sessions.delete(session_id)
+    return '', 204
+
+@app.route('/api/random-topic', methods=['GET'])
+async def random_topic():
+    try:
+        instance = await _get_tutor()
+        return jsonify(await instance.get_random_conversation_topic_async())
+    except Exception as e:
+        print(f"Random topic endpoint error: {e}")
+        return jsonify({
+            "error": "An error occurred getting a random topic",
+            "topic": "我们聊聊今天的天气吧？",
+            "translation": "How about we talk about today's weather?"
+        }), 500
+
+@app.route('/api/metrics', methods=['GET'])
+async def prometheus_metrics():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/api/health', methods=['GET'])
+async def health():
+    return jsonify({
+        "status": "healthy",
+        "timestamp": datetime.now().isoformat(),
+        "server": "asgi",
+        "environment_variables": environment_status(),
+        "sessions": sessions.stats(),
+        "journal": journal.stats() if journal else None,
+        "static": static_assets.stats(),
+        "annotation": annotator.stats(),
+        "tutor_started": tutor.peek() is not None,
+        **(tutor.peek().stats() if tutor.peek() else {})
+    })
@@ -0,0 +1,485 @@
+"""Routing of Azure OpenAI calls across several endpoint/deployment pairs.
+
+Each backend keeps a moving average of its latency and error rate. Calls
+go to the backend with the best score. A backend that keeps failing has
+its circuit opened: it gets no traffic for `cooldown` seconds, then one
+probe call decides whether it is closed again. Failed calls fail over to
+the next backend. With hedging on, a call that runs past the backend's
+p95 latency gets a second copy sent to another backend; whichever answers
+first wins. The hedge delay counts from when the call goes out, and
+failover and hedge attempts go through the caller's admission control
+(see the admit argument of BackendPool.complete).
+
+Backends are configured with AZURE_OPENAI_BACKENDS, a JSON list such as
+
+    [{"name": "eastus", "endpoint": "https://a.openai.azure.com", "deployment": "gpt-4"},
+     {"name": "westeu", "endpoint": "https://b.openai.azure.com", "deployment": "gpt-4",
+      "api_key": "..."}]
+
+Missing fields fall back to the single-backend AZURE_OPENAI_* variables,
+which are used on their own when AZURE_OPENAI_BACKENDS is not set.
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import openai
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+LATENCY_ALPHA = 0.2
+ERROR_ALPHA = 0.1
+# Score multipliers: a backend failing half its calls looks 3x slower, and
+# each call already in flight on it adds a quarter of its latency
+ERROR_PENALTY = 4
+IN_FLIGHT_PENALTY = 0.25
+# Added to every score so untried backends still spread their load
+BASE_SCORE = 0.05
+# Samples needed before hedging uses a backend's p95 instead of the minimum delay
+MIN_P95_SAMPLES = 20
+# Oldest API version that accepts stream_options (token usage on streamed replies)
+STREAM_USAGE_API_VERSION = "2024-06-01"
+
+
+def is_backend_failure(error):
+    """Whether an error counts against the backend (rather than the request)"""
+    if isinstance(error, asyncio.CancelledError):
+        return False
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return True
+
+
+def _annotate(span, backend, deployment):
+    """Note on span which backend answered; a losing hedge that finishes later doesn't overwrite it"""
+    if span is not None and "backend" not in span:
+        span["backend"] = backend.name
+        span["deployment"] = deployment or backend.deployment
+
+
+class Backend:
+    """One Azure endpoint/deployment pair and its health"""
+
+    def __init__(self, name, endpoint, deployment, api_key, api_version, max_retries=2):
+        self.name = name
+        self.endpoint = endpoint
+        self.deployment = deployment
+        self.api_key = api_key
+        self.api_version = api_version
+        self.max_retries = max_retries
+        self.client = openai.AzureOpenAI(
+            api_key=api_key,
+            api_version=api_version,
+            azure_endpoint=endpoint,
+            max_retries=max_retries
+        )
+        self.async_client = None
+
+        # Moving averages, guarded by the pool's lock
+        self.latency = None
+        self.error_rate = 0.0
+        self.samples = deque(maxlen=100)
+        self.in_flight = 0
+
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+
+        self.calls = 0
+        self.errors = 0
+        self.trips = 0
+
+    def arguments(self, params, deployment=None):
+        """create() keyword arguments for params on this backend"""
+        arguments = dict(params, model=deployment or self.deployment)
+        if "stream_options" in arguments and self.api_version[:10] < STREAM_USAGE_API_VERSION:
+            # Older API versions reject the field instead of ignoring it
+            del arguments["stream_options"]
+        return arguments
+
+    def p95(self):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+class BackendPool:
+    """Latency-aware routing with failover, hedging and per-backend circuit breakers"""
+
+    def __init__(self, backends, hedge=False, hedge_min_delay=1.0, hedge_budget=0.1, max_attempts=2,
+                 failure_threshold=5, cooldown=30.0, hedge_workers=32):
+        self.backends = list(backends)
+        self.hedge = hedge and len(self.backends) > 1
+        self.hedge_min_delay = hedge_min_delay
+        # Hedges may add at most this fraction of extra calls
+        self.hedge_budget = hedge_budget
+        self.max_attempts = max_attempts
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+        self._lock = threading.Lock()
+        # Hedged calls run here, so they never block the tutor's own
+        # executor. Every non-streamed call is hedged while the budget
+        # allows, so size it for the number of concurrent completions.
+        self._executor = ThreadPoolExecutor(max_workers=hedge_workers, thread_name_prefix="hedge") if self.hedge else None
+
+        self.requests = 0
+        self.failovers = 0
+        self.hedges = 0
+        self.hedges_won = 0
+        self.hedges_denied = 0
+
+    @classmethod
+    def from_env(cls):
+        api_key = os.getenv("AZURE_OPENAI_API_KEY")
+        api_version = os.getenv("AZURE_OPENAI_API_VERSION", "2024-10-21")
+        endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
+        deployment = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4")
+
+        configs = json.loads(os.getenv("AZURE_OPENAI_BACKENDS") or "[]") or [{"name": "default"}]
+        # With several backends a failing call moves on to the next one
+        # instead of retrying the same backend
+        default_retries = "2" if len(configs) == 1 else "0"
+        max_retries = int(os.getenv("AZURE_OPENAI_MAX_RETRIES", default_retries))
+
+        backends = [
+            Backend(
+                config.get("name") or f"backend-{i}",
+                config.get("endpoint") or endpoint,
+                config.get("deployment") or deployment,
+                config.get("api_key") or api_key,
+                config.get("api_version") or api_version,
+                max_retries=max_retries
+            )
+            for i, config in enumerate(configs)
+        ]
+        return cls(
+            backends,
+            hedge=os.getenv("HEDGE_ENABLED", "0") == "1",
+            hedge_min_delay=float(os.getenv("HEDGE_MIN_DELAY", "1.0")),
+            hedge_budget=float(os.getenv("HEDGE_BUDGET", "0.1")),
+            failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5")),
+            cooldown=float(os.getenv("CIRCUIT_COOLDOWN", "30")),
+            hedge_workers=int(os.getenv("HEDGE_WORKERS", "32"))
+        )
+
+    def enable_async(self, http_client):
+        """Create async clients for every backend, sharing one httpx pool"""
+        for backend in self.backends:
+            backend.async_client = openai.AsyncAzureOpenAI(
+                api_key=backend.api_key,
+                api_version=backend.api_version,
+                azure_endpoint=backend.endpoint,
+                max_retries=backend.max_retries,
+                http_client=http_client
+            )
+
+    def warm_up(self):
+        """Open a pooled connection to every backend ahead of the first call.
+
+        Listing models costs no tokens, and any answer, even an error status,
+        leaves a kept-alive connection in the client's pool.
+        """
+        start = time.monotonic()
+        for backend in self.backends:
+            try:
+                backend.client.with_options(max_retries=0, timeout=10).models.list()
+            except openai.APIStatusError:
+                pass
+            except Exception as e:
+                print(f"Warm-up of backend {backend.name} failed: {e}")
+        print(f"Warmed up {len(self.backends)} backend(s) in {(time.monotonic() - start) * 1000:.0f} ms")
+
+    async def warm_up_async(self):
+        start = time.monotonic()
+
+        async def warm(backend):
+            try:
+                await backend.async_client.with_options(max_retries=0, timeout=10).models.list()
+            except openai.APIStatusError:
+                pass
+            except Exception as e:
+                print(f"Warm-up of backend {backend.name} failed: {e}")
+
+        await asyncio.gather(*(warm(backend) for backend in self.backends))
+        print(f"Warmed up {len(self.backends)} backend(s) in {(time.monotonic() - start) * 1000:.0f} ms")
+
+    def complete(self, params, deployment=None, span=None, admit=None):
+        """Run a chat completion on the best backend.
+
+        params["model"] is replaced by deployment, or by each backend's own
+        deployment when it is None. The backend and deployment that answered
+        are written to span, if given.
+
+        admit, if given, is asked before every call beyond the first:
+        admit() for a failover, which may wait, and admit(hedge=True) for a
+        hedge, which must not. When it returns False the failover gives up
+        with the last error and the hedge is not sent.
+        """
+        tried = []
+        error = None
+        for attempt in range(min(self.max_attempts, len(self.backends))):
+            backend = self._pick(tried)
+            if backend is None:
+                break
+            if attempt and admit is not None and not admit():
+                self._release(backend)
+                break
+            tried.append(backend)
+            if span is not None:
+                span["attempts"] = attempt + 1
+            if attempt:
+                self._count("failovers")
+            try:
+                if self._should_hedge(params):
+                    return self._hedged(backend, params, tried, deployment, span, admit)
+                return self._call(backend, params, deployment, span)
+            except Exception as e:
+                if not is_backend_failure(e):
+                    raise
+                error = e
+        raise error
+
+    async def complete_async(self, params, deployment=None, span=None, admit=None):
+        """complete() for coroutines; admit is a coroutine function here"""
+        tried = []
+        error = None
+        for attempt in range(min(self.max_attempts, len(self.backends))):
+            backend = self._pick(tried)
+            if backend is None:
+                break
+            if attempt and admit is not None and not await admit():
+                self._release(backend)
+                break
+            tried.append(backend)
+            if span is not None:
+                span["attempts"] = attempt + 1
+            if attempt:
+                self._count("failovers")
+            try:
+                if self._should_hedge(params):
+                    return await self._hedged_async(backend, params, tried, deployment, span, admit)
+                return await self._call_async(backend, params, deployment, span)
+            except Exception as e:
+                if not is_backend_failure(e):
+                    raise
+                error = e
+        raise error
+
+    def _call(self, backend, params, deployment=None, span=None):
+        start = time.monotonic()
+        error = None
+        try:
+            response = backend.client.chat.completions.create(**backend.arguments(params, deployment))
+            _annotate(span, backend, deployment)
+            return response
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._record(backend, time.monotonic() - start, error)
+
+    async def _call_async(self, backend, params, deployment=None, span=None):
+        start = time.monotonic()
+        error = None
+        try:
+            response = await backend.async_client.chat.completions.create(**backend.arguments(params, deployment))
+            _annotate(span, backend, deployment)
+            return response
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._record(backend, time.monotonic() - start, error)
+
+    def _hedged(self, primary, params, tried, deployment=None, span=None, admit=None):
+        started = threading.Event()
+
+        def attempt():
+            started.set()
+            return self._call(primary, params, deployment, span)
+
+        first = self._executor.submit(attempt)
+        # Time the hedge delay from when the call goes out, not from when it
+        # started waiting for a free worker
+        started.wait()
+        done, _ = wait([first], timeout=self._hedge_delay(primary))
+        if done:
+            return first.result()
+
+        backup = self._pick(tried)
+        if backup is None:
+            return first.result()
+        if admit is not None and not admit(hedge=True):
+            self._release(backup)
+            self._count("hedges_denied")
+            return first.result()
+        tried.append(backup)
+        self._count("hedges")
+        second = self._executor.submit(self._call, backup, params, deployment, span)
+
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # The slower call can't be interrupted; it finishes in the
+                    # background and still updates its backend's averages
+                    if future is second:
+                        self._count("hedges_won")
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def _hedged_async(self, primary, params, tried, deployment=None, span=None, admit=None):
+        first = asyncio.ensure_future(self._call_async(primary, params, deployment, span))
+        done, _ = await asyncio.wait([first], timeout=self._hedge_delay(primary))
+        if done:
+            return first.result()
+
+        backup = self._pick(tried)
+        if backup is None:
+            return await first
+        if admit is not None and not await admit(hedge=True):
+            self._release(backup)
+            self._count("hedges_denied")
+            return await first
+        tried.append(backup)
+        self._count("hedges")
+        second = asyncio.ensure_future(self._call_async(backup, params, deployment, span))
+
+        pending = {first, second}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self._count("hedges_won")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _should_hedge(self, params):
+        if not self.hedge or params.get("stream"):
+            return False
+        with self._lock:
+            self.requests += 1
+            return self.hedges < self.hedge_budget * self.requests
+
+    def _hedge_delay(self, backend):
+        with self._lock:
+            p95 = backend.p95() if len(backend.samples) >= MIN_P95_SAMPLES else None
+        return max(self.hedge_min_delay, p95 or 0.0)
+
+    def _pick(self, exclude=()):
+        """Best available backend not in exclude (or None), counted as in flight"""
+        with self._lock:
+            now = time.monotonic()
+            candidates = [b for b in self.backends if b not in exclude and self._available(b, now)]
+            if not candidates and not exclude:
+                # Every circuit is open: rather than failing outright, try the
+                # backend that has been resting longest
+                candidates = [min(self.backends, key=lambda b: b.opened_at)]
+            if not candidates:
+                return None
+            backend = min(candidates, key=self._score)
+            if backend.state == HALF_OPEN:
+                backend.probing = True
+            backend.in_flight += 1
+            return backend
+
+    def _release(self, backend):
+        """Undo _pick() for a backend that ended up not being called"""
+        with self._lock:
+            backend.in_flight -= 1
+            if backend.state == HALF_OPEN:
+                backend.probing = False
+
+    def _available(self, backend, now):
+        if backend.state == OPEN and now - backend.opened_at >= self.cooldown:
+            backend.state = HALF_OPEN
+            backend.probing = False
+        if backend.state == HALF_OPEN:
+            return not backend.probing
+        return backend.state == CLOSED
+
+    def _score(self, backend):
+        latency = backend.latency or 0.0
+        return ((BASE_SCORE + latency)
+                * (1 + ERROR_PENALTY * backend.error_rate)
+                * (1 + IN_FLIGHT_PENALTY * backend.in_flight))
+
+    def _record(self, backend, latency, error):
+        failed = error is not None and is_backend_failure(error)
+        with self._lock:
+            backend.in_flight -= 1
+            if isinstance(error, asyncio.CancelledError):
+                # A losing hedge: says nothing about the backend
+                backend.probing = False
+                return
+            backend.calls += 1
+            backend.error_rate += ERROR_ALPHA * ((1.0 if failed else 0.0) - backend.error_rate)
+            if failed:
+                backend.errors += 1
+                backend.consecutive_failures += 1
+                if backend.state == HALF_OPEN or backend.consecutive_failures >= self.failure_threshold:
+                    if backend.state != OPEN:
+                        backend.trips += 1
+                    backend.state = OPEN
+                    backend.opened_at = time.monotonic()
+                    backend.probing = False
+                return
+            if error is None:
+                if backend.latency is None:
+                    backend.latency = latency
+                else:
+                    backend.latency += LATENCY_ALPHA * (latency - backend.latency)
+                backend.samples.append(latency)
+            backend.consecutive_failures = 0
+            backend.state = CLOSED
+            backend.probing = False
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        with self._lock:
+            backends = []
+            for backend in self.backends:
+                p95 = backend.p95()
+                backends.append({
+                    "name": backend.name,
+                    "deployment": backend.deployment,
+                    "state": backend.state,
+                    "latency_ms": round(backend.latency * 1000) if backend.latency is not None else None,
+                    "p95_ms": round(p95 * 1000) if p95 is not None else None,
+                    "error_rate": round(backend.error_rate, 4),
+                    "in_flight": backend.in_flight,
+                    "calls": backend.calls,
+                    "errors": backend.errors,
+                    "circuit_trips": backend.trips
+                })
+            return {
+                "backends": backends,
+                "failovers": self.failovers,
+                "hedging": self.hedge,
+                "hedges": self.hedges,
+                "hedges_won": self.hedges_won,
+                "hedges_denied": self.hedges_denied
+            }
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Load benchmark for the Chinese Language Learning App.
+
+Starts fake_azure_server.py and the app (Flask or the async server) on
+local ports, drives the API at a fixed concurrency, and prints a JSON
+report: p50/p95/p99 latency per route, requests per second, errors, and
+Azure calls per request as counted by the fake server.
+
+    python benchmark.py --server flask --concurrency 20 --requests 500
+    python benchmark.py --server asgi --concurrency 200 --duration 30 \
+        --latency lognormal:0.8:0.4 --output bench-asgi.json
+    python benchmark.py --url http://localhost:5000 --fake-url http://localhost:8765
+
+Reports include the git commit, so runs can be compared across commits.
+Settings such as CHAT_MODE or AZURE_OPENAI_RPM are passed to the app
+through the environment.
+"""
+
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+# Learner messages; repeats are intentional, as in a real class
+MESSAGES = [
+    "你好", "谢谢", "我很好", "我是学生", "我喜欢吃中国菜", "今天天气很好",
+    "我昨天去了商店买东西", "我想喝 coffee", "我的周末很 busy", "我不会说中文很好",
+    "我明天要去北京旅游", "我有一个哥哥和一个妹妹", "我在大学学习中文两年了",
+    "你喜欢什么运动？", "我每天早上七点起床", "我觉得中文很难但是很有意思",
+    "我的爱好是看电影和听音乐", "他是我的好朋友", "我们一起去吃饭吧", "再见"
+]
+
+ROUTES = {
+    "chat": ("POST", "/api/chat"),
+    "chat-stream": ("POST", "/api/chat/stream"),
+    "random-topic": ("GET", "/api/random-topic"),
+    "health": ("GET", "/api/health")
+}
+
+SERVER_COMMANDS = {
+    "flask": [sys.executable, "-c",
+              "import sys; from app import app; app.run(host='127.0.0.1', port=int(sys.argv[1]), threaded=True)"],
+    "asgi": [sys.executable, "-m", "hypercorn", "asgi_app:app", "--bind"]
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(ordered, p):
+    if not ordered:
+        return None
+    index = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, errors, duration):
+    ordered = sorted(latencies)
+    count = len(ordered)
+    ms = lambda value: round(value * 1000, 1) if value is not None else None
+    return {
+        "requests": count,
+        "errors": errors,
+        "rps": round(count / duration, 2) if duration else None,
+        "latency_ms": {
+            "mean": ms(sum(ordered) / count) if count else None,
+            "p50": ms(percentile(ordered, 50)),
+            "p95": ms(percentile(ordered, 95)),
+            "p99": ms(percentile(ordered, 99)),
+            "max": ms(ordered[-1]) if count else None
+        }
+    }
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ROUTES:
+            raise SystemExit(f"Unknown route in --mix: {name} (use {', '.join(ROUTES)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def fake_stats(fake_url):
+    with urllib.request.urlopen(f"{fake_url}/stats", timeout=10) as response:
+        return json.loads(response.read())
+
+
+def reset_fake(fake_url):
+    request = urllib.request.Request(f"{fake_url}/reset", data=b"{}", method="POST")
+    urllib.request.urlopen(request, timeout=10).read()
+
+
+class LoadGenerator:
+    def __init__(self, base_url, mix, mode=None, unique=False, timeout=60):
+        self.base_url = base_url
+        self.routes = list(mix)
+        self.weights = [mix[name] for name in self.routes]
+        self.mode = mode
+        self.unique = unique
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sent = 0
+        self.results = {name: {"latencies": [], "errors": 0, "status": {}} for name in self.routes}
+
+    def request_once(self, route):
+        method, path = ROUTES[route]
+        data = None
+        headers = {}
+        if method == "POST":
+            message = random.choice(MESSAGES)
+            if self.unique:
+                # Defeat the caches to measure the uncached path
+                message = f"{message}{random.randint(0, 10 ** 9)}"
+            body = {"message": message, "conversation_history": []}
+            if self.mode:
+                body["mode"] = self.mode
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        request = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            status = e.code
+        except (urllib.error.URLError, OSError):
+            status = 0
+        return status, time.perf_counter() - start
+
+    def run(self, concurrency, total=None, duration=None, record=True):
+        deadline = time.monotonic() + duration if duration else None
+        self._sent = 0
+
+        def worker():
+            while True:
+                with self._lock:
+                    if total is not None and self._sent >= total:
+                        return
+                    self._sent += 1
+                if deadline is not None and time.monotonic() >= deadline:
+                    return
+                route = random.choices(self.routes, self.weights)[0]
+                status, latency = self.request_once(route)
+                if not record:
+                    continue
+                with self._lock:
+                    result = self.results[route]
+                    result["status"][str(status)] = result["status"].get(str(status), 0) + 1
+                    if status == 200:
+                        result["latencies"].append(latency)
+                    else:
+                        result["errors"] += 1
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start
+
+
+def wait_until_up(url, process, path="/api/health", timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise SystemExit(f"Server for {url} exited with code {process.returncode}")
+        try:
+            urllib.request.urlopen(f"{url}{path}", timeout=2).read()
+            return
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    raise SystemExit(f"Server at {url} did not come up within {timeout}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the app against a fake Azure OpenAI server")
+    parser.add_argument("--server", choices=sorted(SERVER_COMMANDS), default="flask",
+                        help="App server to start (ignored with --url)")
+    parser.add_argument("--url", help="Benchmark an already running app instead of starting one")
+    parser.add_argument("--fake-url", help="Fake Azure server used by an app given with --url (for upstream counts)")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, help="Total requests (default 200 unless --duration is given)")
+    parser.add_argument("--duration", type=float, help="Run for this many seconds instead of a request count")
+    parser.add_argument("--warmup", type=int, default=10, help="Unrecorded requests sent first")
+    parser.add_argument("--mix", default="chat=8,random-topic=1,health=1",
+                        help="Route weights, from: " + ", ".join(ROUTES))
+    parser.add_argument("--mode", choices=["pipeline", "fused"], help="Chat mode sent with each message")
+    parser.add_argument("--unique", action="store_true", help="Make every message unique (no cache hits)")
+    parser.add_argument("--latency", action="append", default=[],
+                        help="Fake server latency: SPEC or TASK=SPEC (see fake_azure_server.py)")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--bodies", help="JSON file of canned fake server bodies per task")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    total = args.requests if args.requests or args.duration else 200
+    mix = parse_mix(args.mix)
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    fake = None
+    fake_url = args.fake_url
+    process = None
+    if not args.url:
+        # The fake server runs in its own process so it doesn't compete with
+        # the load generator's threads
+        fake_port = free_port()
+        fake_command = [sys.executable, os.path.join(here, "fake_azure_server.py"), "--port", str(fake_port),
+                        "--error-rate", str(args.error_rate), "--error-status", str(args.error_status)]
+        for spec in args.latency:
+            fake_command += ["--latency", spec]
+        if args.bodies:
+            fake_command += ["--bodies", args.bodies]
+        fake = subprocess.Popen(fake_command, stdout=subprocess.DEVNULL)
+        fake_url = f"http://127.0.0.1:{fake_port}"
+
+        port = free_port()
+        env = dict(os.environ)
+        env.update({
+            "AZURE_OPENAI_API_KEY": "benchmark",
+            "AZURE_OPENAI_ENDPOINT": fake_url
+        })
+        env.pop("AZURE_OPENAI_BACKENDS", None)
+        command = SERVER_COMMANDS[args.server]
+        command = command + [f"127.0.0.1:{port}"] if args.server == "asgi" else command + [str(port)]
+        process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=here)
+        base_url = f"http://127.0.0.1:{port}"
+    else:
+        base_url = args.url.rstrip("/")
+
+    try:
+        if fake is not None:
+            wait_until_up(fake_url, fake, path="/stats")
+        wait_until_up(base_url, process)
+        load = LoadGenerator(base_url, mix, mode=args.mode, unique=args.unique)
+        if args.warmup:
+            load.run(min(args.concurrency, args.warmup), total=args.warmup, record=False)
+        if fake_url:
+            reset_fake(fake_url)
+
+        duration = load.run(args.concurrency, total=None if args.duration else total, duration=args.duration)
+
+        routes = {}
+        all_latencies = []
+        all_errors = 0
+        for route, result in load.results.items():
+            routes[ROUTES[route][1]] = dict(summarize(result["latencies"], result["errors"], duration),
+                                            status=result["status"])
+            all_latencies += result["latencies"]
+            all_errors += result["errors"]
+        overall = summarize(all_latencies, all_errors, duration)
+
+        report = {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(),
+            "config": {
+                "server": "external" if args.url else args.server,
+                "concurrency": args.concurrency,
+                "requests": total if not args.duration else None,
+                "duration_s": args.duration,
+                "mix": mix,
+                "mode": args.mode or os.getenv("CHAT_MODE", "pipeline"),
+                "unique_messages": args.unique,
+                "latency": args.latency or ["0.3"],
+                "error_rate": args.error_rate
+            },
+            "elapsed_s": round(duration, 3),
+            "overall": overall,
+            "routes": routes
+        }
+        if fake_url:
+            upstream = fake_stats(fake_url)
+            sent = overall["requests"] + overall["errors"]
+            report["upstream"] = dict(
+                upstream,
+                calls_per_request=round(upstream["requests"] / sent, 3) if sent else None
+            )
+
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        print(output)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                f.write(output + "\n")
+    finally:
+        for child in (process, fake):
+            if child is None:
+                continue
+            child.terminate()
+            try:
+                child.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                child.kill()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Offline grammar and interjection corrections for large JSONL corpora.
+
+Each input line is a JSON object with the text in --field (default
+"text") and an optional id in --id-field (default "id"); a line that is
+just a JSON string is also accepted. Output is one JSON line per input
+line, in input order:
+
+    {"line": 1, "id": "essay-1", "correction": {...}}          # null: no errors
+    {"line": 2, "id": "essay-2", "sentences": [{"sentence": ..., "correction": ...}]}   # --split
+    {"line": 3, "id": "essay-3", "error": "..."}
+
+    python bulk_correct.py essays.jsonl graded.jsonl --workers 8 --rpm 300 --split
+
+Lines are read lazily and at most a few per worker are in flight, so memory
+use doesn't depend on the size of the input. Progress is checkpointed to
+OUTPUT.checkpoint; running the same command again resumes after the last
+line written (--restart starts over). When Azure keeps answering 429 after
+--max-retries, the run stops with exit code 75 and can be resumed later.
+
+Uses the same Azure settings, caches (CACHE_DB_PATH) and task deployments
+(AZURE_OPENAI_TASK_DEPLOYMENTS) as the web app.
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from admission import AdmissionController, UpstreamOverloaded
+
+# sysexits.h EX_TEMPFAIL: try again later
+EXIT_OVERLOADED = 75
+
+SENTENCE_RE = re.compile(r"[^。！？!?\n]+[。！？!?]*")
+
+
+def read_items(path, field, id_field, skip=0):
+    """Yield (line number, id, text, error) for each non-blank line after skip"""
+    with open(path, "rb") as f:
+        for number, raw in enumerate(f, 1):
+            if number <= skip:
+                continue
+            try:
+                line = raw.decode("utf-8").strip()
+            except UnicodeDecodeError:
+                yield number, None, None, "Invalid UTF-8"
+                continue
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                yield number, None, None, "Invalid JSON"
+                continue
+            if isinstance(item, str):
+                yield number, None, item, None
+            elif isinstance(item, dict) and isinstance(item.get(field), str):
+                yield number, item.get(id_field), item[field], None
+            else:
+                yield number, None, None, f"No text in field '{field}'"
+
+
+def split_sentences(text):
+    return [sentence.strip() for sentence in SENTENCE_RE.findall(text) if sentence.strip()]
+
+
+def load_checkpoint(path, input_path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            checkpoint = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    if checkpoint.get("input") != os.path.abspath(input_path):
+        raise SystemExit(f"{path} belongs to another input ({checkpoint.get('input')}); use --restart")
+    return checkpoint
+
+
+def save_checkpoint(path, input_path, line, output_bytes, counts, done=False):
+    temporary = path + ".tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump({
+            "input": os.path.abspath(input_path),
+            "line": line,
+            "output_bytes": output_bytes,
+            "counts": counts,
+            "done": done
+        }, f)
+    os.replace(temporary, path)
+
+
+class Grader:
+    def __init__(self, tutor, split=False, max_retries=5):
+        self.tutor = tutor
+        self.split = split
+        self.max_retries = max_retries
+
+    def correct(self, text):
+        """Correction for one text, retrying while Azure is overloaded"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.tutor._corrections(text)
+            except UpstreamOverloaded as e:
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(min(60, e.retry_after * 2 ** attempt))
+
+    def grade(self, text):
+        if not self.split:
+            return {"correction": self.correct(text)}
+        return {"sentences": [
+            {"sentence": sentence, "correction": self.correct(sentence)}
+            for sentence in split_sentences(text)
+        ]}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Correct a JSONL corpus of learner texts")
+    parser.add_argument("input", help="JSONL input")
+    parser.add_argument("output", help="JSONL output (appended to when resuming)")
+    parser.add_argument("--field", default="text", help="Field holding the text")
+    parser.add_argument("--id-field", default="id", help="Field copied to the output to identify each line")
+    parser.add_argument("--split", action="store_true", help="Correct each sentence of a text separately")
+    parser.add_argument("--workers", type=int, default=4, help="Corrections running at once")
+    parser.add_argument("--rpm", type=int, default=0, help="Azure requests per minute cap (0 = no cap)")
+    parser.add_argument("--tpm", type=int, default=0, help="Azure tokens per minute cap (0 = no cap)")
+    parser.add_argument("--max-retries", type=int, default=5, help="Retries of a text while Azure answers 429")
+    parser.add_argument("--checkpoint-every", type=int, default=100, help="Lines between checkpoints")
+    parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint and start over")
+    return parser.parse_args(argv)
+
+
+def process(grader, args):
+    """Grade args.input into args.output, resuming from the checkpoint.
+
+    Returns (exit code, counts). The checkpoint is marked done only when
+    every line was written; on any other exception it records the lines
+    written so far and the exception propagates.
+    """
+    checkpoint_path = args.output + ".checkpoint"
+    checkpoint = None if args.restart else load_checkpoint(checkpoint_path, args.input)
+    if checkpoint and not os.path.exists(args.output):
+        raise SystemExit(f"{args.output} is missing; use --restart to start over")
+    skip = 0
+    counts = {"lines": 0, "errors": 0}
+    output = open(args.output, "r+b" if checkpoint else "wb")
+    if checkpoint:
+        # Drop anything written after the last checkpoint; those lines are redone
+        skip = checkpoint["line"]
+        counts = checkpoint["counts"]
+        output.truncate(checkpoint["output_bytes"])
+        output.seek(checkpoint["output_bytes"])
+        print(f"Resuming after line {skip}", file=sys.stderr)
+
+    last_line = skip
+    since_checkpoint = 0
+    pending = deque()
+    exit_code = 0
+    completed = False
+
+    def write_next():
+        # The line leaves pending only once written, so a line whose result
+        # raises stays first and is redone on resume
+        write(*pending[0])
+        pending.popleft()
+
+    def write(number, item_id, future, error):
+        nonlocal last_line, since_checkpoint
+        record = {"line": number}
+        if item_id is not None:
+            record["id"] = item_id
+        if future is not None:
+            try:
+                record.update(future.result())
+            except UpstreamOverloaded:
+                raise
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+        if error:
+            record["error"] = error
+            counts["errors"] += 1
+        counts["lines"] += 1
+        output.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+        last_line = number
+        since_checkpoint += 1
+        if since_checkpoint >= args.checkpoint_every:
+            output.flush()
+            save_checkpoint(checkpoint_path, args.input, last_line, output.tell(), counts)
+            since_checkpoint = 0
+
+    def finished(future):
+        # A line whose result can still be written after the run stopped
+        if future is None:
+            return True
+        if future.cancelled() or not future.done():
+            return False
+        return not isinstance(future.exception(), UpstreamOverloaded)
+
+    # Up to a few lines per worker are read ahead; results are written in
+    # input order as they complete
+    window = args.workers * 4
+    pool = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="bulk")
+    try:
+        for number, item_id, text, error in read_items(args.input, args.field, args.id_field, skip):
+            future = pool.submit(grader.grade, text) if error is None else None
+            pending.append((number, item_id, future, error))
+            while pending and (len(pending) >= window or pending[0][2] is None or pending[0][2].done()):
+                write_next()
+        while pending:
+            write_next()
+        completed = True
+    except UpstreamOverloaded as e:
+        print(f"Stopping: {e}. Run the same command again to resume.", file=sys.stderr)
+        exit_code = EXIT_OVERLOADED
+    except KeyboardInterrupt:
+        print("Interrupted. Run the same command again to resume.", file=sys.stderr)
+        exit_code = 130
+    finally:
+        for _, _, future, _ in pending:
+            if future is not None:
+                future.cancel()
+        pool.shutdown(wait=True, cancel_futures=True)
+        try:
+            # Keep the results that finished before the stop, up to the
+            # first one that didn't, so a resume doesn't redo them
+            while pending and finished(pending[0][2]):
+                write_next()
+        except Exception as e:
+            print(f"Error writing finished lines: {e}", file=sys.stderr)
+        output.flush()
+        save_checkpoint(checkpoint_path, args.input, last_line, output.tell(), counts, done=completed)
+        output.close()
+        if not completed:
+            print(f"Checkpoint saved after line {last_line}.", file=sys.stderr)
+    return exit_code, counts
+
+
+def main():
+    args = parse_args()
+    checkpoint = None if args.restart else load_checkpoint(args.output + ".checkpoint", args.input)
+    if checkpoint and checkpoint.get("done"):
+        print(f"{args.input} was already processed into {args.output} (use --restart to redo it)", file=sys.stderr)
+        return
+
+    # Imported here so --help works without Azure settings
+    from app import ChineseLanguageTutor
+    tutor = ChineseLanguageTutor()
+    # Offline work can wait as long as it takes for quota
+    tutor.admission = AdmissionController(rpm=args.rpm, tpm=args.tpm, max_queue=max(100, args.workers),
+                                          max_wait=3600)
+    grader = Grader(tutor, args.split, args.max_retries)
+
+    started = time.monotonic()
+    exit_code, counts = process(grader, args)
+    elapsed = time.monotonic() - started
+    print(json.dumps({
+        "lines": counts["lines"],
+        "errors": counts["errors"],
+        "elapsed_s": round(elapsed, 1),
+        "upstream": tutor.task_stats.stats(tutor.task_profiles),
+        "correction_cache": tutor.correction_cache.stats()
+    }, ensure_ascii=False), file=sys.stderr)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
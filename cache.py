@@ -0,0 +1,274 @@
+"""Caches used by ChineseLanguageTutor to avoid repeating Azure calls.
+
+TieredCache combines an in-process LRU (bounded by size and TTL) with an
+optional SQLite store. The SQLite file survives restarts and can be shared
+by several gunicorn workers on the same machine. SingleFlight covers the
+gap before a result is cached: identical requests that arrive together
+share one upstream call.
+"""
+
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+# Returned by get() when a key is not cached, so None can be cached too.
+MISSING = object()
+
+
+def normalize_text(text):
+    """Normalize text for use as a cache key (NFKC, collapsed whitespace)"""
+    text = unicodedata.normalize("NFKC", text or "")
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class LRUCache:
+    """Thread-safe in-memory LRU cache with a per-entry TTL"""
+
+    def __init__(self, max_size=1024, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISSING
+            value, expires_at = entry
+            if expires_at < time.time():
+                del self._data[key]
+                return MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteStore:
+    """Persistent key/value store shared between processes via one SQLite file"""
+
+    # Expired rows are purged once every this many writes.
+    PURGE_EVERY = 500
+
+    def __init__(self, path, namespace, ttl=86400):
+        self.path = path
+        self.namespace = namespace
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        conn.commit()
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared across threads, so keep one
+        # per thread. WAL lets readers in other workers run during writes.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+            (self.namespace, key)
+        ).fetchone()
+        if row is None or row[1] < time.time():
+            return MISSING
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (self.namespace, key, json.dumps(value, ensure_ascii=False), expires_at)
+        )
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            conn.execute(
+                "DELETE FROM cache WHERE namespace = ? AND expires_at < ?",
+                (self.namespace, time.time())
+            )
+        conn.commit()
+
+
+class TieredCache:
+    """In-memory LRU in front of an optional SQLite store, with hit/miss counters"""
+
+    def __init__(self, name, max_size=1024, ttl=3600, db_path=None):
+        self.name = name
+        self.memory = LRUCache(max_size=max_size, ttl=ttl)
+        self.store = SQLiteStore(db_path, namespace=name, ttl=ttl) if db_path else None
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.store_errors = 0
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not MISSING:
+            self._count("memory_hits")
+            return value
+
+        if self.store is not None:
+            try:
+                value = self.store.get(key)
+            except sqlite3.Error as e:
+                print(f"Error reading {self.name} cache: {e}")
+                self._count("store_errors")
+                value = MISSING
+            if value is not MISSING:
+                self.memory.set(key, value)
+                self._count("disk_hits")
+                return value
+
+        self._count("misses")
+        return MISSING
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.store is not None:
+            try:
+                self.store.set(key, value)
+            except sqlite3.Error as e:
+                print(f"Error writing {self.name} cache: {e}")
+                self._count("store_errors")
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "size": len(self.memory),
+            "max_size": self.memory.max_size,
+            "persistent": self.store is not None,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "store_errors": self.store_errors,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0
+        }
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one in-flight call.
+
+    The first caller for a key runs fn; callers arriving while it runs wait
+    for it and get the same result, or the same exception. Nothing is kept
+    once the call finishes, so this is not a cache.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.merged = 0
+        self.errors = 0
+
+    def do(self, key, fn, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.merged += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args)
+            return call.result
+        except Exception as e:
+            call.error = e
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def do_async(self, key, fn, *args):
+        """do() for coroutine functions; call from a single event loop"""
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args))
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._finished(key, t))
+            with self._lock:
+                self.calls += 1
+        else:
+            with self._lock:
+                self.merged += 1
+        # Shielded so a caller that goes away doesn't cancel the shared call
+        return await asyncio.shield(task)
+
+    def _finished(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled() and task.exception() is not None:
+            with self._lock:
+                self.errors += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._calls) + len(self._tasks),
+                "upstream_calls": self.calls,
+                "merged": self.merged,
+                "errors": self.errors
+            }
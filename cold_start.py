@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark: what a fresh process (a new gunicorn worker, a
+Vercel cold start) pays before it can answer.
+
+Each run starts a new interpreter that imports the app, then times its
+first /api/health, first static file and first /api/chat (against
+fake_azure_server.py), and notes whether the openai SDK had been loaded
+by then. The report has the median and worst run of each:
+
+    python cold_start.py --runs 10
+    python cold_start.py --server asgi --warm-up --output cold-asgi.json
+    python cold_start.py --max-import-ms 400     # exit 1 on a regression, e.g. in CI
+
+The run fails (exit code 1) if /api/health or a static file loads the SDK
+(checked without --warm-up, which loads it on purpose), or if
+--max-import-ms / --max-first-chat-ms are exceeded. With --warm-up the
+first static file is slower: it shares the interpreter with the SDK import
+running in the background.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+from benchmark import git_commit
+from fake_azure_server import build_server
+
+# Runs in the fresh interpreter; prints one JSON line of timings
+CHILD = r'''
+import asyncio, json, sys, time
+
+def ms(start):
+    return round((time.perf_counter() - start) * 1000, 1)
+
+server, idle = sys.argv[1], float(sys.argv[2])
+result = {}
+chat = {"message": "我昨天去了商店", "conversation_history": []}
+
+if server == "flask":
+    start = time.perf_counter()
+    import app
+    result["import_ms"] = ms(start)
+    result["sdk_after_import"] = "openai" in sys.modules
+    client = app.app.test_client()
+    start = time.perf_counter()
+    client.get("/api/health")
+    result["first_health_ms"] = ms(start)
+    result["sdk_after_health"] = "openai" in sys.modules
+    start = time.perf_counter()
+    client.get("/styles.css")
+    result["first_static_ms"] = ms(start)
+    result["sdk_after_static"] = "openai" in sys.modules
+    time.sleep(idle)
+    start = time.perf_counter()
+    status = client.post("/api/chat", json=chat).status_code
+    result["first_chat_ms"] = ms(start)
+else:
+    start = time.perf_counter()
+    import asgi_app
+    result["import_ms"] = ms(start)
+    result["sdk_after_import"] = "openai" in sys.modules
+
+    async def main():
+        async with asgi_app.app.test_app() as test_app:
+            client = test_app.test_client()
+            start = time.perf_counter()
+            await client.get("/api/health")
+            result["first_health_ms"] = ms(start)
+            result["sdk_after_health"] = "openai" in sys.modules
+            start = time.perf_counter()
+            await client.get("/styles.css")
+            result["first_static_ms"] = ms(start)
+            result["sdk_after_static"] = "openai" in sys.modules
+            await asyncio.sleep(idle)
+            start = time.perf_counter()
+            response = await client.post("/api/chat", json=chat)
+            result["first_chat_ms"] = ms(start)
+            return response.status_code
+
+    status = asyncio.run(main())
+result["chat_status"] = status
+print(json.dumps(result))
+'''
+
+TIMINGS = ("process_ms", "import_ms", "first_health_ms", "first_static_ms", "first_chat_ms")
+CHECKS = ("sdk_after_health", "sdk_after_static")
+
+
+def run_once(server, idle, env, cwd):
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-c", CHILD, server, str(idle)], env=env, cwd=cwd,
+                               capture_output=True, text=True, timeout=120)
+    if completed.returncode != 0:
+        raise SystemExit(f"Cold-start run failed:\n{completed.stderr}")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result["process_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the app's cold start")
+    parser.add_argument("--server", choices=["flask", "asgi"], default="flask")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--warm-up", action="store_true", help="Run with UPSTREAM_WARMUP=1")
+    parser.add_argument("--idle", type=float, default=0.5,
+                        help="Seconds between the first static file and the first chat")
+    parser.add_argument("--latency", default="0.05", help="Fake Azure latency spec")
+    parser.add_argument("--max-import-ms", type=float, help="Fail if the median import time is higher")
+    parser.add_argument("--max-first-chat-ms", type=float, help="Fail if the median first chat is slower")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    fake = build_server(port=0, latency=args.latency)
+    threading.Thread(target=fake.serve_forever, daemon=True).start()
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env.update({
+        "AZURE_OPENAI_API_KEY": "cold-start",
+        "AZURE_OPENAI_ENDPOINT": f"http://127.0.0.1:{fake.server_port}",
+        "UPSTREAM_WARMUP": "1" if args.warm_up else "0",
+        "REQUEST_LOG": "0",
+        "PYTHONDONTWRITEBYTECODE": "1"
+    })
+    env.pop("AZURE_OPENAI_BACKENDS", None)
+    env.pop("REQUEST_JOURNAL_PATH", None)
+
+    runs = [run_once(args.server, args.idle, env, here) for _ in range(args.runs)]
+    fake.shutdown()
+
+    summary = {}
+    for name in TIMINGS:
+        values = [run[name] for run in runs]
+        summary[name] = {"median": round(statistics.median(values), 1), "max": max(values)}
+    failures = []
+    if not args.warm_up:
+        failures += [f"{check} in {sum(run[check] for run in runs)} run(s)" for check in CHECKS
+                     if any(run[check] for run in runs)]
+    if any(run["chat_status"] != 200 for run in runs):
+        failures.append("first chat did not return 200")
+    if args.max_import_ms is not None and summary["import_ms"]["median"] > args.max_import_ms:
+        failures.append(f"median import {summary['import_ms']['median']} ms > {args.max_import_ms} ms")
+    if args.max_first_chat_ms is not None and summary["first_chat_ms"]["median"] > args.max_first_chat_ms:
+        failures.append(f"median first chat {summary['first_chat_ms']['median']} ms > {args.max_first_chat_ms} ms")
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(),
+        "config": {
+            "server": args.server,
+            "runs": args.runs,
+            "warm_up": args.warm_up,
+            "idle_s": args.idle,
+            "latency": args.latency
+        },
+        "summary": summary,
+        "sdk_loaded_by_import": any(run["sdk_after_import"] for run in runs),
+        "failures": failures,
+        "runs": runs
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""Token-budgeted prompt context for the chat completions.
+
+Recent turns are included newest-first until the budget is used up. Older
+turns are folded into a running summary that is extended once every
+`summary_interval` messages and cached, so prompt size stays flat on long
+conversations without re-summarizing on every request.
+
+Summaries are keyed by a rolling hash over the folded messages, so the same
+key is produced whether a client re-uploads its full history or a session
+only holds the most recent messages (see SessionStore).
+"""
+
+import hashlib
+import math
+import threading
+
+from cache import MISSING
+from triage import CJK_RE
+
+# Rough cl100k-style estimate: common hanzi are 1-2 tokens, other text ~4 chars/token
+CJK_TOKENS_PER_CHAR = 1.5
+CHARS_PER_TOKEN = 4
+# Role and formatting tokens added per chat message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text):
+    """Cheap local token estimate, no tokenizer needed"""
+    cjk = len(CJK_RE.findall(text))
+    return math.ceil(cjk * CJK_TOKENS_PER_CHAR + (len(text) - cjk) / CHARS_PER_TOKEN)
+
+
+def roll_key(key, sender, text):
+    """Extend a rolling conversation key by one message"""
+    return hashlib.sha1(f"{key}\x1f{sender}\x1f{text}".encode("utf-8")).hexdigest()
+
+
+class ContextBuilder:
+    """Fits the system prompt, a running summary and recent turns into a token budget"""
+
+    def __init__(self, summarize, summary_cache, token_budget=1500, max_messages=12, summary_interval=6,
+                 summary_tokens=200, max_fold_messages=40, executor=None):
+        # summarize(previous_summary, turns) returns the new summary text or raises;
+        # turns are (role, content) pairs.
+        self.summarize = summarize
+        self.summary_cache = summary_cache
+        self.token_budget = token_budget
+        # Recent messages kept verbatim at most, even if they would fit
+        self.max_messages = max_messages
+        self.summary_interval = summary_interval
+        self.summary_tokens = summary_tokens
+        self.max_fold_messages = max_fold_messages
+        # Summaries are built here when set; otherwise inline
+        self.executor = executor
+
+        self._pending = set()
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.folded_builds = 0
+        self.summaries_built = 0
+        self.summary_errors = 0
+
+    def build(self, system_content, conversation_history, user_message, history_base=None):
+        """Return the chat messages for a turn.
+
+        conversation_history uses the /api/chat format. If its last entry is
+        the current user message (as the browser client sends it) it is not
+        repeated. history_base is (index, key) of the first history entry
+        when older messages are no longer available (sessions).
+        """
+        base_index, base_key = history_base or (0, "")
+        turns = self._turns(conversation_history, user_message)
+
+        available = (self.token_budget
+                     - estimate_tokens(system_content)
+                     - estimate_tokens(user_message)
+                     - 2 * MESSAGE_OVERHEAD_TOKENS)
+
+        # Walk back from the newest turn while the full turns still fit
+        first_kept = len(turns)
+        used = 0
+        while first_kept > 0 and len(turns) - first_kept < self.max_messages:
+            cost = estimate_tokens(turns[first_kept - 1][1]) + MESSAGE_OVERHEAD_TOKENS
+            if used + cost > available:
+                break
+            used += cost
+            first_kept -= 1
+
+        summary = None
+        if first_kept > 0:
+            # Older turns don't fit: reserve room for the summary and refit
+            available -= self.summary_tokens + MESSAGE_OVERHEAD_TOKENS
+            while first_kept < len(turns) and used > available:
+                used -= estimate_tokens(turns[first_kept][1]) + MESSAGE_OVERHEAD_TOKENS
+                first_kept += 1
+            summary = self._summary_before(turns, first_kept, base_index, base_key)
+
+        messages = [{"role": "system", "content": system_content}]
+        if summary:
+            messages.append({
+                "role": "system",
+                "content": f"Summary of the earlier conversation: {summary}"
+            })
+        for role, content in turns[first_kept:]:
+            messages.append({"role": role, "content": content})
+        messages.append({"role": "user", "content": user_message})
+
+        with self._lock:
+            self.builds += 1
+            if summary:
+                self.folded_builds += 1
+        return messages
+
+    def _turns(self, conversation_history, user_message):
+        history = list(conversation_history or [])
+        if history and history[-1].get('sender') == 'user' and history[-1].get('message') == user_message:
+            history = history[:-1]
+        turns = []
+        for msg in history:
+            if msg.get('sender') == 'user':
+                turns.append(("user", msg.get('message') or ""))
+            elif msg.get('sender') == 'ai':
+                turns.append(("assistant", msg.get('message') or ""))
+        return turns
+
+    def _summary_before(self, turns, first_kept, base_index, base_key):
+        """Summary of the turns before first_kept, or None.
+
+        Summaries only exist at absolute message positions that are
+        multiples of summary_interval, so the key is the same on every
+        request until the next boundary is crossed. The newest boundary at
+        or before first_kept is summarized; the turns from first_kept on
+        are always sent verbatim, so until that summary is built the newest
+        cached one is used and no recent turn is dropped.
+        """
+        interval = self.summary_interval
+        target = (base_index + first_kept) // interval * interval - base_index
+        if target < 0 or base_index + target == 0:
+            return None
+
+        keys = [base_key]
+        for role, content in turns[:target]:
+            keys.append(roll_key(keys[-1], role, content))
+
+        # Newest cached summary at or before the target boundary
+        summary, position = None, 0
+        for candidate in range(target, -1, -1):
+            if base_index + candidate > 0 and (base_index + candidate) % interval == 0:
+                cached = self.summary_cache.get(keys[candidate])
+                if cached is not MISSING:
+                    summary, position = cached, candidate
+                    break
+
+        if position < target:
+            self._schedule(keys[target], summary, turns[position:target])
+            if self.executor is None:
+                built = self.summary_cache.get(keys[target])
+                if built is not MISSING:
+                    summary = built
+        return summary
+
+    def _schedule(self, key, previous_summary, new_turns):
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+
+        new_turns = new_turns[-self.max_fold_messages:]
+        if self.executor is None:
+            self._build_summary(key, previous_summary, new_turns)
+        else:
+            self.executor.submit(self._build_summary, key, previous_summary, new_turns)
+
+    def _build_summary(self, key, previous_summary, new_turns):
+        try:
+            summary = self.summarize(previous_summary, new_turns)
+            if summary:
+                self.summary_cache.set(key, summary)
+                with self._lock:
+                    self.summaries_built += 1
+        except Exception as e:
+            print(f"Error summarizing conversation: {e}")
+            with self._lock:
+                self.summary_errors += 1
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "token_budget": self.token_budget,
+                "max_messages": self.max_messages,
+                "builds": self.builds,
+                "builds_with_summary": self.folded_builds,
+                "summaries_built": self.summaries_built,
+                "summary_errors": self.summary_errors,
+                "summaries_pending": len(self._pending),
+                "summary_cache": self.summary_cache.stats()
+            }
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Azure OpenAI chat completions API, for benchmarks
+and for trying the app without credentials.
+
+    python fake_azure_server.py --port 8765 --latency lognormal:0.6:0.4 \
+        --latency translation=0.15 --error-rate 0.02 --error-status 429
+
+Point the app at it with AZURE_OPENAI_ENDPOINT=http://127.0.0.1:8765 and
+any AZURE_OPENAI_API_KEY. Each request is classified by its prompt as one
+of the tutor's tasks (chat, fused, correction, interjection, translation,
+topic, summary) and answered with a canned body, after a delay drawn from
+the task's latency distribution:
+
+    0.3                   constant seconds
+    uniform:LOW:HIGH
+    normal:MEAN:STDDEV
+    lognormal:MEDIAN:SIGMA
+
+Usage is reported with prompt caching as Azure does it: once a prompt of
+at least 1024 tokens (counted as 3 characters each) has been seen, later
+prompts that start the same way report the shared prefix, in 128-token
+steps, as prompt_tokens_details.cached_tokens.
+
+Canned bodies can be replaced with --bodies FILE, a JSON object mapping a
+task to a string (sent as is) or an object (sent as JSON text).
+
+GET /stats returns request counts per task and deployment; POST /reset
+clears them.
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# First matching marker in the prompt decides the task
+TASK_MARKERS = [
+    ("fused", '"response": "your conversational reply'),
+    ("interjection", "The student used English words"),
+    ("correction", "Analyze the student's Chinese text for grammatical errors"),
+    ("translation", "Translate the Chinese text to natural English"),
+    ("topic", "conversation starter"),
+    ("summary", "Update the running summary")
+]
+
+DEFAULT_BODIES = {
+    "chat": "你好！今天你想聊什么？",
+    "fused": {
+        "response": "你好！今天你想聊什么？",
+        "translation": "Hello! What would you like to talk about today?",
+        "has_errors": False
+    },
+    "correction": {"has_errors": False},
+    "interjection": {
+        "type": "interjection_help",
+        "english_words": ["coffee"],
+        "translations": ["咖啡"],
+        "suggested_sentence": "我想喝咖啡。",
+        "explanation": "Coffee is 咖啡 (kāfēi)."
+    },
+    "translation": "Hello! What would you like to talk about today?",
+    "topic": "你周末喜欢做什么？",
+    "summary": "The student greeted the tutor and talked about their day."
+}
+
+
+# Prompt caching: prompts shorter than this aren't cached, and cache hits
+# are counted in steps of CACHE_STEP tokens
+CACHE_MIN_TOKENS = 1024
+CACHE_STEP = 128
+CHARS_PER_TOKEN = 3
+CACHE_MAX_PREFIXES = 100000
+
+
+def parse_latency(spec):
+    """Return a function drawing one delay in seconds from a distribution spec"""
+    kind, _, args = spec.partition(":")
+    if not args:
+        value = float(kind)
+        return lambda: value
+    params = [float(arg) for arg in args.split(":")]
+    if kind == "uniform":
+        return lambda: random.uniform(params[0], params[1])
+    if kind == "normal":
+        return lambda: max(0.0, random.gauss(params[0], params[1]))
+    if kind == "lognormal":
+        mu = math.log(params[0])
+        return lambda: random.lognormvariate(mu, params[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def classify(messages):
+    text = "\n".join(message.get("content") or "" for message in messages)
+    for task, marker in TASK_MARKERS:
+        if marker in text:
+            return task, text
+    return "chat", text
+
+
+class FakeAzure:
+    def __init__(self, latency, task_latency, error_rate, error_status, bodies):
+        self.latency = latency
+        self.task_latency = task_latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.bodies = bodies
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.errors = 0
+            self.by_task = {}
+            self.by_deployment = {}
+            self.prefixes = set()
+            self.cached_tokens = 0
+
+    def record(self, task, deployment, failed):
+        with self._lock:
+            self.requests += 1
+            self.by_task[task] = self.by_task.get(task, 0) + 1
+            self.by_deployment[deployment] = self.by_deployment.get(deployment, 0) + 1
+            if failed:
+                self.errors += 1
+
+    def cached(self, deployment, text):
+        """Tokens of text's prefix that an earlier prompt to deployment shared"""
+        step = CACHE_STEP * CHARS_PER_TOKEN
+        boundaries = range(CACHE_MIN_TOKENS * CHARS_PER_TOKEN, len(text) + 1, step)
+        digests = [hashlib.sha1(f"{deployment}\0{text[:end]}".encode("utf-8")).digest() for end in boundaries]
+        with self._lock:
+            hits = 0
+            for digest in digests:
+                if digest not in self.prefixes:
+                    break
+                hits += 1
+            if len(self.prefixes) > CACHE_MAX_PREFIXES:
+                self.prefixes.clear()
+            self.prefixes.update(digests)
+            cached = CACHE_MIN_TOKENS + (hits - 1) * CACHE_STEP if hits else 0
+            self.cached_tokens += cached
+            return cached
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "cached_tokens": self.cached_tokens,
+                "by_task": dict(self.by_task),
+                "by_deployment": dict(self.by_deployment)
+            }
+
+    def body(self, task):
+        body = self.bodies.get(task, DEFAULT_BODIES["chat"])
+        if task == "topic" and body == DEFAULT_BODIES["topic"]:
+            # Vary generated topics so the topic pool doesn't drop them as duplicates
+            body = f"{body}（{random.randint(1, 10 ** 6)}）"
+        return body if isinstance(body, str) else json.dumps(body, ensure_ascii=False)
+
+    def delay(self, task):
+        return self.task_latency.get(task, self.latency)()
+
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/stats":
+                self._send_json(200, fake.stats())
+            else:
+                self._send_json(404, {"error": {"code": "404", "message": "Not found"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            payload = self.rfile.read(length)
+            if self.path.rstrip("/") == "/reset":
+                fake.reset()
+                self._send_json(200, {"reset": True})
+                return
+
+            # /openai/deployments/<deployment>/chat/completions
+            parts = self.path.split("?")[0].strip("/").split("/")
+            deployment = parts[2] if len(parts) > 2 and parts[1] == "deployments" else "unknown"
+            request = json.loads(payload or b"{}")
+            task, text = classify(request.get("messages", []))
+
+            time.sleep(fake.delay(task))
+            failed = random.random() < fake.error_rate
+            fake.record(task, deployment, failed)
+            if failed:
+                headers = {"Retry-After": "1"} if fake.error_status == 429 else {}
+                self._send_json(fake.error_status, {
+                    "error": {"code": str(fake.error_status), "message": "Injected error"}
+                }, headers)
+                return
+
+            content = fake.body(task)
+            usage = {
+                "prompt_tokens": max(1, len(text) // CHARS_PER_TOKEN),
+                "completion_tokens": max(1, len(content) // 2),
+                "prompt_tokens_details": {"cached_tokens": fake.cached(deployment, text)}
+            }
+            usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+            if request.get("stream"):
+                include_usage = (request.get("stream_options") or {}).get("include_usage")
+                self._send_stream(content, usage if include_usage else None)
+            else:
+                self._send_json(200, {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": deployment,
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop"
+                    }],
+                    "usage": usage
+                })
+
+        def _send_json(self, status, body, headers=None):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_stream(self, content, usage=None):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            # A few characters per chunk, like a real token stream
+            for start in range(0, len(content), 3):
+                chunk = {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": "fake",
+                    "choices": [{"index": 0, "delta": {"content": content[start:start + 3]}, "finish_reason": None}]
+                }
+                self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+            if usage is not None:
+                # stream_options.include_usage: a last chunk with no choices
+                chunk = {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": "fake",
+                    "choices": [],
+                    "usage": usage
+                }
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+            self._write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def _write_chunk(self, text):
+            data = text.encode("utf-8")
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+    return Handler
+
+
+def build_server(host="127.0.0.1", port=8765, latency="0.3", task_latency=None, error_rate=0.0,
+                 error_status=500, bodies=None):
+    """Create (but don't start) a fake server; port 0 picks a free port"""
+    fake = FakeAzure(
+        parse_latency(latency),
+        {task: parse_latency(spec) for task, spec in (task_latency or {}).items()},
+        error_rate,
+        error_status,
+        dict(DEFAULT_BODIES, **(bodies or {}))
+    )
+    server = ThreadingHTTPServer((host, port), make_handler(fake))
+    server.daemon_threads = True
+    server.fake = fake
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Azure OpenAI chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", action="append", default=[],
+                        help="SPEC for all tasks, or TASK=SPEC for one task (repeatable)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=500, help="Status code of injected errors")
+    parser.add_argument("--bodies", help="JSON file of canned bodies per task")
+    args = parser.parse_args()
+
+    latency = "0.3"
+    task_latency = {}
+    for spec in args.latency:
+        task, sep, task_spec = spec.partition("=")
+        if sep:
+            task_latency[task] = task_spec
+        else:
+            latency = spec
+    bodies = None
+    if args.bodies:
+        with open(args.bodies, encoding="utf-8") as f:
+            bodies = json.load(f)
+
+    server = build_server(args.host, args.port, latency, task_latency, args.error_rate, args.error_status, bodies)
+    print(f"Fake Azure OpenAI listening on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
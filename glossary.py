@@ -0,0 +1,163 @@
+"""English→Chinese glossary for the interjection help.
+
+data/glossary.tsv is the editable source; it is compiled into
+data/glossary.bin, which is memory-mapped and searched in place, so
+looking a word up takes a few microseconds, and gunicorn workers share
+the file's pages instead of each holding a copy.
+
+glossary.bin layout (little-endian):
+
+    b"GLS1"  uint32 count  uint32 offset * count  records
+    record:  english (lowercase UTF-8) b"\\t" chinese (UTF-8) b"\\n"
+
+Records are sorted by their English bytes and the offsets point at them in
+that order, so a lookup is a binary search over the offsets.
+
+Rebuild the index after editing the source:  python glossary.py
+"""
+
+import mmap
+import os
+import re
+import struct
+import threading
+from collections import Counter
+
+from triage import ENGLISH_WORD_RE
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+GLOSSARY_SOURCE_PATH = os.path.join(DATA_DIR, "glossary.tsv")
+GLOSSARY_PATH = os.path.join(DATA_DIR, "glossary.bin")
+
+MAGIC = b"GLS1"
+HEADER = struct.Struct("<4sI")
+OFFSET = struct.Struct("<I")
+
+# Whitespace left between Chinese characters or punctuation after a rewrite
+CJK_GAP_RE = re.compile(r"(?<=[\u3000-\u303f\u3400-\u9fff\uff00-\uffef])\s+(?=[\u3000-\u303f\u3400-\u9fff\uff00-\uffef])")
+
+
+def read_source(path=GLOSSARY_SOURCE_PATH):
+    """{english: chinese} from a glossary.tsv file"""
+    entries = {}
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            english, sep, chinese = line.partition("\t")
+            english, chinese = english.strip().lower(), chinese.strip()
+            if not sep or not english or not chinese:
+                raise ValueError(f"{path}:{number}: expected 'english<TAB>chinese'")
+            if english in entries:
+                raise ValueError(f"{path}:{number}: '{english}' is listed twice")
+            entries[english] = chinese
+    return entries
+
+
+def build(entries, path=GLOSSARY_PATH):
+    """Write entries ({english: chinese}) as a glossary.bin file"""
+    records = sorted((english.encode("utf-8"), chinese.encode("utf-8")) for english, chinese in entries.items())
+    base = HEADER.size + OFFSET.size * len(records)
+    offsets, body = [], bytearray()
+    for english, chinese in records:
+        offsets.append(base + len(body))
+        body += english + b"\t" + chinese + b"\n"
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(records)))
+        f.write(b"".join(OFFSET.pack(offset) for offset in offsets))
+        f.write(body)
+    os.replace(temporary, path)
+
+
+def _singular_forms(word):
+    """Candidate singulars for a plural English word, most likely first"""
+    if word.endswith("ies") and len(word) > 4:
+        yield word[:-3] + "y"
+    if word.endswith("es") and len(word) > 3:
+        yield word[:-2]
+    if word.endswith("s") and not word.endswith("ss") and len(word) > 2:
+        yield word[:-1]
+
+
+def rewrite(text, known):
+    """text with each English word in known replaced by its Chinese"""
+    rewritten = ENGLISH_WORD_RE.sub(lambda match: known.get(match.group(0), match.group(0)), text)
+    return CJK_GAP_RE.sub("", rewritten)
+
+
+class Glossary:
+    """Read-only lookups in a memory-mapped glossary.bin"""
+
+    def __init__(self, path=GLOSSARY_PATH):
+        self.path = path
+        self._mm = None
+        self._count = 0
+        self._lock = threading.Lock()
+        self._outcomes = Counter()
+        try:
+            with open(path, "rb") as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, self._count = HEADER.unpack_from(self._mm, 0)
+            if magic != MAGIC:
+                raise ValueError("not a glossary file")
+        except (OSError, ValueError, struct.error) as e:
+            print(f"Could not load glossary from {path}: {e}")
+            self._mm = None
+            self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def _find(self, key):
+        """Chinese for an exact lowercase key, or None"""
+        mm = self._mm
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            start = OFFSET.unpack_from(mm, HEADER.size + OFFSET.size * middle)[0]
+            tab = mm.find(b"\t", start)
+            english = mm[start:tab]
+            if english == key:
+                return mm[tab + 1:mm.find(b"\n", tab)].decode("utf-8")
+            if english < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def lookup(self, word):
+        """Chinese for an English word (any case, plural or singular), or None"""
+        if not self._count:
+            return None
+        word = word.lower()
+        for candidate in (word, *_singular_forms(word)):
+            chinese = self._find(candidate.encode("utf-8"))
+            if chinese is not None:
+                return chinese
+        return None
+
+    def translate(self, words):
+        """{word: chinese} for the words the glossary knows"""
+        known = {}
+        for word in dict.fromkeys(words):
+            chinese = self.lookup(word)
+            if chinese is not None:
+                known[word] = chinese
+        return known
+
+    def count(self, outcome):
+        """Count how an interjection was answered (local, partial, upstream)"""
+        with self._lock:
+            self._outcomes[outcome] += 1
+
+    def stats(self):
+        with self._lock:
+            return {"entries": self._count, "outcomes": dict(self._outcomes)}
+
+
+if __name__ == "__main__":
+    entries = read_source()
+    build(entries)
+    print(f"Wrote {len(entries)} entries to {GLOSSARY_PATH}")
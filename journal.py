@@ -0,0 +1,225 @@
+"""Opt-in journal of production traffic, for replay.py.
+
+With REQUEST_JOURNAL_PATH set, every /api/chat, /api/chat/stream and
+/api/random-topic request is appended to that file as one JSON line: when
+it arrived, the request body, the response, and the Azure calls it made.
+A stream is written when it ends, with the reply assembled from its
+events (see stream_reply()). Request threads
+only put the entry on a bounded queue; a background thread writes entries
+in batches and rotates the file when it grows past
+REQUEST_JOURNAL_MAX_BYTES (keeping REQUEST_JOURNAL_BACKUPS old files as
+PATH.1, PATH.2, ...). Gunicorn workers share the file: each batch is
+appended, and the file rotated, under an fcntl lock on PATH.lock. If the
+writer falls behind, entries are dropped and counted rather than slowing
+requests down.
+
+The journal holds learners' messages, so keep it somewhere private.
+"""
+
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: one process per journal file
+    fcntl = None
+
+JOURNAL_ROUTES = ("/api/chat", "/api/chat/stream", "/api/random-topic")
+
+
+def stream_reply(reply, event, payload):
+    """Fold one /api/chat/stream event into the reply journaled for it.
+
+    The reply deltas are left out: "reply_done" carries the whole text.
+    """
+    if event != "reply":
+        reply.update(payload)
+
+
+def journal_entry(route, method, status, started, request_body, response_body, upstream):
+    """One journal line; started is the request's time.monotonic() start"""
+    duration = time.monotonic() - started
+    return {
+        "ts": round(time.time() - duration, 3),
+        "route": route,
+        "method": method,
+        "status": int(status),
+        "duration_ms": round(duration * 1000, 1),
+        "request": request_body,
+        "response": response_body,
+        "upstream": upstream
+    }
+
+
+class RequestJournal:
+    """Batched, rotating JSONL writer fed from request threads"""
+
+    def __init__(self, path, max_bytes=50 * 1024 * 1024, backups=5, batch_size=200,
+                 flush_interval=1.0, max_queue=10000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.rotations = 0
+        self.errors = 0
+
+    @classmethod
+    def from_env(cls):
+        """A journal configured from REQUEST_JOURNAL_*, or None when it is off"""
+        path = os.getenv("REQUEST_JOURNAL_PATH")
+        if not path:
+            return None
+        return cls(
+            path,
+            max_bytes=int(os.getenv("REQUEST_JOURNAL_MAX_BYTES", str(50 * 1024 * 1024))),
+            backups=int(os.getenv("REQUEST_JOURNAL_BACKUPS", "5"))
+        )
+
+    def record(self, entry):
+        """Queue one entry; never blocks"""
+        self._start()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _start(self):
+        # Started on first use so gunicorn workers forked after import each
+        # get their own writer
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._thread = threading.Thread(target=self._write_loop, name="request-journal", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _write_loop(self):
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                return
+            batch = [entry]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    entry = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if entry is None:
+                    stop = True
+                    break
+                batch.append(entry)
+            self._write(batch)
+            if stop:
+                return
+
+    def _write(self, batch):
+        lines = []
+        for entry in batch:
+            try:
+                lines.append(json.dumps(entry, ensure_ascii=False, default=str))
+            except (TypeError, ValueError) as e:
+                print(f"Error encoding journal entry: {e}")
+                with self._lock:
+                    self.errors += 1
+        if not lines:
+            return
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        try:
+            with self._file_lock():
+                try:
+                    self._rotate_if_needed(len(data))
+                except OSError as e:
+                    # Keep appending to the current file rather than lose the batch
+                    print(f"Error rotating request journal: {e}")
+                    with self._lock:
+                        self.errors += 1
+                with open(self.path, "ab") as f:
+                    f.write(data)
+        except OSError as e:
+            print(f"Error writing request journal: {e}")
+            with self._lock:
+                self.errors += 1
+            return
+        with self._lock:
+            self.written += len(lines)
+            self.batches += 1
+
+    @contextmanager
+    def _file_lock(self):
+        """Serializes appends and rotation with other processes writing this journal"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.path + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _rotate_if_needed(self, incoming):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+        if size == 0 or size + incoming <= self.max_bytes:
+            return
+        if self.backups <= 0:
+            os.remove(self.path)
+        else:
+            for i in range(self.backups - 1, 0, -1):
+                source = f"{self.path}.{i}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        with self._lock:
+            self.rotations += 1
+
+    def close(self, timeout=5):
+        """Write what is queued and stop the writer"""
+        if self._thread is None or self._closed:
+            return
+        self._closed = True
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "path": self.path,
+                "queued": self._queue.qsize(),
+                "written": self.written,
+                "dropped": self.dropped,
+                "batches": self.batches,
+                "rotations": self.rotations,
+                "errors": self.errors
+            }
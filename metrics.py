@@ -0,0 +1,230 @@
+"""Request metrics in Prometheus text format, and upstream call spans.
+
+Counters and histograms are kept in process memory and rendered by
+/api/metrics; values that components already count (cache hits, admission
+rejections, ...) are read from their stats() at scrape time through
+collectors. With several gunicorn workers each worker reports its own
+numbers, so scrape them per worker or aggregate in Prometheus.
+
+Every Azure call also produces a span (task, backend, deployment,
+latency, tokens, outcome). Spans are attached to the request that caused
+them and written with the one-line request log (REQUEST_LOG=1, default).
+"""
+
+import contextvars
+import json
+import math
+import threading
+import time
+
+from tasks import cached_tokens
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Spans of the current request; None outside of a request
+_request_spans = contextvars.ContextVar("request_spans", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + list(extra or [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+        # key -> [bucket counts..., sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def render(self):
+        with self._lock:
+            values = {key: list(entry) for key, entry in self._values.items()}
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, entry in sorted(values.items()):
+            for bound, count in zip(self.buckets, entry):
+                labels = _format_labels(self.labels, key, [("le", _format_value(float(bound)))])
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(round(entry[-2], 6))}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {entry[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = {}
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def set_collector(self, name, collect):
+        """Register collect() under name, replacing an earlier one of the same name.
+
+        collect() returns [(metric, type, help, [(labels_dict, value), ...]), ...].
+        """
+        self._collectors[name] = collect
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        for collect in list(self._collectors.values()):
+            try:
+                families = collect()
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+                continue
+            for name, kind, help, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    lines.append(f"{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    "tutor_http_request_duration_seconds",
+    "Time to produce a response (for SSE routes, until the first event)",
+    ("route", "method", "status")
+)
+UPSTREAM_DURATION = REGISTRY.histogram(
+    "tutor_upstream_request_duration_seconds",
+    "Azure OpenAI call latency",
+    ("task", "deployment", "outcome")
+)
+UPSTREAM_TOKENS = REGISTRY.counter(
+    "tutor_upstream_tokens_total",
+    "Tokens reported by Azure OpenAI usage",
+    ("task", "deployment", "type")
+)
+FALLBACKS = REGISTRY.counter(
+    "tutor_fallbacks_total",
+    "Canned replies served instead of an Azure result",
+    ("kind",)
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def start_request():
+    """Begin collecting spans for the current request"""
+    _request_spans.set([])
+    return time.monotonic()
+
+
+def current_spans():
+    return _request_spans.get()
+
+
+def resume_request(spans):
+    """Collect into spans (from current_spans()) in a context that didn't start the request"""
+    _request_spans.set(spans)
+
+
+def record_upstream(task, span, latency, usage=None, outcome="ok"):
+    """Record one Azure call: metrics, plus a span on the current request"""
+    deployment = span.get("deployment", "")
+    UPSTREAM_DURATION.observe(latency, task=task, deployment=deployment, outcome=outcome)
+    span.update(task=task, latency_ms=round(latency * 1000, 1), outcome=outcome)
+    if usage is not None:
+        record_usage(task, span, usage)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append(span)
+
+
+def record_usage(task, span, usage):
+    """Token counts of a call; for streams they arrive after record_upstream()"""
+    deployment = span.get("deployment", "")
+    UPSTREAM_TOKENS.inc(usage.prompt_tokens or 0, task=task, deployment=deployment, type="prompt")
+    UPSTREAM_TOKENS.inc(cached_tokens(usage), task=task, deployment=deployment, type="cached")
+    UPSTREAM_TOKENS.inc(usage.completion_tokens or 0, task=task, deployment=deployment, type="completion")
+    span.update(prompt_tokens=usage.prompt_tokens, cached_tokens=cached_tokens(usage),
+                completion_tokens=usage.completion_tokens)
+
+
+def record_fallback(kind):
+    FALLBACKS.inc(kind=kind)
+
+
+def observe_request(route, method, status, started):
+    HTTP_REQUEST_DURATION.observe(time.monotonic() - started, route=route, method=method, status=status)
+
+
+def log_request(route, method, status, started, enabled=True):
+    """Write the request's log line, stop collecting spans and return them"""
+    spans = _request_spans.get() or []
+    _request_spans.set(None)
+    if enabled:
+        print(json.dumps({
+            "route": route,
+            "method": method,
+            "status": status,
+            "duration_ms": round((time.monotonic() - started) * 1000, 1),
+            "upstream": spans
+        }, ensure_ascii=False))
+    return spans
+
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Replay a request journal (see journal.py) against a running server.
+
+Requests are sent with their original spacing, divided by --speed, and
+the report compares the replayed latencies with the ones recorded in the
+journal. Sessions are recreated on the target: the first request of each
+journaled session creates a new one, and later requests use it.
+Streamed replies (/api/chat/stream) are read to the end: their latency
+is the time to the "done" event, a stream that ends any other way counts
+as an error, and the report adds the time to the first event.
+
+    python replay.py journal.jsonl --url http://localhost:5000
+    python replay.py journal.jsonl.2 journal.jsonl.1 journal.jsonl --speed 4 --output replay.json
+    python replay.py journal.jsonl --speed 0 --limit 1000    # as fast as --concurrency allows
+
+Point the server at fake_azure_server.py to replay production patterns
+without Azure costs.
+"""
+
+import argparse
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from benchmark import git_commit, summarize
+from journal import JOURNAL_ROUTES
+
+
+def load_journal(paths, limit=None):
+    entries = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"Skipping unreadable line {number} of {path}")
+                    continue
+                if entry.get("route") in JOURNAL_ROUTES:
+                    entries.append(entry)
+    entries.sort(key=lambda entry: entry["ts"])
+    return entries[:limit] if limit else entries
+
+
+def read_events(response):
+    """Read a text/event-stream response to its end: [(event name, perf_counter time when it arrived)]"""
+    events = []
+    for line in response:
+        line = line.decode("utf-8").strip()
+        if line.startswith("event:"):
+            events.append((line[len("event:"):].strip(), time.perf_counter()))
+    return events
+
+
+class Replayer:
+    def __init__(self, base_url, timeout=60):
+        self.base_url = base_url
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        # Journaled session id -> session id on the target
+        self._sessions = {}
+        self._session_locks = {}
+        self.results = {}
+        self.max_lag = 0.0
+
+    def _send(self, method, path, body=None):
+        """(status, body); an event stream's body is its (event name, perf_counter time) list"""
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8") if body is not None else None
+        headers = {"Content-Type": "application/json"} if data is not None else {}
+        request = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                if response.headers.get_content_type() == "text/event-stream":
+                    return response.status, read_events(response)
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+        except (urllib.error.URLError, OSError):
+            return 0, b""
+
+    def _session_for(self, original):
+        with self._lock:
+            if original in self._sessions:
+                return self._sessions[original]
+            session_lock = self._session_locks.setdefault(original, threading.Lock())
+        # Concurrent turns of one session wait for a single create; other
+        # sessions and result bookkeeping don't wait on the POST
+        with session_lock:
+            with self._lock:
+                if original in self._sessions:
+                    return self._sessions[original]
+            status, body = self._send("POST", "/api/session", {})
+            session = json.loads(body)["session_id"] if status == 201 else None
+            with self._lock:
+                self._sessions[original] = session
+                self._session_locks.pop(original, None)
+            return session
+
+    def replay_one(self, entry, scheduled):
+        with self._lock:
+            self.max_lag = max(self.max_lag, time.monotonic() - scheduled)
+        route = entry["route"]
+        body = dict(entry.get("request") or {}) if entry.get("method", "POST") == "POST" else None
+        if body and body.get("session_id"):
+            body["session_id"] = self._session_for(body["session_id"])
+
+        start = time.perf_counter()
+        status, response = self._send(entry.get("method", "POST"), route, body)
+        latency = time.perf_counter() - start
+        first_event = None
+        if isinstance(response, list):
+            if response:
+                first_event = response[0][1] - start
+            if status == 200 and (not response or response[-1][0] != "done"):
+                status = "incomplete_stream"
+
+        with self._lock:
+            result = self.results.setdefault(
+                route, {"latencies": [], "errors": 0, "status": {}, "recorded": [], "first_event": []}
+            )
+            result["status"][str(status)] = result["status"].get(str(status), 0) + 1
+            if entry.get("duration_ms") is not None:
+                result["recorded"].append(entry["duration_ms"] / 1000)
+            if status == 200:
+                result["latencies"].append(latency)
+                if first_event is not None:
+                    result["first_event"].append(first_event)
+            else:
+                result["errors"] += 1
+
+    def run(self, entries, speed, concurrency):
+        if not entries:
+            return 0.0
+        first = entries[0]["ts"]
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for entry in entries:
+                scheduled = start + (entry["ts"] - first) / speed if speed > 0 else time.monotonic()
+                delay = scheduled - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(self.replay_one, entry, scheduled)
+        return time.monotonic() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a request journal against a server")
+    parser.add_argument("journal", nargs="+", help="Journal files (rotated files can be listed together)")
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Time scale: 2 sends twice as fast as recorded, 0 sends without pauses")
+    parser.add_argument("--concurrency", type=int, default=200, help="Maximum requests in flight")
+    parser.add_argument("--limit", type=int, help="Replay only the first N requests")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    entries = load_journal(args.journal, args.limit)
+    if not entries:
+        raise SystemExit("No replayable requests in the journal")
+
+    replayer = Replayer(args.url.rstrip("/"), args.timeout)
+    duration = replayer.run(entries, args.speed, args.concurrency)
+
+    routes = {}
+    all_latencies = []
+    all_errors = 0
+    for route, result in replayer.results.items():
+        replayed = summarize(result["latencies"], result["errors"], duration)
+        recorded = summarize(result["recorded"], 0, None)
+        routes[route] = dict(replayed, status=result["status"], recorded_latency_ms=recorded["latency_ms"])
+        if result["first_event"]:
+            routes[route]["first_event_latency_ms"] = summarize(result["first_event"], 0, None)["latency_ms"]
+        all_latencies += result["latencies"]
+        all_errors += result["errors"]
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(),
+        "config": {
+            "url": args.url,
+            "journal": args.journal,
+            "speed": args.speed,
+            "concurrency": args.concurrency,
+            "recorded_span_s": round(entries[-1]["ts"] - entries[0]["ts"], 3)
+        },
+        "elapsed_s": round(duration, 3),
+        # How far behind schedule the slowest send was; a large value means
+        # --concurrency limited the replay rate
+        "max_lag_ms": round(replayer.max_lag * 1000, 1),
+        "overall": summarize(all_latencies, all_errors, duration),
+        "routes": routes
+    }
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Pre-generated replies to common opening messages.
+
+Many conversations start with the same few greetings and no history, and
+each one otherwise costs a chat completion, a translation and a
+correction. Once a history-free message has been seen min_hits times, a
+background worker generates a few distinct reply bundles (reply,
+translation and correction) for it, and later requests are answered from
+that pool in rotation so learners don't all get the same reply. When a
+pool is older than its TTL it is still served while a fresh one is
+generated in the background.
+
+Messages are matched after normalization (case, spacing and punctuation
+are ignored), and only short ones are considered.
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+
+from admission import background
+from triage import phrase_key
+
+
+class OpeningReplyCache:
+    """Per-message pools of reply bundles, filled and refreshed by a background thread"""
+
+    def __init__(self, generate, variants=3, ttl=3600, min_hits=2, max_keys=256, max_chars=40):
+        # generate(message) returns {"response", "translation", "correction"} or raises
+        self.generate = generate
+        self.variants = variants
+        self.ttl = ttl
+        self.min_hits = min_hits
+        self.max_keys = max_keys
+        self.max_chars = max_chars
+
+        # key -> {"message", "hits", "pool", "next", "refreshed", "pending"}, least recently used first
+        self._entries = OrderedDict()
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._work = threading.Event()
+        self._thread = None
+
+        self.served = 0
+        self.misses = 0
+        self.generated = 0
+        self.duplicates = 0
+        self.errors = 0
+
+    def get(self, message):
+        """A pooled bundle for a history-free message, or None"""
+        if len(message) > self.max_chars:
+            return None
+        key = phrase_key(message)
+        if not key:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = {
+                    "message": message, "hits": 0, "pool": [], "next": 0, "refreshed": None, "pending": False
+                }
+                while len(self._entries) > self.max_keys:
+                    self._entries.popitem(last=False)
+            self._entries.move_to_end(key)
+            entry["hits"] += 1
+
+            pool = entry["pool"]
+            # A pool with fewer distinct replies than asked for is kept until
+            # it ages out too, rather than regenerated on every hit
+            due = entry["refreshed"] is None or now - entry["refreshed"] > self.ttl
+            if entry["hits"] >= self.min_hits and due:
+                self._schedule(key, entry)
+            if not pool:
+                self.misses += 1
+                return None
+            bundle = pool[entry["next"] % len(pool)]
+            entry["next"] += 1
+            self.served += 1
+        # Callers add fields such as "mode" and "session_id" to the result
+        return dict(bundle)
+
+    def _schedule(self, key, entry):
+        # Called with the lock held
+        if entry["pending"]:
+            return
+        entry["pending"] = True
+        self._pending.append(key)
+        if self._thread is None:
+            # Started on first use so gunicorn workers forked after import each get one
+            self._thread = threading.Thread(target=self._fill_loop, name="opening-replies", daemon=True)
+            self._thread.start()
+        self._work.set()
+
+    def _fill_loop(self):
+        backoff = 1
+        while True:
+            self._work.wait(timeout=60)
+            self._work.clear()
+            while True:
+                with self._lock:
+                    if not self._pending:
+                        break
+                    key = self._pending.popleft()
+                    entry = self._entries.get(key)
+                if entry is not None:
+                    backoff = self._fill(entry, backoff)
+
+    def _fill(self, entry, backoff):
+        """Generate a new pool for entry; returns the error backoff to use next"""
+        with self._lock:
+            refreshing = entry["refreshed"] is not None
+        fresh, seen = [], set()
+        # A few extra attempts for duplicate replies, but don't spin forever
+        for _ in range(self.variants * 2):
+            if len(fresh) >= self.variants:
+                break
+            try:
+                # Queued behind every request's calls
+                with background():
+                    bundle = self.generate(entry["message"])
+            except Exception as e:
+                print(f"Error generating opening reply: {e}")
+                with self._lock:
+                    self.errors += 1
+                # Back off so an outage doesn't turn into a request storm
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+                continue
+            backoff = 1
+            key = phrase_key(bundle["response"])
+            if key in seen:
+                with self._lock:
+                    self.duplicates += 1
+                continue
+            seen.add(key)
+            fresh.append(bundle)
+            with self._lock:
+                self.generated += 1
+                if not refreshing:
+                    # First fill: serve each bundle as soon as it exists
+                    entry["pool"] = list(fresh)
+        with self._lock:
+            if fresh:
+                entry["pool"] = fresh
+                entry["refreshed"] = time.monotonic()
+            entry["pending"] = False
+        return backoff
+
+    def stats(self):
+        with self._lock:
+            pooled = sum(1 for entry in self._entries.values() if entry["pool"])
+            return {
+                "tracked": len(self._entries),
+                "pooled": pooled,
+                "pending": len(self._pending),
+                "served": self.served,
+                "misses": self.misses,
+                "generated": self.generated,
+                "duplicates_dropped": self.duplicates,
+                "errors": self.errors
+            }
@@ -0,0 +1,153 @@
+"""Server-side conversation sessions for /api/chat.
+
+Clients that create a session send only the new message each turn; the
+server keeps the recent turns. Sessions live in process memory, so with
+several gunicorn workers the client must stick to one worker (or re-create
+its session when it gets a 404, seeding it with its local history).
+"""
+
+import secrets
+import threading
+import time
+from collections import OrderedDict, deque
+
+from context_builder import roll_key
+
+# Compact per-message representation: (is_user, text)
+USER = True
+AI = False
+
+
+class Session:
+    __slots__ = ("messages", "last_access", "chars", "base_index", "base_key")
+
+    def __init__(self, max_messages):
+        self.messages = deque(maxlen=max_messages)
+        self.last_access = time.time()
+        self.chars = 0
+        # Position and rolling key of the oldest message still held, so the
+        # context builder can find summaries of messages that were dropped.
+        self.base_index = 0
+        self.base_key = ""
+
+
+class SessionStore:
+    """Bounded ring buffer of messages per session, with idle expiry and a memory cap"""
+
+    def __init__(self, max_messages=20, idle_ttl=1800, max_sessions=10000, max_chars=20000000):
+        self.max_messages = max_messages
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        # Rough memory cap: total characters held across all sessions
+        self.max_chars = max_chars
+
+        # Least recently used first
+        self._sessions = OrderedDict()
+        self._chars = 0
+        self._lock = threading.Lock()
+
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def create(self, conversation_history=None):
+        """Create a session, optionally seeded with a client-side history"""
+        session_id = secrets.token_urlsafe(16)
+        session = Session(self.max_messages)
+        with self._lock:
+            self._expire_idle()
+            self._sessions[session_id] = session
+            self.created += 1
+            for msg in conversation_history or []:
+                if msg.get('sender') in ('user', 'ai') and msg.get('message'):
+                    self._append(session, msg['sender'] == 'user', msg['message'])
+            self._enforce_limits()
+        return session_id
+
+    def history(self, session_id):
+        """Return the session's messages in /api/chat history format, or None if unknown/expired"""
+        history, _ = self.context(session_id)
+        return history
+
+    def context(self, session_id):
+        """Return (history, history_base) for ContextBuilder.build, or (None, None)"""
+        with self._lock:
+            session = self._touch(session_id)
+            if session is None:
+                return None, None
+            history = [
+                {"sender": "user" if is_user else "ai", "message": text}
+                for is_user, text in session.messages
+            ]
+            return history, (session.base_index, session.base_key)
+
+    def append_turn(self, session_id, user_message, ai_message):
+        with self._lock:
+            session = self._touch(session_id)
+            if session is None:
+                return False
+            self._append(session, USER, user_message)
+            self._append(session, AI, ai_message)
+            self._enforce_limits()
+            return True
+
+    def delete(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is None:
+                return False
+            self._chars -= session.chars
+            return True
+
+    def _touch(self, session_id):
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        if session.last_access < time.time() - self.idle_ttl:
+            self._remove(session_id)
+            self.expired += 1
+            return None
+        session.last_access = time.time()
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def _append(self, session, is_user, text):
+        if len(session.messages) == session.messages.maxlen:
+            dropped_is_user, dropped = session.messages[0]
+            session.chars -= len(dropped)
+            self._chars -= len(dropped)
+            session.base_key = roll_key(session.base_key, "user" if dropped_is_user else "assistant", dropped)
+            session.base_index += 1
+        session.messages.append((is_user, text))
+        session.chars += len(text)
+        self._chars += len(text)
+
+    def _remove(self, session_id):
+        session = self._sessions.pop(session_id)
+        self._chars -= session.chars
+
+    def _expire_idle(self):
+        cutoff = time.time() - self.idle_ttl
+        # Sessions are ordered by last access, so stop at the first live one
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.last_access >= cutoff:
+                break
+            self._remove(session_id)
+            self.expired += 1
+
+    def _enforce_limits(self):
+        while self._sessions and (len(self._sessions) > self.max_sessions or self._chars > self.max_chars):
+            session_id = next(iter(self._sessions))
+            self._remove(session_id)
+            self.evicted += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active": len(self._sessions),
+                "chars": self._chars,
+                "created": self.created,
+                "expired": self.expired,
+                "evicted": self.evicted
+            }
@@ -0,0 +1,181 @@
+"""Front-end files served from memory.
+
+The files in STATIC_FILES are read once, content-hashed and compressed
+(gzip, plus brotli when the brotli package is installed), so serving one
+is a dictionary lookup. Nothing else in the directory can be fetched.
+
+index.html is rewritten to load each asset through a hashed name such as
+app.3f2a9c1be07d.js; those URLs never change content and are cached by
+browsers for a year. index.html and the plain names are revalidated on
+every load with their ETag, which costs a 304 and no body.
+"""
+
+import gzip
+import hashlib
+import os
+import re
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_FILES = ("index.html", "app.js", "styles.css")
+INDEX = "index.html"
+
+CONTENT_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".js": "text/javascript; charset=utf-8",
+    ".css": "text/css; charset=utf-8"
+}
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+
+def _accepted_encodings(header):
+    """Content codings allowed by an Accept-Encoding header"""
+    accepted = set()
+    for part in (header or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        if coding.strip():
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def _etag_matches(header, etags):
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return not candidates.isdisjoint(etags)
+
+
+class Asset:
+    def __init__(self, name, body, mtime=None):
+        self.name = name
+        self.mtime = mtime
+        self.content_type = CONTENT_TYPES.get(os.path.splitext(name)[1], "application/octet-stream")
+        self.hash = hashlib.sha256(body).hexdigest()[:12]
+        root, ext = os.path.splitext(name)
+        self.hashed_name = f"{root}.{self.hash}{ext}"
+
+        # encoding -> (body, etag); each representation gets its own strong ETag
+        self.variants = {"identity": (body, f'"{self.hash}"')}
+        compressed = gzip.compress(body, 9, mtime=0)
+        if len(compressed) < len(body):
+            self.variants["gzip"] = (compressed, f'"{self.hash}-gz"')
+        if brotli is not None:
+            compressed = brotli.compress(body, quality=11)
+            if len(compressed) < len(body):
+                self.variants["br"] = (compressed, f'"{self.hash}-br"')
+        self.etags = {etag for _, etag in self.variants.values()}
+
+    def negotiate(self, accept_encoding):
+        accepted = _accepted_encodings(accept_encoding)
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and (encoding in accepted or "*" in accepted):
+                return encoding
+        return "identity"
+
+
+class StaticAssets:
+    """Allow-listed front-end files, hashed and compressed in memory"""
+
+    def __init__(self, directory, names=STATIC_FILES, reload=False):
+        self.directory = directory
+        self.names = tuple(names)
+        # Re-read files whose mtime changed (development)
+        self.reload = reload
+        self._lock = threading.Lock()
+        self._assets = {}
+        self._routes = {}
+        self.served = 0
+        self.not_modified = 0
+        self.load()
+
+    def load(self):
+        files = {}
+        for name in self.names:
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, "rb") as f:
+                    files[name] = (f.read(), os.path.getmtime(path))
+            except OSError as e:
+                print(f"Error loading static file {name}: {e}")
+
+        assets = {}
+        for name, (body, mtime) in files.items():
+            if name != INDEX:
+                assets[name] = Asset(name, body, mtime)
+        if INDEX in files:
+            # Point the page at the hashed names so they can be cached forever
+            body, mtime = files[INDEX]
+            html = body.decode("utf-8")
+            for asset in list(assets.values()):
+                html = re.sub(rf'((?:src|href)=["\']/?){re.escape(asset.name)}(["\'])',
+                              rf"\g<1>{asset.hashed_name}\g<2>", html)
+            assets[INDEX] = Asset(INDEX, html.encode("utf-8"), mtime)
+
+        routes = {}
+        for asset in assets.values():
+            routes[asset.name] = (asset, REVALIDATE)
+            if asset.name != INDEX:
+                routes[asset.hashed_name] = (asset, IMMUTABLE)
+        with self._lock:
+            self._assets = assets
+            self._routes = routes
+
+    def _changed(self):
+        for asset in list(self._assets.values()):
+            try:
+                if os.path.getmtime(os.path.join(self.directory, asset.name)) != asset.mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def response(self, filename, if_none_match=None, accept_encoding=None):
+        """(status, headers, body) for filename, or None if it isn't served"""
+        if self.reload and self._changed():
+            self.load()
+        route = self._routes.get(filename)
+        if route is None:
+            return None
+        asset, cache_control = route
+        encoding = asset.negotiate(accept_encoding)
+        body, etag = asset.variants[encoding]
+        headers = {
+            "Content-Type": asset.content_type,
+            "Cache-Control": cache_control,
+            "ETag": etag,
+            "Vary": "Accept-Encoding"
+        }
+        if _etag_matches(if_none_match, asset.etags):
+            with self._lock:
+                self.not_modified += 1
+            return 304, headers, b""
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        with self._lock:
+            self.served += 1
+        return 200, headers, body
+
+    def stats(self):
+        with self._lock:
+            return {
+                "files": {name: asset.hashed_name for name, asset in self._assets.items() if name != INDEX},
+                "encodings": sorted({encoding for asset in self._assets.values() for encoding in asset.variants}),
+                "served": self.served,
+                "not_modified": self.not_modified
+            }
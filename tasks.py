@@ -0,0 +1,131 @@
+"""Per-task deployment tiering and counters for the tutor's Azure calls.
+
+Each prompt type is a task. By default every task runs on the default
+deployment with the temperature and max_tokens set in app.py. The cheap
+ones (translation, grammar checks) can be moved to a faster deployment
+with AZURE_OPENAI_TASK_DEPLOYMENTS, a JSON object such as
+
+    {"translation": {"deployment": "gpt-4o-mini", "max_tokens": 150},
+     "correction": "gpt-4o-mini",
+     "topic": {"deployment": "gpt-4o-mini", "temperature": 1.0}}
+
+where a bare string is shorthand for {"deployment": ...}. The deployment
+name is used on every backend in the pool.
+"""
+
+import json
+import threading
+
+TASKS = ("chat", "correction", "interjection", "translation", "topic", "summary")
+
+
+class TaskProfile:
+    """Deployment and sampling overrides for one task; None keeps the default"""
+
+    __slots__ = ("deployment", "temperature", "max_tokens")
+
+    def __init__(self, deployment=None, temperature=None, max_tokens=None):
+        self.deployment = deployment
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+
+    def apply(self, params):
+        """Return params with this profile's overrides"""
+        params = dict(params)
+        if self.temperature is not None:
+            params["temperature"] = self.temperature
+        if self.max_tokens is not None:
+            params["max_tokens"] = self.max_tokens
+        return params
+
+
+def load_task_profiles(raw):
+    """Parse AZURE_OPENAI_TASK_DEPLOYMENTS into {task: TaskProfile}"""
+    profiles = {}
+    for task, config in json.loads(raw or "{}").items():
+        if task not in TASKS:
+            print(f"Ignoring unknown task in AZURE_OPENAI_TASK_DEPLOYMENTS: {task}")
+            continue
+        if isinstance(config, str):
+            config = {"deployment": config}
+        profiles[task] = TaskProfile(
+            deployment=config.get("deployment"),
+            temperature=config.get("temperature"),
+            max_tokens=config.get("max_tokens")
+        )
+    return profiles
+
+
+def cached_tokens(usage):
+    """Prompt tokens Azure served from its prompt cache (0 when not reported)"""
+    details = getattr(usage, "prompt_tokens_details", None)
+    return getattr(details, "cached_tokens", None) or 0
+
+
+class TaskStats:
+    """Call, latency and token counters per task"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tasks = {}
+
+    def record(self, task, latency, usage=None, error=False):
+        with self._lock:
+            counters = self._counters(task)
+            counters["calls"] += 1
+            counters["latency_total"] += latency
+            counters["latency_max"] = max(counters["latency_max"], latency)
+            if error:
+                counters["errors"] += 1
+            if usage is not None:
+                self._add_usage(counters, usage)
+
+    def record_usage(self, task, usage):
+        """Tokens of a call already recorded, reported when its stream ends"""
+        with self._lock:
+            self._add_usage(self._counters(task), usage)
+
+    def _counters(self, task):
+        # Called with the lock held
+        counters = self._tasks.get(task)
+        if counters is None:
+            counters = self._tasks[task] = {
+                "calls": 0,
+                "errors": 0,
+                "latency_total": 0.0,
+                "latency_max": 0.0,
+                "prompt_tokens": 0,
+                "cached_tokens": 0,
+                "completion_tokens": 0
+            }
+        return counters
+
+    def _add_usage(self, counters, usage):
+        counters["prompt_tokens"] += usage.prompt_tokens or 0
+        counters["cached_tokens"] += cached_tokens(usage)
+        counters["completion_tokens"] += usage.completion_tokens or 0
+
+    def stats(self, profiles):
+        """Counters per task; a null deployment means each backend's default"""
+        with self._lock:
+            tasks = {task: dict(counters) for task, counters in self._tasks.items()}
+        result = {}
+        for task in TASKS:
+            counters = tasks.get(task)
+            profile = profiles.get(task)
+            entry = {"deployment": profile.deployment if profile else None}
+            if counters:
+                prompt_tokens = counters["prompt_tokens"]
+                entry.update(
+                    calls=counters["calls"],
+                    errors=counters["errors"],
+                    avg_latency_ms=round(counters["latency_total"] / counters["calls"] * 1000),
+                    max_latency_ms=round(counters["latency_max"] * 1000),
+                    prompt_tokens=prompt_tokens,
+                    cached_tokens=counters["cached_tokens"],
+                    # Share of prompt tokens served from Azure's prompt cache
+                    cached_ratio=round(counters["cached_tokens"] / prompt_tokens, 3) if prompt_tokens else 0.0,
+                    completion_tokens=counters["completion_tokens"]
+                )
+            result[task] = entry
+        return result
@@ -0,0 +1,55 @@
+import os
+import sys
+import threading
+
+import pytest
+
+# The modules live flat in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_azure_server import build_server  # noqa: E402
+
+
+@pytest.fixture
+def servers():
+    """Start fake Azure servers on free ports: servers(latency, ...) -> [server, ...]"""
+    started = []
+
+    def start(*latencies, bodies=None):
+        for latency in latencies:
+            server = build_server(port=0, latency=latency, bodies=bodies)
+            threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+            started.append(server)
+        return started[-len(latencies):]
+
+    yield start
+    for server in started:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def make_tutor(servers, monkeypatch):
+    """A ChineseLanguageTutor against a fresh fake server: make_tutor(bodies, **env) -> (tutor, server)"""
+    tutors = []
+
+    def make(bodies=None, latency="0.01", tutor_class=None, **env):
+        server, = servers(latency, bodies=bodies)
+        for name in ("AZURE_OPENAI_BACKENDS", "AZURE_OPENAI_TASK_DEPLOYMENTS", "CACHE_DB_PATH", "HEDGE_ENABLED"):
+            monkeypatch.delenv(name, raising=False)
+        monkeypatch.setenv("AZURE_OPENAI_API_KEY", "test-key")
+        monkeypatch.setenv("AZURE_OPENAI_ENDPOINT", f"http://127.0.0.1:{server.server_port}")
+        monkeypatch.setenv("AZURE_OPENAI_MAX_RETRIES", "0")
+        for name, value in env.items():
+            monkeypatch.setenv(name, value)
+
+        if tutor_class is None:
+            from app import ChineseLanguageTutor as tutor_class
+        tutor = tutor_class()
+        tutors.append(tutor)
+        return tutor, server
+
+    yield make
+    for tutor in tutors:
+        tutor.executor.shutdown(wait=False)
+        tutor.batch_executor.shutdown(wait=False)
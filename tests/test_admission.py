@@ -0,0 +1,153 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, UpstreamOverloaded, background
+
+
+def exhausted(max_queue=2, max_wait=5.0):
+    """A controller whose request bucket is empty, so every call queues"""
+    admission = AdmissionController(rpm=6, max_queue=max_queue, max_wait=max_wait, burst_seconds=10)
+    admission.acquire("chat", 1)
+    return admission
+
+
+def start_waiter(admission, task, results, in_background=False):
+    def run():
+        try:
+            if in_background:
+                with background():
+                    admission.acquire(task, 1)
+            else:
+                admission.acquire(task, 1)
+            results[task + ("-bg" if in_background else "")] = "admitted"
+        except UpstreamOverloaded as e:
+            results[task + ("-bg" if in_background else "")] = e.reason
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def wait_for_queue(admission, size, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while admission.stats()["queued"] != size and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert admission.stats()["queued"] == size
+
+
+def test_calls_are_admitted_while_there_is_capacity():
+    admission = AdmissionController(rpm=600, tpm=0)
+    for _ in range(10):
+        admission.acquire("chat", 100)
+    assert admission.stats()["admitted"] == 10
+    assert admission.stats()["delayed"] == 0
+
+
+def test_full_queue_evicts_a_lower_priority_waiter_for_chat():
+    admission = exhausted(max_queue=2)
+    results = {}
+    threads = [start_waiter(admission, "topic", results), start_waiter(admission, "summary", results)]
+    wait_for_queue(admission, 2)
+
+    start_waiter(admission, "chat", results)
+    # The newest of the lowest-priority waiters makes room
+    threads[1].join(timeout=2)
+    assert results == {"summary": "queue_full"}
+    assert admission.stats()["queued"] == 2
+    assert admission.stats()["evicted"] == 1
+    assert admission.stats()["rejected_queue_full"] == 0
+
+
+def test_full_queue_rejects_when_nothing_lower_is_queued():
+    admission = exhausted(max_queue=2)
+    results = {}
+    start_waiter(admission, "chat", results)
+    start_waiter(admission, "translation", results)
+    wait_for_queue(admission, 2)
+
+    with pytest.raises(UpstreamOverloaded) as error:
+        admission.acquire("translation", 1)
+    assert error.value.reason == "queue_full"
+    assert admission.stats()["rejected_queue_full"] == 1
+    assert admission.stats()["evicted"] == 0
+
+
+def test_background_calls_are_evicted_before_request_calls():
+    admission = exhausted(max_queue=2)
+    results = {}
+    start_waiter(admission, "topic", results)
+    evicted = start_waiter(admission, "chat", results, in_background=True)
+    wait_for_queue(admission, 2)
+
+    start_waiter(admission, "topic", dict())
+    evicted.join(timeout=2)
+    assert results == {"chat-bg": "queue_full"}
+
+
+def test_queued_calls_go_out_in_priority_order():
+    # 60 RPM with one second of burst: one call per second after the first
+    admission = AdmissionController(rpm=60, max_queue=10, max_wait=5.0, burst_seconds=1)
+    admission.acquire("chat", 1)
+    order = []
+
+    def run(task):
+        admission.acquire(task, 1)
+        order.append(task)
+
+    threads = [threading.Thread(target=run, args=(task,), daemon=True) for task in ("topic", "translation")]
+    for thread in threads:
+        thread.start()
+    wait_for_queue(admission, 2)
+    chat = threading.Thread(target=run, args=("chat",), daemon=True)
+    chat.start()
+    wait_for_queue(admission, 3)
+    for thread in threads + [chat]:
+        thread.join(timeout=5)
+    assert order == ["chat", "translation", "topic"]
+
+
+def test_async_waiter_is_evicted_too():
+    admission = exhausted(max_queue=1)
+
+    async def main():
+        waiting = asyncio.create_task(admission.acquire_async("topic", 1))
+        while admission.stats()["queued"] != 1:
+            await asyncio.sleep(0.01)
+        results = {}
+        start_waiter(admission, "chat", results)
+        with pytest.raises(UpstreamOverloaded):
+            await asyncio.wait_for(waiting, 2)
+
+    asyncio.run(main())
+
+
+def test_queue_of_size_zero_rejects():
+    admission = exhausted(max_queue=0)
+
+    with pytest.raises(UpstreamOverloaded) as error:
+        admission.acquire("chat", 1)
+    assert error.value.reason == "queue_full"
+
+
+def test_chat_reply_is_admitted_before_its_correction(make_tutor):
+    tutor, server = make_tutor()
+    # Room for exactly one call: it must go to the reply the user waits for
+    tutor.admission = AdmissionController(rpm=6, max_queue=4, max_wait=0.2, burst_seconds=10)
+
+    result = tutor.get_conversation_response("我昨天去了商店买东西", [])
+
+    assert result["response"] == "你好！今天你想聊什么？"
+    assert result["correction"] is None
+    assert server.fake.stats()["by_task"] == {"chat": 1}
+
+
+def test_try_acquire_never_queues():
+    admission = AdmissionController(rpm=6, burst_seconds=10)
+
+    assert admission.try_acquire("chat", 1)
+    assert not admission.try_acquire("chat", 1)
+    assert admission.stats()["queued"] == 0
+    assert admission.stats()["admitted"] == 1
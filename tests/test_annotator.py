@@ -0,0 +1,77 @@
+import pytest
+
+import app as flask_app
+from annotator import SINGLE_CHARACTER_READINGS, Annotator, PinyinDictionary
+
+
+@pytest.fixture(scope="module")
+def annotator():
+    return Annotator()
+
+
+def tokens(annotator, text):
+    return [(token["word"], token["pinyin"]) for token in annotator.annotate(text)]
+
+
+def test_text_is_split_into_words(annotator):
+    assert tokens(annotator, "我们明天去北京吧") == [
+        ("我们", ["wǒ", "men"]), ("明天", ["míng", "tiān"]), ("去", ["qù"]), ("北京", ["běi", "jīng"]),
+        ("吧", ["ba"])
+    ]
+
+
+def test_anything_that_is_not_chinese_keeps_its_place(annotator):
+    assert tokens(annotator, "Hi，我叫Anna！123") == [
+        ("Hi，", None), ("我", ["wǒ"]), ("叫", ["jiào"]), ("Anna！123", None)
+    ]
+
+
+@pytest.mark.parametrize("text, word, reading", [
+    ("他跑得很快", "得", ["de"]),
+    ("我们慢慢地走", "地", ["de"]),
+    ("这条河很长", "长", ["cháng"]),
+    ("老师教我中文", "教", ["jiāo"]),
+    ("他长大了", "长大", ["zhǎng", "dà"]),
+    ("校长来了", "校长", ["xiào", "zhǎng"]),
+    ("土地", "土地", ["tǔ", "dì"]),
+    ("银行", "银行", ["yín", "háng"]),
+])
+def test_polyphones_get_the_reading_of_their_use(annotator, text, word, reading):
+    assert dict(tokens(annotator, text))[word] == reading
+
+
+def test_dictionary_has_the_single_character_readings(annotator):
+    for char, reading in SINGLE_CHARACTER_READINGS.items():
+        assert annotator.dictionary.reading(char) == [reading]
+
+
+def test_repeated_text_comes_from_the_cache():
+    annotator = Annotator()
+    first = annotator.annotate("你好")
+
+    assert annotator.annotate("你好") is first
+    assert annotator.stats()["cache"] == {"hits": 1, "misses": 1, "size": 1}
+
+
+def test_missing_dictionary_still_annotates(tmp_path):
+    annotator = Annotator(PinyinDictionary(str(tmp_path / "missing.bin")))
+
+    assert tokens(annotator, "你好!") == [("你", [None]), ("好", [None]), ("!", None)]
+
+
+@pytest.mark.parametrize("body, error", [
+    ({}, "text is required"),
+    ({"text": 42}, "text is required"),
+    ({"text": "好" * (flask_app.ANNOTATE_MAX_CHARS + 1)}, f"At most {flask_app.ANNOTATE_MAX_CHARS} characters"),
+])
+def test_annotate_route_checks_the_text(body, error):
+    response = flask_app.app.test_client().post("/api/annotate", json=body)
+
+    assert response.status_code == 400
+    assert response.get_json()["error"].startswith(error)
+
+
+def test_annotate_route(annotator):
+    response = flask_app.app.test_client().post("/api/annotate", json={"text": "很长"})
+
+    assert response.get_json() == {"text": "很长", "tokens": annotator.annotate("很长")}
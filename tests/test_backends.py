@@ -0,0 +1,210 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from backends import CLOSED, HALF_OPEN, OPEN, Backend, BackendPool
+from fake_azure_server import parse_latency
+
+PARAMS = {"messages": [{"role": "user", "content": "你好"}], "max_tokens": 20}
+
+
+def backend(name, server):
+    return Backend(name, f"http://127.0.0.1:{server.server_port}", "gpt-4", "test-key", "2024-10-21", max_retries=0)
+
+
+def requests(server):
+    return server.fake.stats()["requests"]
+
+
+def fail(server, failing=True):
+    server.fake.error_rate = 1.0 if failing else 0.0
+
+
+def test_calls_go_to_the_faster_backend(servers):
+    slow, fast = servers("0.2", "0.01")
+    pool = BackendPool([backend("slow", slow), backend("fast", fast)])
+    for _ in range(10):
+        response = pool.complete(PARAMS)
+        assert response.choices[0].message.content
+    # Each is tried once, then the fast one keeps winning
+    assert requests(slow) == 1
+    assert requests(fast) == 9
+    assert [b["latency_ms"] is not None for b in pool.stats()["backends"]] == [True, True]
+
+
+def test_failed_call_fails_over_to_the_next_backend(servers):
+    broken, healthy = servers("0.01", "0.01")
+    fail(broken)
+    pool = BackendPool([backend("broken", broken), backend("healthy", healthy)])
+    span = {}
+    response = pool.complete(PARAMS, span=span)
+
+    assert response.choices[0].message.content
+    assert span["attempts"] == 2
+    assert span["backend"] == "healthy"
+    assert pool.stats()["failovers"] == 1
+
+
+def test_client_errors_are_not_retried_elsewhere(servers):
+    first, second = servers("0.01", "0.01")
+    first.fake.error_status = 400
+    fail(first)
+    pool = BackendPool([backend("first", first), backend("second", second)])
+    with pytest.raises(Exception) as error:
+        pool.complete(PARAMS)
+    assert getattr(error.value, "status_code", None) == 400
+    assert requests(second) == 0
+    assert pool.stats()["backends"][0]["state"] == CLOSED
+
+
+def test_circuit_opens_then_half_opens_and_closes(servers):
+    flaky, steady = servers("0.01", "0.01")
+    fail(flaky)
+    pool = BackendPool([backend("flaky", flaky), backend("steady", steady)], failure_threshold=2, cooldown=30)
+    flaky_backend = pool.backends[0]
+
+    # Two failures in a row open the circuit; failover keeps the calls working
+    while flaky_backend.state != OPEN:
+        pool.complete(PARAMS)
+    assert flaky_backend.trips == 1
+    calls = requests(flaky)
+    for _ in range(5):
+        pool.complete(PARAMS)
+    assert requests(flaky) == calls
+
+    # After the cooldown one probe is let through; it succeeds and closes the circuit
+    flaky_backend.opened_at -= pool.cooldown
+    fail(flaky, False)
+    fail(steady)
+    pool.complete(PARAMS)
+    assert requests(flaky) == calls + 1
+    assert flaky_backend.state == CLOSED
+    assert flaky_backend.consecutive_failures == 0
+
+
+def test_failed_probe_opens_the_circuit_again(servers):
+    flaky, steady = servers("0.01", "0.01")
+    fail(flaky)
+    pool = BackendPool([backend("flaky", flaky), backend("steady", steady)], failure_threshold=1, cooldown=0.2)
+    flaky_backend = pool.backends[0]
+    pool.complete(PARAMS)
+    assert flaky_backend.state == OPEN
+
+    time.sleep(0.25)
+    assert pool._pick([pool.backends[1]]) is flaky_backend
+    assert flaky_backend.state == HALF_OPEN
+    # Only one probe at a time
+    assert pool._pick([pool.backends[1]]) is None
+    flaky_backend.in_flight -= 1
+    pool._record(flaky_backend, 0.01, RuntimeError("still down"))
+    assert flaky_backend.state == OPEN
+    assert flaky_backend.trips == 2
+
+
+def test_slow_call_is_hedged_on_another_backend(servers):
+    slow, fast = servers("0.2", "0.01")
+    slow.fake.latency = parse_latency("1.0")
+    pool = BackendPool([backend("slow", slow), backend("fast", fast)], hedge=True, hedge_min_delay=0.05,
+                       hedge_budget=1.0)
+    span = {}
+    start = time.monotonic()
+    response = pool.complete(PARAMS, span=span)
+    elapsed = time.monotonic() - start
+
+    assert response.choices[0].message.content
+    assert elapsed < 0.6
+    assert span["backend"] == "fast"
+    stats = pool.stats()
+    assert stats["hedges"] == 1
+    assert stats["hedges_won"] == 1
+
+
+def test_hedges_stay_within_the_budget(servers):
+    slow, fast = servers("0.1", "0.1")
+    pool = BackendPool([backend("a", slow), backend("b", fast)], hedge=True, hedge_min_delay=0.01,
+                       hedge_budget=0.25)
+    for _ in range(8):
+        pool.complete(PARAMS)
+    assert pool.stats()["hedges"] <= 2
+
+
+def test_async_calls_fail_over(servers):
+    broken, healthy = servers("0.01", "0.01")
+    fail(broken)
+    pool = BackendPool([backend("broken", broken), backend("healthy", healthy)])
+
+    async def main():
+        async with httpx.AsyncClient() as client:
+            pool.enable_async(client)
+            span = {}
+            response = await pool.complete_async(PARAMS, span=span)
+            return response, span
+
+    response, span = asyncio.run(main())
+    assert response.choices[0].message.content
+    assert span["backend"] == "healthy"
+
+
+def test_stream_options_are_dropped_for_old_api_versions():
+    params = dict(PARAMS, stream=True, stream_options={"include_usage": True})
+    old = Backend("old", "http://127.0.0.1:9", "gpt-4", "key", "2024-02-01")
+    new = Backend("new", "http://127.0.0.1:9", "gpt-4", "key", "2024-10-21")
+    assert "stream_options" not in old.arguments(params)
+    assert new.arguments(params)["stream_options"] == {"include_usage": True}
+    assert new.arguments(params, "gpt-4o-mini")["model"] == "gpt-4o-mini"
+
+
+def test_failover_needs_admission(servers):
+    broken, healthy = servers("0.01", "0.01")
+    fail(broken)
+    pool = BackendPool([backend("broken", broken), backend("healthy", healthy)])
+    asked = []
+
+    with pytest.raises(Exception) as error:
+        pool.complete(PARAMS, admit=lambda hedge=False: asked.append(hedge))
+    assert getattr(error.value, "status_code", None) == 500
+    assert asked == [False]
+    assert requests(healthy) == 0
+    assert pool.stats()["failovers"] == 0
+    assert [b["in_flight"] for b in pool.stats()["backends"]] == [0, 0]
+
+
+def test_hedge_is_skipped_without_spare_capacity(servers):
+    slow, fast = servers("0.3", "0.01")
+    pool = BackendPool([backend("slow", slow), backend("fast", fast)], hedge=True, hedge_min_delay=0.05,
+                       hedge_budget=1.0)
+    span = {}
+
+    response = pool.complete(PARAMS, span=span, admit=lambda hedge=False: not hedge)
+
+    assert response.choices[0].message.content
+    assert span["backend"] == "slow"
+    assert requests(fast) == 0
+    stats = pool.stats()
+    assert (stats["hedges"], stats["hedges_denied"]) == (0, 1)
+    assert [b["in_flight"] for b in stats["backends"]] == [0, 0]
+
+
+def test_hedge_delay_starts_when_the_call_goes_out(servers):
+    primary, other = servers("0.1", "0.01")
+    pool = BackendPool([backend("primary", primary), backend("other", other)], hedge=True, hedge_min_delay=0.25,
+                       hedge_budget=1.0, hedge_workers=1)
+    # Keep the only worker busy for longer than the hedge delay
+    pool._executor.submit(time.sleep, 0.3)
+    pool.backends[1].latency = 1.0
+
+    assert pool.complete(PARAMS).choices[0].message.content
+    assert requests(other) == 0
+    assert pool.stats()["hedges"] == 0
+
+
+def test_hedge_workers_come_from_the_environment(monkeypatch):
+    monkeypatch.setenv("AZURE_OPENAI_BACKENDS", '[{"name": "a"}, {"name": "b"}]')
+    monkeypatch.setenv("AZURE_OPENAI_API_KEY", "test-key")
+    monkeypatch.setenv("AZURE_OPENAI_ENDPOINT", "http://127.0.0.1:9")
+    monkeypatch.setenv("HEDGE_ENABLED", "1")
+    monkeypatch.setenv("HEDGE_WORKERS", "4")
+
+    assert BackendPool.from_env()._executor._max_workers == 4
@@ -0,0 +1,97 @@
+import json
+
+import pytest
+
+import bulk_correct
+from admission import UpstreamOverloaded
+from bulk_correct import EXIT_OVERLOADED, parse_args, process
+
+
+class FakeGrader:
+    """Marks every text as correct; fails on the texts it is told to"""
+
+    def __init__(self, overloaded=()):
+        self.overloaded = set(overloaded)
+        self.graded = []
+
+    def grade(self, text):
+        if text in self.overloaded:
+            raise UpstreamOverloaded(1, "timeout")
+        self.graded.append(text)
+        return {"correction": None}
+
+
+def write_input(path, lines):
+    with open(path, "wb") as f:
+        for line in lines:
+            f.write(line if isinstance(line, bytes) else json.dumps(line, ensure_ascii=False).encode("utf-8"))
+            f.write(b"\n")
+
+
+def read_output(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def read_checkpoint(path):
+    with open(str(path) + ".checkpoint", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def run_args(tmp_path, *extra):
+    return parse_args([str(tmp_path / "in.jsonl"), str(tmp_path / "out.jsonl"), "--workers", "2", *extra])
+
+
+def test_invalid_utf8_line_is_reported_and_the_run_completes(tmp_path):
+    write_input(tmp_path / "in.jsonl", [{"text": "我去了商店"}, b"\xff\xfe broken", {"text": "你好"}])
+    exit_code, counts = process(FakeGrader(), run_args(tmp_path))
+
+    assert exit_code == 0
+    assert [record.get("error") for record in read_output(tmp_path / "out.jsonl")] == [None, "Invalid UTF-8", None]
+    assert counts == {"lines": 3, "errors": 1}
+    assert read_checkpoint(tmp_path / "out.jsonl")["done"] is True
+
+
+def test_unexpected_exception_leaves_a_resumable_checkpoint(tmp_path, monkeypatch):
+    write_input(tmp_path / "in.jsonl", [{"text": f"句子{i}"} for i in range(10)])
+    read_items = bulk_correct.read_items
+
+    def failing_read_items(*args):
+        for number, item in enumerate(read_items(*args), 1):
+            if number == 6:
+                raise RuntimeError("disk went away")
+            yield item
+
+    monkeypatch.setattr(bulk_correct, "read_items", failing_read_items)
+    with pytest.raises(RuntimeError):
+        process(FakeGrader(), run_args(tmp_path))
+    checkpoint = read_checkpoint(tmp_path / "out.jsonl")
+    assert checkpoint["done"] is False
+    # The lines already graded were written before stopping
+    assert checkpoint["line"] == 5
+    assert [record["line"] for record in read_output(tmp_path / "out.jsonl")] == [1, 2, 3, 4, 5]
+
+    monkeypatch.setattr(bulk_correct, "read_items", read_items)
+    exit_code, counts = process(FakeGrader(), run_args(tmp_path))
+    assert exit_code == 0
+    assert [record["line"] for record in read_output(tmp_path / "out.jsonl")] == list(range(1, 11))
+    assert counts["lines"] == 10
+    assert read_checkpoint(tmp_path / "out.jsonl")["done"] is True
+
+
+def test_overload_stops_and_resumes_without_redoing_lines(tmp_path):
+    write_input(tmp_path / "in.jsonl", [{"text": f"句子{i}", "id": i} for i in range(8)])
+    exit_code, _ = process(FakeGrader(overloaded={"句子5"}), run_args(tmp_path))
+
+    assert exit_code == EXIT_OVERLOADED
+    checkpoint = read_checkpoint(tmp_path / "out.jsonl")
+    assert checkpoint["done"] is False
+    assert checkpoint["line"] == 5
+    assert [record["id"] for record in read_output(tmp_path / "out.jsonl")] == [0, 1, 2, 3, 4]
+
+    grader = FakeGrader()
+    exit_code, counts = process(grader, run_args(tmp_path))
+    assert exit_code == 0
+    assert grader.graded == ["句子5", "句子6", "句子7"]
+    assert [record["id"] for record in read_output(tmp_path / "out.jsonl")] == list(range(8))
+    assert counts == {"lines": 8, "errors": 0}
@@ -0,0 +1,142 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import MISSING, LRUCache, SingleFlight, TieredCache, normalize_text
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(max_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is MISSING
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_lru_expires_entries_and_caches_none():
+    cache = LRUCache(ttl=60)
+    cache.set("gone", "value", ttl=-1)
+    cache.set("none", None)
+
+    assert cache.get("gone") is MISSING
+    assert cache.get("none") is None
+
+
+def test_tiered_cache_survives_restart(tmp_path):
+    db_path = str(tmp_path / "cache.db")
+    TieredCache("translation", db_path=db_path).set("你好", {"english": "hello"})
+
+    cache = TieredCache("translation", db_path=db_path)
+    assert cache.get("你好") == {"english": "hello"}
+    assert cache.get("你好") == {"english": "hello"}
+    assert cache.get("再见") is MISSING
+
+    stats = cache.stats()
+    assert (stats["disk_hits"], stats["memory_hits"], stats["misses"]) == (1, 1, 1)
+    assert TieredCache("pinyin", db_path=db_path).get("你好") is MISSING
+
+
+def test_keys_are_normalized():
+    assert normalize_text(" 你好\u3000 世界 ") == "你好 世界"
+    assert normalize_text("ＡＢＣ１２３") == "ABC123"
+
+
+def test_repeated_reply_is_translated_once(make_tutor):
+    tutor, server = make_tutor()
+
+    first = tutor._get_translation("你好！")
+    second = tutor._get_translation(" 你好！ ")
+
+    assert first == second == "Hello! What would you like to talk about today?"
+    assert server.fake.stats()["by_task"] == {"translation": 1}
+    assert tutor.stats()["caches"]["translation"]["memory_hits"] == 1
+
+
+def test_translations_persist_between_tutors(make_tutor, tmp_path):
+    db_path = str(tmp_path / "cache.db")
+    tutor, _ = make_tutor(CACHE_DB_PATH=db_path)
+    tutor._get_translation("你好！")
+
+    restarted, server = make_tutor(CACHE_DB_PATH=db_path)
+
+    assert restarted._get_translation("你好！") == "Hello! What would you like to talk about today?"
+    assert server.fake.stats()["requests"] == 0
+    assert restarted.stats()["caches"]["translation"]["disk_hits"] == 1
+
+
+def test_failed_translation_is_not_cached(make_tutor):
+    tutor, server = make_tutor()
+    server.fake.error_rate = 1.0
+    assert tutor._get_translation("你好！") == "Translation not available"
+
+    server.fake.error_rate = 0.0
+    assert tutor._get_translation("你好！") == "Hello! What would you like to talk about today?"
+
+
+def test_single_flight_merges_concurrent_calls():
+    flight = SingleFlight("test")
+    release = threading.Event()
+    calls = []
+    results = []
+
+    def fetch(key):
+        calls.append(key)
+        release.wait(2)
+        return key.upper()
+
+    threads = [threading.Thread(target=lambda: results.append(flight.do("k", fetch, "k"))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 2
+    while flight.stats()["merged"] < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(2)
+
+    assert calls == ["k"]
+    assert results == ["K"] * 4
+    assert flight.stats() == {"in_flight": 0, "upstream_calls": 1, "merged": 3, "errors": 0}
+
+
+def test_single_flight_forgets_finished_calls():
+    flight = SingleFlight("test")
+
+    assert [flight.do("k", lambda: len(flight._calls)) for _ in range(2)] == [1, 1]
+    assert flight.stats()["upstream_calls"] == 2
+
+
+def test_single_flight_async_shares_exceptions():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    async def run():
+        return await asyncio.gather(*(flight.do_async("k", fetch) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(run())
+
+    assert len(calls) == 1
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flight.stats()["errors"] == 1
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_simultaneous_identical_corrections_share_one_call(make_tutor):
+    tutor, server = make_tutor(latency="0.2")
+
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        results = list(pool.map(tutor._corrections, ["我昨天去了商店买东西"] * 5))
+
+    assert results == [None] * 5
+    assert server.fake.stats()["by_task"] == {"correction": 1}
+    assert tutor.stats()["single_flight"]["correction"]["merged"] == 4
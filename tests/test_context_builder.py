@@ -0,0 +1,97 @@
+from cache import LRUCache
+from context_builder import ContextBuilder
+
+SYSTEM = "You are a Chinese tutor."
+
+
+class QueuedExecutor:
+    """Collects submitted summaries without running them, like a busy pool"""
+
+    def __init__(self):
+        self.calls = []
+
+    def submit(self, fn, *args):
+        self.calls.append((fn, args))
+
+    def run_all(self):
+        calls, self.calls = self.calls, []
+        for fn, args in calls:
+            fn(*args)
+
+
+def summarize(previous_summary, turns):
+    return f"{previous_summary or ''} {len(turns)} turns".strip()
+
+
+def conversation(length, filler="word " * 40):
+    history = []
+    for i in range(length):
+        sender = "user" if i % 2 == 0 else "ai"
+        history.append({"sender": sender, "message": f"message {i} {filler}"})
+    return history
+
+
+def builder(executor=None, **kwargs):
+    return ContextBuilder(summarize, LRUCache(max_size=100), executor=executor, **kwargs)
+
+
+def history_messages(messages):
+    return [m["content"] for m in messages[1:-1] if not m["content"].startswith("Summary of")]
+
+
+def test_short_conversation_is_kept_verbatim():
+    history = conversation(4)
+    messages = builder().build(SYSTEM, history, "hello")
+    assert history_messages(messages) == [m["message"] for m in history]
+    assert messages[-1] == {"role": "user", "content": "hello"}
+
+
+def test_newest_exchange_is_always_in_the_prompt_while_summaries_are_pending():
+    executor = QueuedExecutor()
+    context = builder(executor)
+    for length in range(2, 40, 2):
+        # About 200 characters of Chinese per turn, so only a few fit the default budget
+        history = conversation(length, "我们今天下午去公园散步了。" * 15)
+        kept = history_messages(context.build(SYSTEM, history, "hello"))
+        assert kept[-2:] == [history[-2]["message"], history[-1]["message"]], length
+
+
+def test_newest_message_is_kept_with_a_small_budget():
+    executor = QueuedExecutor()
+    context = builder(executor, token_budget=300)
+    for length in range(1, 30):
+        history = conversation(length)
+        kept = history_messages(context.build(SYSTEM, history, "hello"))
+        assert kept and kept[-1] == history[-1]["message"], length
+        executor.run_all()
+
+
+def test_summary_covers_older_turns_and_recent_turns_stay():
+    executor = QueuedExecutor()
+    context = builder(executor, max_messages=4, summary_interval=6)
+    history = conversation(20)
+    first = context.build(SYSTEM, history, "hello")
+    assert not first[1]["content"].startswith("Summary of")
+    assert len(executor.calls) == 1
+
+    executor.run_all()
+    messages = context.build(SYSTEM, history, "hello")
+    assert messages[1]["content"].startswith("Summary of the earlier conversation")
+    assert history_messages(messages) == [m["message"] for m in history[-4:]]
+    # The boundary's summary is reused, not rebuilt, on the next request
+    context.build(SYSTEM, history, "hello")
+    assert executor.calls == []
+
+
+def test_summary_key_is_stable_for_a_session_window():
+    context = builder(max_messages=4, summary_interval=6)
+    history = conversation(20)
+    full = context.build(SYSTEM, history, "hello")
+
+    from context_builder import roll_key
+    key = ""
+    for message in history[:8]:
+        key = roll_key(key, "user" if message["sender"] == "user" else "assistant", message["message"])
+    # A session that only holds the messages from position 8 on gets the same prompt
+    windowed = context.build(SYSTEM, history[8:], "hello", history_base=(8, key))
+    assert windowed == full
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+import app as flask_app
+from admission import AdmissionController
+from app import LazyTutor
+
+WRONG = "我昨天去商店了买东西"
+RIGHT = "我昨天去了商店买东西"
+CORRECTION = {
+    "has_errors": True,
+    "type": "grammar_correction",
+    "original": WRONG,
+    "corrected": RIGHT,
+    "explanation": "了 goes after the verb."
+}
+
+
+def test_identical_sentences_are_checked_once_and_keep_their_order(make_tutor):
+    tutor, server = make_tutor({"correction": CORRECTION})
+
+    results = tutor.correct_batch([WRONG, RIGHT, WRONG, "", RIGHT])
+
+    assert [item["sentence"] for item in results] == [WRONG, RIGHT, WRONG, "", RIGHT]
+    assert results[0] == results[2]
+    assert results[0]["correction"]["corrected"] == RIGHT
+    assert results[3] == {"sentence": "", "error": "Sentence is required"}
+    assert server.fake.stats()["by_task"] == {"correction": 2}
+
+
+def test_rejected_sentences_carry_retry_after(make_tutor):
+    tutor, server = make_tutor()
+    tutor.admission = AdmissionController(rpm=6, max_queue=0)
+    tutor.admission.acquire("chat", 1)
+
+    [item] = tutor.correct_batch([WRONG])
+
+    assert item["error"] == "The tutor is busy right now. Please try again shortly."
+    assert item["retry_after"] >= 1
+    assert server.fake.stats()["requests"] == 0
+
+
+@pytest.mark.parametrize("body, error", [
+    ({}, "sentences must be a non-empty list"),
+    ({"sentences": []}, "sentences must be a non-empty list"),
+    ({"sentences": WRONG}, "sentences must be a non-empty list"),
+    ({"sentences": [WRONG, 42]}, "Every sentence must be a string"),
+    ({"sentences": [WRONG] * 3}, "At most 2 sentences per batch"),
+])
+def test_route_checks_the_batch(body, error, monkeypatch):
+    monkeypatch.setattr(flask_app, "BATCH_MAX_SENTENCES", 2)
+
+    response = flask_app.app.test_client().post("/api/correct/batch", json=body)
+
+    assert response.status_code == 400
+    assert response.get_json() == {"error": error}
+
+
+def test_route_strips_sentences(make_tutor, monkeypatch):
+    tutor, _ = make_tutor({"correction": CORRECTION})
+    monkeypatch.setattr(flask_app, "tutor", LazyTutor(lambda: tutor))
+
+    response = flask_app.app.test_client().post("/api/correct/batch", json={"sentences": [f" {WRONG} ", "  "]})
+
+    results = response.get_json()["results"]
+    assert [item["sentence"] for item in results] == [WRONG, ""]
+    assert results[0]["correction"]["corrected"] == RIGHT
+
+
+def test_asgi_batch_dedupes_and_keeps_order(make_tutor, monkeypatch):
+    asgi_app = pytest.importorskip("asgi_app")
+    tutor, server = make_tutor({"correction": CORRECTION}, tutor_class=asgi_app.AsyncChineseLanguageTutor)
+    monkeypatch.setattr(asgi_app, "tutor", LazyTutor(lambda: tutor))
+
+    async def post():
+        response = await asgi_app.app.test_client().post("/api/correct/batch", json={"sentences": [WRONG, RIGHT, WRONG]})
+        body = await response.get_json()
+        await tutor.aclose()
+        return body
+
+    results = asyncio.run(post())["results"]
+
+    assert [item["sentence"] for item in results] == [WRONG, RIGHT, WRONG]
+    assert results[0] == results[2]
+    assert server.fake.stats()["by_task"] == {"correction": 2}
@@ -0,0 +1,62 @@
+import app as flask_app
+
+SENTENCE = "我昨天去商店了买东西"
+CORRECTION = {
+    "has_errors": True,
+    "type": "grammar_correction",
+    "original": SENTENCE,
+    "corrected": "我昨天去商店买东西了",
+    "explanation": "了 goes at the end."
+}
+
+
+def correction_calls(server):
+    return server.fake.stats()["by_task"].get("correction", 0)
+
+
+def test_repeated_sentence_is_checked_once(make_tutor):
+    tutor, server = make_tutor({"correction": CORRECTION})
+
+    first = tutor._corrections(SENTENCE)
+    second = tutor._corrections(f"  {SENTENCE} ")
+
+    assert first == second
+    assert first["corrected"] == "我昨天去商店买东西了"
+    assert "has_errors" not in first
+    assert correction_calls(server) == 1
+
+
+def test_no_errors_result_is_cached_too(make_tutor):
+    tutor, server = make_tutor()
+
+    assert tutor._corrections(SENTENCE) is None
+    assert tutor._corrections(SENTENCE) is None
+    assert correction_calls(server) == 1
+    assert tutor.stats()["caches"]["correction"]["memory_hits"] == 1
+
+
+def test_unparsed_reply_is_not_cached(make_tutor):
+    tutor, server = make_tutor({"correction": "Looks fine to me!"})
+
+    assert tutor._corrections(SENTENCE) is None
+    assert tutor._corrections(SENTENCE) is None
+    assert correction_calls(server) == 2
+
+
+def test_new_prompt_version_misses_old_results(make_tutor, monkeypatch):
+    tutor, server = make_tutor({"correction": CORRECTION})
+    tutor._corrections(SENTENCE)
+
+    monkeypatch.setattr(flask_app, "CORRECTION_PROMPT_VERSION", "test")
+
+    tutor._corrections(SENTENCE)
+    assert correction_calls(server) == 2
+
+
+def test_failed_check_is_not_cached(make_tutor):
+    tutor, server = make_tutor({"correction": CORRECTION})
+    server.fake.error_rate = 1.0
+    assert tutor._analyze_for_corrections(SENTENCE) is None
+
+    server.fake.error_rate = 0.0
+    assert tutor._analyze_for_corrections(SENTENCE)["corrected"] == "我昨天去商店买东西了"
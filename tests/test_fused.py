@@ -0,0 +1,90 @@
+import app as flask_app
+from app import FUSED_ERROR_RESPONSE
+
+
+def fused_body(**fields):
+    return {"fused": dict({"response": "你好！你今天做了什么？", "translation": "Hello! What did you do today?"}, **fields)}
+
+
+def test_fused_reply_comes_from_one_completion(make_tutor):
+    tutor, server = make_tutor(fused_body(has_errors=True, correction={
+        "type": "grammar_correction", "original": "我昨天去商店了买东西", "corrected": "我昨天去商店买东西了",
+        "explanation": "了 goes at the end."
+    }))
+
+    result = tutor.respond("我昨天去商店了买东西", [], "fused")
+
+    assert result["mode"] == "fused"
+    assert result["response"] == "你好！你今天做了什么？"
+    assert result["translation"] == "Hello! What did you do today?"
+    assert result["correction"]["corrected"] == "我昨天去商店买东西了"
+    assert server.fake.stats()["by_task"] == {"fused": 1}
+
+
+def test_grammar_correction_without_a_corrected_sentence_is_dropped(make_tutor):
+    tutor, _ = make_tutor(fused_body(has_errors=True, correction={"type": "grammar_correction", "explanation": "?"}))
+
+    assert tutor.respond("我昨天去商店了买东西", [], "fused")["correction"] is None
+
+
+def test_correct_sentence_has_no_correction(make_tutor):
+    tutor, _ = make_tutor(fused_body(has_errors=False, correction={"type": "grammar_correction", "corrected": "你好"}))
+
+    assert tutor.respond("你好", [], "fused")["correction"] is None
+
+
+def test_interjection_words_are_filled_in_from_the_message(make_tutor):
+    tutor, _ = make_tutor(fused_body(has_errors=True, correction={
+        "type": "interjection_help", "translations": ["咖啡"], "explanation": "Coffee is 咖啡."
+    }))
+
+    correction = tutor.respond("我想喝 coffee", [], "fused")["correction"]
+
+    assert correction["type"] == "interjection_help"
+    assert correction["english_words"] == ["coffee"]
+
+
+def test_reply_that_is_not_json_falls_back_to_its_first_line(make_tutor):
+    tutor, _ = make_tutor({"fused": "你好！\nHello!"})
+
+    result = tutor.respond("你好", [], "fused")
+
+    assert result["response"] == "你好！"
+    assert result["translation"] == "I understand what you said. Let's continue our conversation!"
+    assert result["correction"] is None
+
+
+def test_json_without_a_reply_falls_back(make_tutor):
+    tutor, _ = make_tutor({"fused": {"translation": "Hello"}})
+
+    result = tutor.respond("你好", [], "fused")
+
+    assert result["response"] == '{"translation": "Hello"}'
+    assert result["correction"] is None
+
+
+def test_failed_completion_returns_the_canned_reply(make_tutor):
+    tutor, server = make_tutor()
+    server.fake.error_rate = 1.0
+
+    result = tutor.respond("你好", [], "fused")
+
+    assert result == dict(FUSED_ERROR_RESPONSE, mode="fused")
+
+
+def test_fused_stream_sends_the_whole_reply_and_reports_the_mode(make_tutor):
+    tutor, server = make_tutor(fused_body())
+
+    events = list(tutor.stream_conversation_response("你好", [], mode="fused"))
+
+    assert [event for event, _ in events] == ["reply", "reply_done", "translation", "correction", "done"]
+    assert events[1][1] == {"response": "你好！你今天做了什么？", "mode": "fused"}
+    assert events[-1][1] == {"mode": "fused"}
+    assert server.fake.stats()["by_task"] == {"fused": 1}
+
+
+def test_stream_route_rejects_unknown_modes():
+    response = flask_app.app.test_client().post("/api/chat/stream", json={"message": "你好", "mode": "turbo"})
+
+    assert response.status_code == 400
+    assert "Unknown mode" in response.get_json()["error"]
@@ -0,0 +1,82 @@
+import pytest
+
+from glossary import GLOSSARY_PATH, Glossary, build, read_source, rewrite
+
+ENTRIES = {"apple": "苹果", "bus": "公共汽车", "city": "城市", "library": "图书馆", "zebra": "斑马"}
+
+
+@pytest.fixture
+def glossary(tmp_path):
+    path = str(tmp_path / "glossary.bin")
+    build(ENTRIES, path)
+    return Glossary(path)
+
+
+@pytest.mark.parametrize("word, chinese", [
+    ("apple", "苹果"),
+    ("Apple", "苹果"),
+    ("zebra", "斑马"),
+    ("apples", "苹果"),
+    ("buses", "公共汽车"),
+    ("cities", "城市"),
+    ("LIBRARIES", "图书馆"),
+    ("banana", None),
+    ("s", None),
+])
+def test_lookup(glossary, word, chinese):
+    assert glossary.lookup(word) == chinese
+
+
+def test_translate_keeps_only_known_words(glossary):
+    assert glossary.translate(["apples", "banana", "apples", "bus"]) == {"apples": "苹果", "bus": "公共汽车"}
+
+
+def test_rewrite_closes_the_gaps_left_between_chinese():
+    assert rewrite("我想吃 apple 和 banana 。", {"apple": "苹果"}) == "我想吃苹果和 banana 。"
+
+
+def test_missing_file_knows_no_words(tmp_path):
+    glossary = Glossary(str(tmp_path / "missing.bin"))
+
+    assert len(glossary) == 0
+    assert glossary.lookup("apple") is None
+
+
+@pytest.mark.parametrize("source, error", [
+    ("apple\t苹果\nApple\t苹果\n", "listed twice"),
+    ("apple 苹果\n", "expected 'english<TAB>chinese'"),
+])
+def test_bad_source_lines_are_reported(tmp_path, source, error):
+    path = tmp_path / "glossary.tsv"
+    path.write_text(source, encoding="utf-8")
+
+    with pytest.raises(ValueError, match=error):
+        read_source(str(path))
+
+
+def test_shipped_index_matches_its_source():
+    entries = read_source()
+    glossary = Glossary(GLOSSARY_PATH)
+
+    assert len(glossary) == len(entries)
+    assert all(glossary.lookup(english) == chinese for english, chinese in entries.items())
+
+
+def test_known_interjection_is_answered_locally(make_tutor):
+    tutor, server = make_tutor()
+
+    correction = tutor._corrections("我想去 library 看书")
+
+    assert correction["type"] == "interjection_help"
+    assert correction["suggested_sentence"] == "我想去图书馆看书"
+    assert server.fake.stats()["requests"] == 0
+    assert tutor.glossary.stats()["outcomes"] == {"local": 1}
+
+
+def test_partly_known_interjection_goes_to_azure(make_tutor):
+    tutor, server = make_tutor()
+
+    tutor._corrections("我想去 library 看 xylophone")
+
+    assert server.fake.stats()["by_task"] == {"interjection": 1}
+    assert tutor.glossary.stats()["outcomes"] == {"partial": 1}
@@ -0,0 +1,142 @@
+import asyncio
+import glob
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import app as flask_app
+import journal as journal_module
+from app import LazyTutor
+from journal import RequestJournal
+from replay import Replayer
+
+
+def read_entries(path):
+    entries = []
+    for name in glob.glob(path + "*"):
+        if name.endswith(".lock"):
+            continue
+        with open(name, encoding="utf-8") as f:
+            entries.extend(json.loads(line) for line in f if line.strip())
+    return entries
+
+
+def test_writers_sharing_a_path_rotate_without_losing_entries(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    # Two writers stand in for two gunicorn workers
+    writers = [RequestJournal(path, max_bytes=400, backups=50, flush_interval=0.01) for _ in range(2)]
+    for i in range(60):
+        writers[i % 2].record({"n": i, "message": "你好" * 5})
+    for writer in writers:
+        writer.close()
+
+    assert sorted(entry["n"] for entry in read_entries(path)) == list(range(60))
+    assert sum(writer.stats()["rotations"] for writer in writers) > 0
+
+
+def test_failed_rotation_keeps_the_batch(tmp_path, monkeypatch):
+    path = str(tmp_path / "journal.jsonl")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"n": -1}) + "\n")
+
+    def fail(source, target):
+        raise PermissionError("read-only directory")
+
+    monkeypatch.setattr(journal_module.os, "replace", fail)
+    writer = RequestJournal(path, max_bytes=10, flush_interval=0.01)
+    writer.record({"n": 0})
+    writer.close()
+
+    assert [entry["n"] for entry in read_entries(path)] == [-1, 0]
+    assert writer.stats()["written"] == 1
+    assert writer.stats()["errors"] == 1
+
+
+class Recorder:
+    def __init__(self):
+        self.entries = []
+
+    def record(self, entry):
+        self.entries.append(entry)
+
+
+def test_flask_stream_is_journaled_when_it_ends(make_tutor, monkeypatch):
+    tutor, _ = make_tutor()
+    recorder = Recorder()
+    monkeypatch.setattr(flask_app, "tutor", LazyTutor(lambda: tutor))
+    monkeypatch.setattr(flask_app, "journal", recorder)
+
+    response = flask_app.app.test_client().post("/api/chat/stream", json={"message": "我昨天去了商店"})
+    response.get_data()
+
+    [entry] = recorder.entries
+    assert entry["route"] == "/api/chat/stream"
+    assert entry["status"] == 200
+    assert entry["request"] == {"message": "我昨天去了商店"}
+    assert entry["response"] == {
+        "response": "你好！今天你想聊什么？",
+        "translation": "Hello! What would you like to talk about today?",
+        "correction": None,
+        "mode": "pipeline"
+    }
+    assert sorted(span["task"] for span in entry["upstream"]) == ["chat", "correction", "translation"]
+
+
+def test_asgi_stream_is_journaled_when_it_ends(make_tutor, monkeypatch):
+    asgi_app = pytest.importorskip("asgi_app")
+    tutor, _ = make_tutor(tutor_class=asgi_app.AsyncChineseLanguageTutor)
+    recorder = Recorder()
+    monkeypatch.setattr(asgi_app, "tutor", LazyTutor(lambda: tutor))
+    monkeypatch.setattr(asgi_app, "journal", recorder)
+
+    async def post():
+        response = await asgi_app.app.test_client().post("/api/chat/stream", json={"message": "你好", "mode": "fused"})
+        await response.get_data()
+        await tutor.aclose()
+
+    asyncio.run(post())
+
+    [entry] = recorder.entries
+    assert entry["route"] == "/api/chat/stream"
+    assert entry["response"]["mode"] == "fused"
+    assert [span["task"] for span in entry["upstream"]] == ["chat"]
+
+
+class EventStreamHandler(BaseHTTPRequestHandler):
+    events = []
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for event in self.events:
+            self.wfile.write(f"event: {event}\ndata: {{}}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.mark.parametrize("events, status", [
+    (["reply", "reply_done", "translation", "done"], "200"),
+    (["reply", "reply_done", "error"], "incomplete_stream"),
+])
+def test_replay_reads_event_streams_to_the_end(events, status):
+    handler = type("Handler", (EventStreamHandler,), {"events": events})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        replayer = Replayer(f"http://127.0.0.1:{server.server_port}", timeout=5)
+        replayer.replay_one({"route": "/api/chat/stream", "request": {"message": "你好"}, "duration_ms": 5},
+                            time.monotonic())
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    result = replayer.results["/api/chat/stream"]
+    assert result["status"] == {status: 1}
+    assert len(result["first_event"]) == (1 if status == "200" else 0)
@@ -0,0 +1,84 @@
+import app as flask_app
+import metrics
+from app import LazyTutor
+from metrics import Registry
+
+
+def sample(text, name):
+    """Value of the sample name (with its labels) in rendered metrics; 0 when absent"""
+    lines = [line for line in text.splitlines() if line.startswith(name + " ")]
+    return float(lines[0].rsplit(" ", 1)[1]) if lines else 0
+
+
+def test_counter_renders_one_line_per_label_set():
+    registry = Registry()
+    counter = registry.counter("test_calls_total", "Calls", ("task",))
+    counter.inc(task="chat")
+    counter.inc(2, task="chat")
+    counter.inc(task='say "hi"\n')
+
+    assert registry.render().splitlines() == [
+        "# HELP test_calls_total Calls",
+        "# TYPE test_calls_total counter",
+        'test_calls_total{task="chat"} 3',
+        'test_calls_total{task="say \\"hi\\"\\n"} 1',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    histogram = registry.histogram("test_seconds", "Latency", buckets=(0.1, 1))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    assert registry.render().splitlines()[2:] == [
+        'test_seconds_bucket{le="0.1"} 1',
+        'test_seconds_bucket{le="1"} 2',
+        'test_seconds_bucket{le="+Inf"} 3',
+        "test_seconds_sum 5.55",
+        "test_seconds_count 3",
+    ]
+
+
+def test_collectors_are_read_at_render_time():
+    registry = Registry()
+    values = {"queued": 1}
+    registry.set_collector("test", lambda: [("test_queued", "gauge", "Queued", [({}, values["queued"]),
+                                                                                 ({"x": "y"}, None)])])
+    registry.set_collector("broken", lambda: 1 / 0)
+    values["queued"] = 4
+
+    assert registry.render().splitlines() == ["# HELP test_queued Queued", "# TYPE test_queued gauge", "test_queued 4"]
+
+
+def test_spans_are_collected_per_request():
+    started = metrics.start_request()
+    metrics.record_upstream("chat", {"deployment": "gpt-4"}, 0.25)
+
+    [span] = metrics.log_request("/api/chat", "POST", "200", started, enabled=False)
+
+    assert span == {"deployment": "gpt-4", "task": "chat", "latency_ms": 250.0, "outcome": "ok"}
+    assert metrics.current_spans() is None
+
+
+def test_metrics_route_after_a_chat_turn(make_tutor, monkeypatch):
+    tutor, _ = make_tutor(AZURE_OPENAI_DEPLOYMENT_NAME="gpt-4")
+    monkeypatch.setattr(flask_app, "tutor", LazyTutor(lambda: tutor))
+    # Importing asgi_app points the collector at its own tutor
+    monkeypatch.setitem(metrics.REGISTRY._collectors, "tutor",
+                        lambda: flask_app.collect_metrics(tutor, flask_app.sessions))
+    client = flask_app.app.test_client()
+    before = client.get("/api/metrics").get_data(as_text=True)
+
+    client.post("/api/chat", json={"message": "我昨天去了商店买东西"})
+    response = client.get("/api/metrics")
+    text = response.get_data(as_text=True)
+
+    assert response.content_type == metrics.CONTENT_TYPE
+    chat_requests = 'tutor_http_request_duration_seconds_count{route="/api/chat",method="POST",status="200"}'
+    assert sample(text, chat_requests) == sample(before, chat_requests) + 1
+    assert 'tutor_upstream_request_duration_seconds_count{task="translation",deployment="gpt-4",outcome="ok"}' in text
+    assert sample(text, 'tutor_cache_misses_total{cache="translation"}') == 1
+    assert sample(text, 'tutor_backend_circuit_open{backend="default"}') == 0
+    assert "tutor_sessions_active " in text
@@ -0,0 +1,63 @@
+import itertools
+import time
+
+from app import ChineseLanguageTutor
+from reply_cache import OpeningReplyCache
+
+
+def filled_cache(message):
+    numbers = itertools.count()
+
+    def generate(text):
+        number = next(numbers)
+        return {"response": f"你好 {number}", "translation": f"hello {number}", "correction": None}
+
+    cache = OpeningReplyCache(generate, variants=2, min_hits=1)
+    assert cache.get(message) is None
+    deadline = time.monotonic() + 2
+    while cache.stats()["generated"] < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return cache
+
+
+class StubTutor(ChineseLanguageTutor):
+    """respond() without Azure clients: uncached turns are answered by mode"""
+
+    def __init__(self, opening_cache):
+        self.opening_cache = opening_cache
+
+    def process_message(self, user_message, conversation_history, history_base=None):
+        return {"response": "fused", "translation": "", "correction": None}
+
+    def get_conversation_response(self, user_message, conversation_history, history_base=None):
+        return {"response": "pipeline", "translation": "", "correction": None}
+
+
+def test_pool_serves_variants_in_rotation():
+    cache = filled_cache("你好！")
+
+    replies = [cache.get(" 你好 ")["response"] for _ in range(4)]
+
+    assert replies == ["你好 0", "你好 1", "你好 0", "你好 1"]
+    assert cache.get("你好？") is not None
+    assert cache.get("你好" * 30) is None
+
+
+def test_pooled_reply_is_marked_cached_and_keeps_pipeline_mode():
+    tutor = StubTutor(filled_cache("你好"))
+
+    result = tutor.respond("你好", [], "pipeline")
+
+    assert result["response"].startswith("你好")
+    assert result["mode"] == "pipeline"
+    assert result["cached"] is True
+
+
+def test_fused_turns_and_turns_with_history_skip_the_pool():
+    tutor = StubTutor(filled_cache("你好"))
+
+    fused = tutor.respond("你好", [], "fused")
+    with_history = tutor.respond("你好", [{"sender": "user", "message": "早"}], "pipeline")
+
+    assert (fused["response"], fused["mode"], "cached" in fused) == ("fused", "fused", False)
+    assert (with_history["response"], "cached" in with_history) == ("pipeline", False)
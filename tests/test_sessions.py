@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+
+import app as flask_app
+from sessions import SessionStore
+
+MALFORMED_HISTORIES = [
+    "你好",
+    {"sender": "user", "message": "你好"},
+    ["你好"],
+    [{"sender": "user", "message": None}],
+    [{"sender": "user", "message": ["你好"]}],
+]
+
+
+def test_session_is_seeded_with_the_valid_turns():
+    store = SessionStore(max_messages=4)
+    session_id = store.create([
+        {"sender": "user", "message": "你好"},
+        {"sender": "system", "message": "ignored"},
+        {"sender": "ai", "message": "你好！"},
+        {"sender": "user", "message": ""},
+    ])
+
+    assert store.history(session_id) == [
+        {"sender": "user", "message": "你好"},
+        {"sender": "ai", "message": "你好！"},
+    ]
+
+
+def test_session_keeps_the_newest_messages():
+    store = SessionStore(max_messages=2)
+    session_id = store.create()
+    store.append_turn(session_id, "一", "二")
+    store.append_turn(session_id, "三", "四")
+
+    assert [msg["message"] for msg in store.history(session_id)] == ["三", "四"]
+    assert store.delete(session_id)
+    assert store.history(session_id) is None
+
+
+@pytest.mark.parametrize("history", MALFORMED_HISTORIES)
+@pytest.mark.parametrize("route, body", [
+    ("/api/session", {}),
+    ("/api/chat", {"message": "你好"}),
+    ("/api/chat/stream", {"message": "你好"}),
+])
+def test_flask_rejects_malformed_history(route, body, history):
+    response = flask_app.app.test_client().post(route, json=dict(body, conversation_history=history))
+
+    assert response.status_code == 400
+    assert "conversation_history" in response.get_json()["error"]
+
+
+@pytest.mark.parametrize("history", MALFORMED_HISTORIES)
+def test_asgi_rejects_malformed_history(history):
+    asgi_app = pytest.importorskip("asgi_app")
+
+    async def post():
+        response = await asgi_app.app.test_client().post("/api/session", json={"conversation_history": history})
+        return response.status_code, await response.get_json()
+
+    status, body = asyncio.run(post())
+
+    assert status == 400
+    assert "conversation_history" in body["error"]
+
+
+def test_session_route_accepts_client_history():
+    client = flask_app.app.test_client()
+    history = [{"sender": "user", "message": "你好", "translation": None, "timestamp": "2024-01-01T00:00:00Z"}]
+
+    response = client.post("/api/session", json={"conversation_history": history})
+
+    assert response.status_code == 201
+    assert flask_app.sessions.history(response.get_json()["session_id"]) == [{"sender": "user", "message": "你好"}]
+
+
+@pytest.mark.parametrize("session_id", [["abc"], {"id": "abc"}, 42, True])
+@pytest.mark.parametrize("route", ["/api/chat", "/api/chat/stream"])
+def test_flask_rejects_session_ids_that_are_not_strings(route, session_id):
+    response = flask_app.app.test_client().post(route, json={"message": "你好", "session_id": session_id})
+
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "session_id must be a string"}
+
+
+@pytest.mark.parametrize("route", ["/api/chat", "/api/chat/stream"])
+def test_asgi_rejects_session_ids_that_are_not_strings(route):
+    asgi_app = pytest.importorskip("asgi_app")
+
+    async def post():
+        response = await asgi_app.app.test_client().post(route, json={"message": "你好", "session_id": ["abc"]})
+        return response.status_code, await response.get_json()
+
+    assert asyncio.run(post()) == (400, {"error": "session_id must be a string"})
+
+
+def test_unknown_string_session_is_a_404():
+    response = flask_app.app.test_client().post("/api/chat", json={"message": "你好", "session_id": "gone"})
+
+    assert response.status_code == 404
+    assert response.get_json()["session_id"] == "gone"
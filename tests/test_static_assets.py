@@ -0,0 +1,88 @@
+import gzip
+import os
+
+import pytest
+
+import app as flask_app
+from static_assets import IMMUTABLE, REVALIDATE, StaticAssets
+
+INDEX_HTML = '<link rel="stylesheet" href="styles.css"><script src="/app.js"></script>'
+APP_JS = "console.log('你好');\n" * 50
+
+
+@pytest.fixture
+def directory(tmp_path):
+    files = {"index.html": INDEX_HTML, "app.js": APP_JS, "styles.css": "body { margin: 0; }", "secret.env": "KEY=1"}
+    for name, text in files.items():
+        (tmp_path / name).write_text(text, encoding="utf-8")
+    return tmp_path
+
+
+def test_index_points_at_hashed_names(directory):
+    assets = StaticAssets(str(directory))
+    names = assets.stats()["files"]
+
+    status, headers, body = assets.response("index.html")
+
+    assert status == 200
+    assert headers["Cache-Control"] == REVALIDATE
+    assert body.decode("utf-8") == (f'<link rel="stylesheet" href="{names["styles.css"]}">'
+                                    f'<script src="/{names["app.js"]}"></script>')
+    assert assets.response(names["app.js"])[1]["Cache-Control"] == IMMUTABLE
+    assert assets.response("app.js")[1]["Cache-Control"] == REVALIDATE
+
+
+def test_only_listed_files_are_served(directory):
+    assets = StaticAssets(str(directory))
+
+    for name in ("secret.env", "../secret.env", "app.0000.js", "", "index.htm"):
+        assert assets.response(name) is None
+
+
+@pytest.mark.parametrize("accept_encoding, encoding", [
+    ("gzip, deflate", "gzip"),
+    ("gzip;q=0", None),
+    ("*", "gzip"),
+    (None, None),
+])
+def test_gzip_is_sent_when_accepted(directory, accept_encoding, encoding, monkeypatch):
+    monkeypatch.setattr("static_assets.brotli", None)
+    assets = StaticAssets(str(directory))
+
+    _, headers, body = assets.response("app.js", accept_encoding=accept_encoding)
+
+    assert headers.get("Content-Encoding") == encoding
+    assert headers["Vary"] == "Accept-Encoding"
+    assert (gzip.decompress(body) if encoding else body).decode("utf-8") == APP_JS
+
+
+def test_matching_etag_is_a_304(directory):
+    assets = StaticAssets(str(directory))
+    _, headers, _ = assets.response("app.js", accept_encoding="gzip")
+    etag = headers["ETag"]
+
+    assert assets.response("app.js", etag, "gzip")[::2] == (304, b"")
+    assert assets.response("app.js", f'W/{etag}, "other"')[0] == 304
+    assert assets.response("app.js", "*")[0] == 304
+    assert assets.response("app.js", '"other"')[0] == 200
+    assert assets.stats()["not_modified"] == 3
+
+
+def test_reload_picks_up_changed_files(directory):
+    assets = StaticAssets(str(directory), reload=True)
+    old_name = assets.stats()["files"]["app.js"]
+    (directory / "app.js").write_text("console.log(1);", encoding="utf-8")
+    os.utime(directory / "app.js", (1, 1))
+
+    assert assets.response("app.js")[2] == b"console.log(1);"
+    assert assets.response(old_name) is None
+
+
+def test_flask_serves_the_page_with_validators():
+    client = flask_app.app.test_client()
+
+    page = client.get("/")
+    assert page.status_code == 200
+    assert client.get("/", headers={"If-None-Match": page.headers["ETag"]}).status_code == 304
+    for path in ("/app.py", "/.env", "/requests.jsonl", "/data/pinyin.bin"):
+        assert client.get(path).status_code == 404
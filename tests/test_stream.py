@@ -0,0 +1,123 @@
+import asyncio
+import json
+
+import pytest
+
+import app as flask_app
+from admission import AdmissionController
+from app import CHAT_ERROR_RESPONSE, LazyTutor
+
+NOT_OBJECTS = [[], ["你好"], "你好", 3]
+
+
+def parse_events(body):
+    """(event, data) pairs of a text/event-stream body"""
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+@pytest.fixture
+def client(make_tutor, monkeypatch):
+    """A Flask test client whose tutor talks to a fake server: client() -> (client, tutor, server)"""
+    def make(**options):
+        tutor, server = make_tutor(**options)
+        monkeypatch.setattr(flask_app, "tutor", LazyTutor(lambda: tutor))
+        return flask_app.app.test_client(), tutor, server
+
+    return make
+
+
+def test_events_arrive_in_order(client):
+    test_client, _, _ = client()
+
+    response = test_client.post("/api/chat/stream", json={"message": "我昨天去了商店"})
+    events = parse_events(response.get_data(as_text=True))
+    names = [event for event, _ in events]
+
+    assert response.mimetype == "text/event-stream"
+    assert names[:names.index("reply_done")] == ["reply"] * names.index("reply_done")
+    assert sorted(names[names.index("reply_done") + 1:-1]) == ["correction", "translation"]
+    assert names[-1] == "done"
+    reply = "".join(data["delta"] for event, data in events if event == "reply")
+    assert dict(events)["reply_done"] == {"response": reply, "mode": "pipeline"}
+    assert dict(events)["translation"] == {"translation": "Hello! What would you like to talk about today?"}
+
+
+def test_failure_after_the_reply_ends_with_an_error_event(client, monkeypatch):
+    test_client, tutor, _ = client()
+
+    def broken(text):
+        raise RuntimeError("translation crashed")
+
+    monkeypatch.setattr(tutor, "_get_translation", broken)
+    events = parse_events(test_client.post("/api/chat/stream", json={"message": "你好"}).get_data(as_text=True))
+
+    assert "reply_done" in dict(events)
+    assert events[-1] == ("error", {"error": "An error occurred processing your message"})
+
+
+def test_failed_chat_call_sends_the_canned_reply(client):
+    test_client, _, server = client()
+    server.fake.error_rate = 1.0
+
+    events = dict(parse_events(test_client.post("/api/chat/stream", json={"message": "你好"}).get_data(as_text=True)))
+
+    assert events["reply_done"]["response"] == CHAT_ERROR_RESPONSE["response"]
+    assert events["translation"] == {"translation": CHAT_ERROR_RESPONSE["translation"]}
+    assert "done" in events
+
+
+def test_rejected_call_is_a_plain_429(client):
+    test_client, tutor, _ = client()
+    tutor.admission = AdmissionController(rpm=6, max_queue=1, max_wait=0.05)
+    tutor.admission.acquire("chat", 1)
+
+    response = test_client.post("/api/chat/stream", json={"message": "你好"})
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"]
+    assert response.get_json()["retry_after"] >= 1
+
+
+@pytest.mark.parametrize("route", ["/api/chat", "/api/chat/stream", "/api/annotate", "/api/correct/batch",
+                                   "/api/session"])
+@pytest.mark.parametrize("body", NOT_OBJECTS)
+def test_body_that_is_not_an_object_is_rejected(route, body):
+    response = flask_app.app.test_client().post(route, json=body)
+
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "The request body must be a JSON object"
+
+
+@pytest.mark.parametrize("route", ["/api/chat", "/api/chat/stream"])
+@pytest.mark.parametrize("message, error", [
+    (None, "Message is required"),
+    ("  ", "Message is required"),
+    (42, "message must be a string"),
+    (["你好"], "message must be a string"),
+])
+def test_chat_message_must_be_a_string(route, message, error):
+    response = flask_app.app.test_client().post(route, json={"message": message})
+
+    assert response.status_code == 400
+    assert response.get_json()["error"] == error
+
+
+@pytest.mark.parametrize("route, body", [
+    ("/api/chat", ["你好"]),
+    ("/api/chat/stream", {"message": 42}),
+    ("/api/annotate", "你好"),
+    ("/api/correct/batch", []),
+    ("/api/session", [1]),
+])
+def test_asgi_rejects_malformed_bodies(route, body):
+    asgi_app = pytest.importorskip("asgi_app")
+
+    async def post():
+        response = await asgi_app.app.test_client().post(route, json=body)
+        return response.status_code
+
+    assert asyncio.run(post()) == 400
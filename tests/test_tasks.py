@@ -0,0 +1,74 @@
+from types import SimpleNamespace
+
+from tasks import TASKS, TaskProfile, TaskStats, load_task_profiles
+
+DEPLOYMENTS = '{"translation": {"deployment": "gpt-4o-mini", "max_tokens": 150}, "correction": "gpt-4o-mini"}'
+
+
+def usage(prompt, completion, cached=0):
+    return SimpleNamespace(prompt_tokens=prompt, completion_tokens=completion,
+                           prompt_tokens_details=SimpleNamespace(cached_tokens=cached))
+
+
+def test_profiles_are_parsed_from_json():
+    profiles = load_task_profiles(
+        '{"translation": "gpt-4o-mini", "topic": {"temperature": 1.0, "max_tokens": 40}, "poetry": "gpt-4"}'
+    )
+
+    assert sorted(profiles) == ["topic", "translation"]
+    assert profiles["translation"].deployment == "gpt-4o-mini"
+    assert profiles["topic"].deployment is None
+    assert load_task_profiles("") == {}
+
+
+def test_profile_overrides_only_what_it_sets():
+    params = {"temperature": 0.7, "max_tokens": 500, "messages": []}
+
+    assert TaskProfile(max_tokens=150).apply(params) == {"temperature": 0.7, "max_tokens": 150, "messages": []}
+    assert params["max_tokens"] == 500
+
+
+def test_counters_per_task():
+    stats = TaskStats()
+    stats.record("chat", 0.2, usage(100, 20, cached=50))
+    stats.record("chat", 0.4, error=True)
+    stats.record_usage("chat", usage(100, 30))
+
+    result = stats.stats({"chat": TaskProfile(deployment="gpt-4")})
+
+    assert list(result) == list(TASKS)
+    assert result["chat"] == {
+        "deployment": "gpt-4",
+        "calls": 2,
+        "errors": 1,
+        "avg_latency_ms": 300,
+        "max_latency_ms": 400,
+        "prompt_tokens": 200,
+        "cached_tokens": 50,
+        "cached_ratio": 0.25,
+        "completion_tokens": 50
+    }
+    assert result["topic"] == {"deployment": None}
+
+
+def test_each_task_goes_to_its_deployment(make_tutor):
+    tutor, server = make_tutor(AZURE_OPENAI_DEPLOYMENT_NAME="gpt-4", AZURE_OPENAI_TASK_DEPLOYMENTS=DEPLOYMENTS)
+
+    tutor.get_conversation_response("我昨天去了商店买东西", [])
+
+    assert server.fake.stats()["by_deployment"] == {"gpt-4": 1, "gpt-4o-mini": 2}
+    tasks = tutor.stats()["tasks"]
+    assert (tasks["chat"]["deployment"], tasks["chat"]["calls"]) == (None, 1)
+    assert (tasks["translation"]["deployment"], tasks["translation"]["calls"]) == ("gpt-4o-mini", 1)
+    assert (tasks["correction"]["deployment"], tasks["correction"]["calls"]) == ("gpt-4o-mini", 1)
+    assert tasks["translation"]["prompt_tokens"] > 0
+    assert "calls" not in tasks["topic"]
+
+
+def test_failed_calls_are_counted_as_errors(make_tutor):
+    tutor, server = make_tutor()
+    server.fake.error_rate = 1.0
+
+    tutor._get_translation("你好")
+
+    assert tutor.stats()["tasks"]["translation"]["errors"] == 1
@@ -0,0 +1,68 @@
+import itertools
+import threading
+import time
+
+from topic_pool import TopicPool
+
+CATEGORIES = ["food", "travel", "music"]
+
+
+class CountingGenerator:
+    def __init__(self):
+        self.calls = 0
+        self._numbers = itertools.count()
+        self._lock = threading.Lock()
+
+    def __call__(self, category):
+        with self._lock:
+            self.calls += 1
+            number = next(self._numbers)
+        return {"topic": f"{category} 话题 {number}", "translation": f"{category} topic {number}"}
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+def test_first_use_generates_one_small_batch():
+    generate = CountingGenerator()
+    pool = TopicPool(CATEGORIES, generate, size=5, low_water=2, batch=2)
+    pool.start()
+    assert wait_for(lambda: pool.stats()["pooled"] >= 2)
+    time.sleep(0.1)
+    # Not a full pool per category, just a batch
+    assert generate.calls == 2
+
+
+def test_pool_is_topped_up_as_topics_are_served():
+    generate = CountingGenerator()
+    pool = TopicPool(CATEGORIES, generate, size=5, low_water=2, batch=2)
+    pool.start()
+    assert wait_for(lambda: pool.stats()["pooled"] == 2)
+
+    served = []
+    for _ in range(6):
+        assert wait_for(lambda: pool.stats()["pooled"] > 0)
+        served.append(pool.pop())
+    assert all(served)
+    assert len({topic["topic"] for topic in served}) == 6
+    time.sleep(0.1)
+    stats = pool.stats()
+    assert stats["pooled"] <= 5
+    # Roughly one generated topic per topic served, plus the buffer
+    assert generate.calls <= len(served) + 5
+
+
+def test_duplicates_are_dropped():
+    pool = TopicPool(CATEGORIES, lambda category: {"topic": "同一个话题", "translation": "same"},
+                     size=5, low_water=2, batch=2)
+    pool.start()
+    assert wait_for(lambda: pool.stats()["generated"] == 1)
+    time.sleep(0.1)
+    assert pool.stats()["pooled"] == 1
+    assert pool.stats()["duplicates_dropped"] >= 1
@@ -0,0 +1,41 @@
+import pytest
+
+from triage import FULL_ANALYSIS, INTERJECTION, SKIP, CorrectionTriage, phrase_key
+
+
+@pytest.mark.parametrize("text, decision, reason", [
+    ("我想去 Beijing", INTERJECTION, "english_words"),
+    ("😀!!", SKIP, "no_chinese"),
+    ("123", SKIP, "no_chinese"),
+    ("好。", SKIP, "single_character"),
+    ("你好！", SKIP, "known_phrase"),
+    ("谢谢 。", SKIP, "known_phrase"),
+    ("我昨天去了商店买东西", FULL_ANALYSIS, "full_analysis"),
+])
+def test_triage_classifies_messages(text, decision, reason):
+    triage = CorrectionTriage()
+
+    assert triage.classify(text) == (decision, reason)
+    assert triage.stats()["upstream_calls_avoided"] == (1 if decision == SKIP else 0)
+
+
+def test_phrase_key_ignores_punctuation_spacing_and_case():
+    assert phrase_key(" 你好， 世界！") == phrase_key("你好世界") == "你好世界"
+    assert phrase_key("OK!") == "ok"
+
+
+def test_custom_phrases_replace_the_bundled_list():
+    triage = CorrectionTriage(known_phrases=frozenset({phrase_key("我很好")}))
+
+    assert triage.classify("我很好！") == (SKIP, "known_phrase")
+    assert triage.classify("你好") == (FULL_ANALYSIS, "full_analysis")
+
+
+def test_skipped_messages_make_no_upstream_call(make_tutor):
+    tutor, server = make_tutor()
+
+    for text in ("你好！", "好", "👍", "谢谢"):
+        assert tutor._corrections(text) is None
+
+    assert server.fake.stats()["requests"] == 0
+    assert tutor.stats()["correction_triage"]["upstream_calls_avoided"] == 4
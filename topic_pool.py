@@ -0,0 +1,141 @@
+"""Pre-generated conversation topics for /api/random-topic.
+
+Topics do not depend on the request, so a background worker keeps a few
+(topic, translation) pairs ready and the endpoint just pops one. The pool
+is topped up on demand, at most `batch` topics at a time, when it drops
+below `low_water`, so it costs roughly one topic per topic served and
+nothing while idle. Each topic is two Azure calls (topic and translation),
+and every process keeps its own pool.
+"""
+
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+
+from triage import phrase_key
+
+
+class TopicPool:
+    """A small bounded topic pool, topped up by a background thread"""
+
+    def __init__(self, categories, generate, size=5, low_water=2, batch=2, seen_limit=2000):
+        # generate(category) returns {"topic": ..., "translation": ...} or raises
+        self.categories = list(categories)
+        self.generate = generate
+        # Topics pooled at most, over all categories
+        self.size = size
+        self.low_water = low_water
+        # Topics generated per top-up
+        self.batch = batch
+        self.seen_limit = seen_limit
+
+        self._pools = {category: deque() for category in self.categories}
+        # Normalized topics already pooled or served, oldest first
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self._refill_needed = threading.Event()
+        self._thread = None
+
+        self.generated = 0
+        self.duplicates = 0
+        self.served = 0
+        self.empty = 0
+        self.errors = 0
+
+    def start(self):
+        """Start the refill worker (once). Safe to call on every request."""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._refill_loop, name="topic-pool", daemon=True)
+            self._thread.start()
+        self._refill_needed.set()
+
+    def pop(self):
+        """Return a pooled topic, or None if every pool is empty"""
+        with self._lock:
+            categories = [c for c in self.categories if self._pools[c]]
+            if not categories:
+                self.empty += 1
+                self._refill_needed.set()
+                return None
+            category = random.choice(categories)
+            topic = self._pools[category].popleft()
+            self.served += 1
+            if self._pooled() < self.low_water:
+                self._refill_needed.set()
+        return topic
+
+    def _pooled(self):
+        # Called with the lock held
+        return sum(len(pool) for pool in self._pools.values())
+
+    def _add(self, category, topic):
+        key = phrase_key(topic["topic"])
+        with self._lock:
+            if not key or key in self._seen:
+                self.duplicates += 1
+                return False
+            self._seen[key] = True
+            while len(self._seen) > self.seen_limit:
+                self._seen.popitem(last=False)
+            self._pools[category].append(topic)
+            self.generated += 1
+            return True
+
+    def _next_category(self):
+        """A category with the fewest pooled topics, or None when the pool is full"""
+        with self._lock:
+            if self._pooled() >= self.size:
+                return None
+            fewest = min(len(pool) for pool in self._pools.values())
+            return random.choice([c for c in self.categories if len(self._pools[c]) == fewest])
+
+    def _refill_loop(self):
+        backoff = 1
+        while True:
+            self._refill_needed.wait(timeout=60)
+            self._refill_needed.clear()
+
+            # A few topics per wake-up; a few extra attempts for duplicates,
+            # but don't spin forever
+            added = 0
+            for _ in range(self.batch * 2):
+                category = self._next_category()
+                if added >= self.batch or category is None:
+                    break
+                try:
+                    topic = self.generate(category)
+                except Exception as e:
+                    print(f"Error refilling topic pool: {e}")
+                    with self._lock:
+                        self.errors += 1
+                    # Back off so an outage doesn't turn into a request storm
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, 60)
+                    continue
+                backoff = 1
+                if self._add(category, topic):
+                    added += 1
+            with self._lock:
+                # Still short after this batch: continue on the next wake-up
+                if added and self._pooled() < self.low_water:
+                    self._refill_needed.set()
+
+    def stats(self):
+        with self._lock:
+            sizes = {c: len(p) for c, p in self._pools.items()}
+        return {
+            "running": self._thread is not None,
+            "size": self.size,
+            "pooled": sum(sizes.values()),
+            "per_category": sizes,
+            "generated": self.generated,
+            "duplicates_dropped": self.duplicates,
+            "served": self.served,
+            "empty": self.empty,
+            "errors": self.errors
+        }
@@ -0,0 +1,80 @@
+"""Local triage for learner messages before the correction call.
+
+Decides, without calling Azure, whether a message needs the full grammar
+analysis, only the English-interjection help, or nothing at all.
+"""
+
+import os
+import re
+import threading
+from collections import Counter
+
+from cache import normalize_text
+
+ENGLISH_WORD_RE = re.compile(r'\b[a-zA-Z]+\b')
+CJK_RE = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]')
+# Whitespace, punctuation, symbols and emoji (everything that is not \w)
+NON_WORD_RE = re.compile(r'[\W_]+')
+
+KNOWN_GOOD_PHRASES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "known_good_phrases.txt")
+
+SKIP = "skip"
+INTERJECTION = "interjection"
+FULL_ANALYSIS = "full_analysis"
+
+
+def phrase_key(text):
+    """Key used for known-phrase lookups: normalized text without punctuation"""
+    return NON_WORD_RE.sub("", normalize_text(text)).lower()
+
+
+def load_known_phrases(path=KNOWN_GOOD_PHRASES_PATH):
+    phrases = set()
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    phrases.add(phrase_key(line))
+    except OSError as e:
+        print(f"Could not load known phrases from {path}: {e}")
+    return frozenset(phrases)
+
+
+class CorrectionTriage:
+    """Classifies messages as skip / interjection / full_analysis and counts the outcomes"""
+
+    def __init__(self, known_phrases=None):
+        self.known_phrases = load_known_phrases() if known_phrases is None else known_phrases
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def classify(self, text):
+        """Returns (decision, reason)"""
+        content = phrase_key(text)
+        
+        if ENGLISH_WORD_RE.search(text):
+            decision, reason = INTERJECTION, "english_words"
+        elif not CJK_RE.search(content):
+            # Only punctuation, emoji, digits or other scripts: nothing to correct
+            decision, reason = SKIP, "no_chinese"
+        elif len(content) == 1:
+            decision, reason = SKIP, "single_character"
+        elif content in self.known_phrases:
+            decision, reason = SKIP, "known_phrase"
+        else:
+            decision, reason = FULL_ANALYSIS, "full_analysis"
+        
+        with self._lock:
+            self._counts[reason] += 1
+        return decision, reason
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        skipped = sum(v for k, v in counts.items() if k in ("no_chinese", "single_character", "known_phrase"))
+        return {
+            "known_phrases": len(self.known_phrases),
+            "decisions": counts,
+            "upstream_calls_avoided": skipped
+        }